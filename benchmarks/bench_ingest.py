@@ -0,0 +1,96 @@
+"""
+
+micro-benchmark of per issue ingest, from an api item to a bson document
+
+usage: python -m benchmarks.bench_ingest
+"""
+from datetime import datetime
+import timeit
+import tracemalloc
+
+from rysolv_monitor.crawler import RysolvCrawler
+from rysolv_monitor.database import RysolvDatabase
+from rysolv_monitor.types import Issue
+
+ITEM = {
+    "attempting": ["a", "b"],
+    "body": "Parser crashes on long input " * 8,
+    "comments": 2,
+    "createdDate": "2020-12-21T09:31:12.104Z",
+    "fundedAmount": 12.5,
+    "id": "49e9f746-c265-447f-ae66-4fbbeb910ab0",
+    "language": ["python", "c++"],
+    "modifiedDate": "2020-12-23T18:00:00.417Z",
+    "name": "Fix crash (segfault) in parser_v2.c",
+    "open": True,
+    "organizationId": "2c8f4f2e-5a7e-4f2b-9d4a-1b7a3c3e9e11",
+    "organizationName": "rysolv.com",
+    "organizationVerified": True,
+    "rep": 25,
+    "repo": "https://github.com/rysolv/rysolv",
+    "type": "bug",
+    "watching": [],
+}
+
+
+class DictIssue(dict):
+    """
+
+    previous representation
+    """
+
+
+def ingest_previous(item: dict):
+    """
+
+    previous ingest, strptime dates and a dict subclass
+    """
+    item = dict(item)
+    item["createdDate"] = datetime.strptime(item["createdDate"], RysolvCrawler.DATE_FORMAT)
+    item["modifiedDate"] = datetime.strptime(item["modifiedDate"], RysolvCrawler.DATE_FORMAT)
+    _issue = DictIssue(item)
+    return _issue, RysolvDatabase.content_hash(_issue)
+
+
+def ingest(item: dict):
+    """
+
+    current ingest
+    """
+    item = dict(item)
+    item["createdDate"] = RysolvCrawler.convert_to_datetime(item["createdDate"])
+    item["modifiedDate"] = RysolvCrawler.convert_to_datetime(item["modifiedDate"])
+    _issue = Issue(item)
+    return _issue, RysolvDatabase.content_hash(_issue.to_document())
+
+
+def _memory(factory, count: int = 10000) -> float:
+    tracemalloc.start()
+    _items = [factory(dict(ITEM)) for _ in range(count)]
+    _size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del _items
+    return _size / count
+
+
+def main(number: int = 20000) -> None:
+    """
+
+    print time per issue and memory per issue object of each case
+    """
+    cases = [
+        ("parse dates previous", lambda: datetime.strptime(ITEM["modifiedDate"],
+                                                           RysolvCrawler.DATE_FORMAT)),
+        ("parse dates", lambda: RysolvCrawler.convert_to_datetime(ITEM["modifiedDate"])),
+        ("ingest previous", lambda: ingest_previous(ITEM)),
+        ("ingest", lambda: ingest(ITEM)),
+    ]
+    for name, func in cases:
+        _best = min(timeit.repeat(func, number=number, repeat=3)) / number
+        print(f"{name:<25} {_best * 1e6:8.3f} us")
+    print(f"{'issue object previous':<25} {_memory(DictIssue):8.0f} bytes")
+    print(f"{'issue object':<25} {_memory(Issue):8.0f} bytes")
+
+
+if __name__ == "__main__":
+    main()
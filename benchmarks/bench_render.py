@@ -0,0 +1,91 @@
+"""
+
+micro-benchmark of MarkdownV2 rendering
+
+usage: python -m benchmarks.bench_render
+"""
+import re
+import timeit
+
+from rysolv_monitor.render import ISSUE_CACHE, render_issue
+from rysolv_monitor.utils import escape, MARKDOWN_RESERVED
+
+TEXT = "Fix crash (segfault) in parser_v2.c when input > 4096 bytes! See #42 [urgent]"
+ISSUE = {
+    "id": "49e9f746-c265-447f-ae66-4fbbeb910ab0",
+    "type": "bug",
+    "organizationName": "rysolv.com",
+    "name": TEXT,
+    "language": ["python", "c++"],
+    "fundedAmount": 12.5,
+    "comments": 2,
+    "attempting": ["a", "b"],
+    "repo": "https://github.com/rysolv/rysolv",
+    "modifiedDate": "2020-12-23 18:00:00.417000",
+}
+
+
+def chained_escape(text: str) -> str:
+    """
+
+    previous implementation, incomplete
+    """
+    return text.replace("-", r"\-") \
+            .replace("(", r"\(") \
+            .replace(")", r"\)") \
+            .replace("!", r"\!") \
+            .replace(".", r"\.") \
+            .replace("+", r"\+") \
+            .replace("=", r"\=") \
+            .replace("_", r"\_")
+
+
+ESCAPE_TABLE = str.maketrans({_char: "\\" + _char for _char in MARKDOWN_RESERVED})
+ESCAPE_REGEX = re.compile("([" + re.escape(MARKDOWN_RESERVED) + "])")
+
+
+def translate_escape(text: str) -> str:
+    """
+
+    single pass with a translate table
+    """
+    return text.translate(ESCAPE_TABLE)
+
+
+def regex_escape(text: str) -> str:
+    """
+
+    single pass with a compiled regex
+    """
+    return ESCAPE_REGEX.sub(lambda match: "\\" + match.group(), text)
+
+
+def _render_uncached():
+    ISSUE_CACHE.clear()
+    return render_issue(ISSUE)
+
+
+def main(number: int = 100000) -> None:
+    """
+
+    print time per call of each case
+    """
+    long_text = TEXT * 30
+    cases = [
+        ("escape previous", lambda: chained_escape(TEXT)),
+        ("escape translate", lambda: translate_escape(TEXT)),
+        ("escape regex", lambda: regex_escape(TEXT)),
+        ("escape", lambda: escape(TEXT)),
+        ("escape long translate", lambda: translate_escape(long_text)),
+        ("escape long regex", lambda: regex_escape(long_text)),
+        ("escape long", lambda: escape(long_text)),
+        ("render issue uncached", _render_uncached),
+        ("render issue cached", lambda: render_issue(ISSUE)),
+    ]
+    for name, func in cases:
+        _best = min(timeit.repeat(func, number=number, repeat=3)) / number
+        print(f"{name:<25} {_best * 1e6:8.3f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+
+stand-in of the rysolv graphql api serving a seeded synthetic catalogue
+"""
+from typing import Dict, List
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime, timedelta
+from multiprocessing import Queue
+from threading import Event, Lock, Thread
+import json
+import random
+import re
+import uuid
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+LANGUAGES = ["python", "javascript", "c++", "go", "rust", "java", "ruby", "typescript"]
+COMMENT_QUERY = re.compile(r'(c\d+): getIssueComments\(issueId: "([^"]+)"\)')
+
+
+def _format_date(date: datetime) -> str:
+    return date.strftime(DATE_FORMAT)[:-4] + "Z"
+
+
+class Catalogue:
+    """
+
+    Catalogue class, synthetic issues and comments, a fraction of issues
+    gets new comments on every churn
+    """
+    def __init__(self, size: int, seed: int = 0, comments: int = 3):
+        self._random = random.Random(seed)
+        self._lock = Lock()
+        self._now = datetime(2021, 1, 1)
+        self.issues: List[Dict] = []
+        self.comments: Dict[str, List[Dict]] = {}
+        for _index in range(size):
+            _issue_id = str(uuid.UUID(int=self._random.getrandbits(128), version=4))
+            _created = self._now - timedelta(minutes=self._random.randint(1, 500000))
+            self.issues.append({
+                "attempting": [],
+                "body": f"Issue body {_index} " * 8,
+                "comments": 0,
+                "createdDate": _format_date(_created),
+                "fundedAmount": self._random.choice([0, 0, 0, 10, 25.5, 100]),
+                "id": _issue_id,
+                "language": self._random.sample(LANGUAGES, 2),
+                "modifiedDate": _format_date(_created),
+                "name": f"Fix crash (segfault) #{_index} in parser_v2.c!",
+                "open": self._random.random() > 0.2,
+                "organizationId": str(uuid.UUID(int=self._random.getrandbits(128), version=4)),
+                "organizationName": f"org-{_index % 97}.com",
+                "organizationVerified": bool(_index % 2),
+                "rep": 25,
+                "repo": f"https://github.com/org-{_index % 97}/repo-{_index % 1013}",
+                "type": self._random.choice(["bug", "feature"]),
+                "watching": [],
+            })
+            self.comments[_issue_id] = []
+            for _ in range(self._random.randint(0, 2 * comments)):
+                self._add_comment(self.issues[-1])
+
+    def _add_comment(self, issue: Dict) -> None:
+        _comments = self.comments[issue["id"]]
+        self._now += timedelta(seconds=1)
+        _comments.append({
+            "body": f"Comment {len(_comments)} on {issue['name']}",
+            "createdDate": _format_date(self._now),
+            "githubUrl": None,
+            "isGithubComment": False,
+            "profilePic": "https://rysolv.s3.us-east-2.amazonaws.com/defaultUser.png",
+            "userId": str(self._random.randint(1, 5000)),
+            "username": f"user_{self._random.randint(1, 5000)}",
+        })
+        issue["comments"] = len(_comments)
+        issue["modifiedDate"] = _format_date(self._now)
+
+    def churn(self, ratio: float) -> List[str]:
+        """
+
+        add a comment to a random sample of issues
+        :param ratio: fraction of issues changed
+        :return: changed issue ids
+        """
+        with self._lock:
+            _issues = self._random.sample(self.issues, int(len(self.issues) * ratio))
+            for _issue in _issues:
+                self._add_comment(_issue)
+            return [_issue["id"] for _issue in _issues]
+
+    def issues_body(self) -> bytes:
+        """
+
+        getIssues response body
+        :return:
+        """
+        with self._lock:
+            return json.dumps({"data": {"getIssues": {"__typename": "IssueArray",
+                                                      "issues": self.issues}}}).encode("utf-8")
+
+    def comments_body(self, query: str) -> bytes:
+        """
+
+        aliased getIssueComments response body
+        :param query:
+        :return:
+        """
+        with self._lock:
+            return json.dumps({"data": {_alias: self.comments.get(_issue_id)
+                                        for _alias, _issue_id in COMMENT_QUERY.findall(query)}}
+                              ).encode("utf-8")
+
+
+class _GraphQLHandler(BaseHTTPRequestHandler):
+    """
+
+    _GraphQLHandler class
+    """
+    protocol_version = "HTTP/1.1"
+    catalogue: Catalogue = None
+
+    def do_POST(self): # pylint: disable=invalid-name
+        """
+
+        answer getIssues and getIssueComments queries, /churn changes issues
+        """
+        _request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.path == "/churn":
+            _changed = self.catalogue.churn(_request["ratio"])
+            _body = json.dumps([{"issue_id": _issue_id,
+                                 "comment": self.catalogue.comments[_issue_id][-1]}
+                                for _issue_id in _changed]).encode("utf-8")
+        elif "getIssues" in _request["query"]:
+            _body = self.catalogue.issues_body()
+        else:
+            _body = self.catalogue.comments_body(_request["query"])
+        self._reply(_body)
+
+    def do_GET(self): # pylint: disable=invalid-name
+        """
+
+        /ids lists issue ids
+        """
+        _ids = [_issue["id"] for _issue in self.catalogue.issues]
+        self._reply(json.dumps(_ids).encode("utf-8"))
+
+    def _reply(self, body: bytes) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args): # pylint: disable=arguments-differ
+        pass
+
+
+def start_graphql_server(catalogue: Catalogue, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+
+    serve catalogue on an ephemeral port from a daemon thread
+    :param catalogue:
+    :param host:
+    :return:
+    """
+    _handler = type("GraphQLHandler", (_GraphQLHandler,), {"catalogue": catalogue})
+    _server = ThreadingHTTPServer((host, 0), _handler)
+    _server.daemon_threads = True
+    Thread(target=_server.serve_forever, name="fake-graphql", daemon=True).start()
+    return _server
+
+
+def serve(size: int, seed: int, ports: Queue) -> None:
+    """
+
+    build a catalogue and serve it, meant to run in its own process so the
+    catalogue doesn't count in the benchmarked process memory
+    :param size:
+    :param seed:
+    :param ports: the listening port is put there
+    :return:
+    """
+    _server = start_graphql_server(Catalogue(size, seed=seed))
+    ports.put(_server.server_port)
+    Event().wait()
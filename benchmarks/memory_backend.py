@@ -0,0 +1,247 @@
+"""
+
+in-memory stand-in of the pymongo database API used by RysolvDatabase,
+so the benchmarks exercise the real write path without a mongod
+"""
+from typing import Dict, List, Optional, Tuple
+from itertools import count
+from threading import RLock
+
+from bson.son import SON
+from pymongo import IndexModel
+from pymongo.errors import CollectionInvalid
+from pymongo.results import BulkWriteResult, DeleteResult, UpdateResult
+
+
+def _matches(document: Dict, _filter: Optional[Dict]) -> bool:
+    for _key, _value in (_filter or {}).items():
+        if isinstance(_value, dict) and "$exists" in _value:
+            if (_key in document) != _value["$exists"]:
+                return False
+        elif isinstance(_value, dict) and "$in" in _value:
+            if document.get(_key) not in _value["$in"]:
+                return False
+        elif document.get(_key) != _value:
+            return False
+    return True
+
+
+def _project(document: Dict, projection: Optional[Dict]) -> Dict:
+    if not projection:
+        return dict(document)
+    _included = [_key for _key, _value in projection.items() if _value and _key != "_id"]
+    if _included:
+        _result = {_key: document[_key] for _key in _included if _key in document}
+        if projection.get("_id", 1):
+            _result["_id"] = document["_id"]
+        return _result
+    return {_key: _value for _key, _value in document.items() if projection.get(_key, 1)}
+
+
+class MemoryCollection:
+    """
+
+    MemoryCollection class, equality lookups are served from lazily built
+    hash indexes
+    """
+    _ids = count(1)
+
+    def __init__(self, name: str, options: Optional[Dict] = None):
+        self.name = name
+        self.options = options or {}
+        # collections exist once created or written to, like in mongodb
+        self.exists = options is not None
+        self._documents: Dict[int, Dict] = {}
+        self._indexes: Dict[Tuple[str, ...], Dict[Tuple, int]] = {}
+        self._index_documents = {"_id_": {"name": "_id_", "key": SON([("_id", 1)])}}
+        self._lock = RLock()
+
+    # index management
+    def create_index(self, keys: List[Tuple[str, int]], **kwargs) -> str:
+        """
+
+        create index
+        """
+        return self.create_indexes([IndexModel(keys, **kwargs)])[0]
+
+    def create_indexes(self, indexes: List[IndexModel]) -> List[str]:
+        """
+
+        create indexes
+        """
+        self.exists = True
+        for _index in indexes:
+            self._index_documents[_index.document["name"]] = dict(_index.document)
+        return [_index.document["name"] for _index in indexes]
+
+    def list_indexes(self) -> List[Dict]:
+        """
+
+        list indexes
+        """
+        return list(self._index_documents.values())
+
+    def drop_index(self, index) -> None:
+        """
+
+        drop index by name or keys
+        """
+        _name = index if isinstance(index, str) else \
+            "_".join(f"{_key}_{_direction}" for _key, _direction in index)
+        self._index_documents.pop(_name, None)
+
+    # reads
+    def _lookup(self, _filter: Dict) -> List[Dict]:
+        if _filter and all(not isinstance(_value, dict) for _value in _filter.values()):
+            _fields = tuple(sorted(_filter))
+            _index = self._indexes.get(_fields)
+            if _index is None:
+                _index = {tuple(_document.get(_field) for _field in _fields): _id
+                          for _id, _document in self._documents.items()}
+                self._indexes[_fields] = _index
+            _id = _index.get(tuple(_filter[_field] for _field in _fields))
+            return [self._documents[_id]] if _id is not None else []
+        return [_document for _document in self._documents.values()
+                if _matches(_document, _filter)]
+
+    def find(self, _filter: Optional[Dict] = None, projection: Optional[Dict] = None):
+        with self._lock:
+            return [_project(_document, projection) for _document in self._lookup(_filter or {})]
+
+    def find_one(self, _filter: Optional[Dict] = None, projection: Optional[Dict] = None):
+        _documents = self.find(_filter, projection)
+        return _documents[0] if _documents else None
+
+    def distinct(self, key: str) -> List:
+        with self._lock:
+            return list({_document[key] for _document in self._documents.values()
+                         if key in _document})
+
+    def count_documents(self, _filter: Dict) -> int:
+        with self._lock:
+            return len(self._lookup(_filter))
+
+    # writes
+    def _insert(self, document: Dict) -> int:
+        self.exists = True
+        _id = next(self._ids)
+        document["_id"] = _id
+        self._documents[_id] = document
+        for _fields, _index in self._indexes.items():
+            _index[tuple(document.get(_field) for _field in _fields)] = _id
+        return _id
+
+    def _update(self, _filter: Dict, update: Dict, upsert: bool) -> Tuple[int, int, Optional[int]]:
+        _documents = self._lookup(_filter)
+        if not _documents:
+            if not upsert:
+                return 0, 0, None
+            _document = dict(_filter)
+            _document.update(update.get("$setOnInsert", {}))
+            _document.update(update.get("$set", {}))
+            return 0, 0, self._insert(_document)
+        _document = _documents[0]
+        _changes = update.get("$set", {})
+        _modified = any(_document.get(_key) != _value for _key, _value in _changes.items())
+        _document.update(_changes)
+        return 1, int(_modified), None
+
+    def update_one(self, _filter: Dict, update: Dict, upsert: bool = False) -> UpdateResult:
+        with self._lock:
+            _matched, _modified, _upserted_id = self._update(_filter, update, upsert)
+        return UpdateResult({"n": _matched or int(_upserted_id is not None),
+                             "nModified": _modified,
+                             "upserted": _upserted_id}, True)
+
+    def bulk_write(self, operations: List, ordered: bool = True) -> BulkWriteResult: # pylint: disable=unused-argument
+        _result = {"nMatched": 0, "nModified": 0, "nUpserted": 0, "nInserted": 0,
+                   "nRemoved": 0, "upserted": [], "writeErrors": [], "writeConcernErrors": []}
+        with self._lock:
+            for _index, _operation in enumerate(operations):
+                # pylint: disable=protected-access
+                _matched, _modified, _upserted_id = self._update(_operation._filter,
+                                                                 _operation._doc,
+                                                                 _operation._upsert)
+                _result["nMatched"] += _matched
+                _result["nModified"] += _modified
+                if _upserted_id is not None:
+                    _result["nUpserted"] += 1
+                    _result["upserted"].append({"index": _index, "_id": _upserted_id})
+        return BulkWriteResult(_result, True)
+
+    def delete_one(self, _filter: Dict) -> DeleteResult:
+        with self._lock:
+            _documents = self._lookup(_filter)[:1]
+            self._delete(_documents)
+        return DeleteResult({"n": len(_documents)}, True)
+
+    def with_options(self, **kwargs) -> "MemoryCollection": # pylint: disable=unused-argument
+        """
+
+        write concerns mean nothing in memory, same collection
+        """
+        return self
+
+    def delete_many(self, _filter: Dict) -> DeleteResult:
+        with self._lock:
+            _documents = self._lookup(_filter)
+            self._delete(_documents)
+        return DeleteResult({"n": len(_documents)}, True)
+
+    def _delete(self, documents: List[Dict]) -> None:
+        for _document in documents:
+            del self._documents[_document["_id"]]
+        if documents:
+            self._indexes = {}
+
+
+class MemoryDatabase:
+    """
+
+    MemoryDatabase class
+    """
+    def __init__(self):
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    def create_collection(self, name: str, **kwargs) -> MemoryCollection:
+        """
+
+        create collection, options are kept but validators are not enforced
+        """
+        _collection = self[name]
+        if _collection.exists:
+            raise CollectionInvalid(f"collection {name} already exists")
+        _collection.exists = True
+        _collection.options = kwargs
+        return _collection
+
+    def list_collections(self, filter: Optional[Dict] = None) -> List[Dict]: # pylint: disable=redefined-builtin
+        """
+
+        list collections, filtered by name
+        """
+        return [{"name": _name, "options": _collection.options}
+                for _name, _collection in self._collections.items()
+                if _collection.exists and _matches({"name": _name}, filter)]
+
+    def command(self, name: str, value, **kwargs) -> Dict:
+        """
+
+        collMod only
+        """
+        if name != "collMod":
+            raise NotImplementedError(name)
+        self[value].options.update(kwargs)
+        return {"ok": 1}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(name)
+        return self._collections[name]
+
+    def drop_collection(self, name: str) -> None:
+        """
+
+        drop collection
+        """
+        self._collections.pop(name, None)
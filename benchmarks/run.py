@@ -0,0 +1,279 @@
+"""
+
+offline benchmark of the crawl -> store -> notify pipeline
+
+A fake graphql server serves a synthetic catalogue, the crawler stores it
+in an in memory backend, or a local mongod with --db-url, and notifications
+of changed issues are fanned out to watchers through the dispatcher and a
+fake telegram api. The server and every size run in their own process so
+peak RSS is the monitor's, per size.
+
+usage: python -m benchmarks.run --sizes 1000,10000,50000 --output bench.json
+       python -m benchmarks.run --compare bench.json
+"""
+from typing import Dict, List, Optional
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Process, Queue
+from threading import Lock
+import json
+import logging
+import platform
+import random
+import resource
+import statistics
+import sys
+import time
+
+from pymongo import MongoClient
+import requests
+
+from rysolv_monitor import __version__
+from rysolv_monitor.crawler import RysolvCrawler
+from rysolv_monitor.database import RysolvCollections, RysolvDatabase
+from rysolv_monitor.dispatcher import DispatcherOptions, NotificationDispatcher
+from rysolv_monitor.metrics import BULK_WRITE_DOCUMENTS, BULK_WRITE_SECONDS
+from rysolv_monitor.render import render_issue_update
+from rysolv_monitor.scheduler import PollScheduler
+from rysolv_monitor.subscribers import SubscriberIndex
+from rysolv_monitor.transport import RysolvTransport, TransportOptions
+
+from benchmarks.fake_graphql import serve
+from benchmarks.memory_backend import MemoryDatabase
+
+# metric name -> True when higher is better
+METRICS = {
+    "cold_cycle_seconds": False,
+    "warm_cycle_seconds": False,
+    "writes_per_second": True,
+    "notifications_per_second": True,
+    "peak_rss_mb": False,
+}
+
+
+class FakeTelegram:
+    """
+
+    FakeTelegram class, stand-in of Bot.send_message with a fixed latency
+    """
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.sent = 0
+        self._lock = Lock()
+
+    def send(self, user_id: int, text: str) -> None: # pylint: disable=unused-argument
+        """
+
+        send message
+        :param user_id:
+        :param text:
+        :return:
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.sent += 1
+
+
+def _written() -> Dict[str, float]:
+    _collections = [_name for _name in RysolvCollections.__members__]
+    return {
+        "documents": sum(BULK_WRITE_DOCUMENTS.value(collection=_name, result=_result)
+                         for _name in _collections for _result in ("upserted", "modified")),
+        "seconds": sum(BULK_WRITE_SECONDS.sum(collection=_name) for _name in _collections),
+    }
+
+
+def _open_database(db_url: Optional[str], size: int):
+    if db_url is None:
+        return MemoryDatabase()
+    _client = MongoClient(db_url)
+    _name = f"rysolv_bench_{size}"
+    _client.drop_database(_name)
+    return _client[_name]
+
+
+def run_size(size: int,
+             port: int,
+             cycles: int,
+             churn: float,
+             users: int,
+             watches: int,
+             latency: float,
+             db_url: Optional[str] = None,
+             seed: int = 0) -> Dict:
+    """
+
+    benchmark a catalogue of size issues
+    :param size: number of issues
+    :param port: port of the fake graphql server
+    :param cycles: warm cycles after the initial one
+    :param churn: fraction of issues changed between cycles
+    :param users: registered users
+    :param watches: watched issues per user
+    :param latency: fake telegram send latency in seconds
+    :param db_url: local mongod, in memory backend when None
+    :param seed:
+    :return: result
+    """
+    _logger = logging.getLogger("benchmark")
+    _url = f"http://127.0.0.1:{port}"
+    _random = random.Random(seed)
+    _database = RysolvDatabase(_open_database(db_url, size))
+    _issue_ids = requests.get(f"{_url}/ids").json()
+    for _user_id in range(users):
+        _database.update_user(_user_id)
+        for _issue_id in _random.sample(_issue_ids, min(watches, size)):
+            _database.update_watch_issue(_user_id, _issue_id)
+    del _issue_ids
+    _subscribers = SubscriberIndex()
+    _subscribers.bootstrap(_database)
+    _transport = RysolvTransport(_logger, TransportOptions(pool_size=9), url=f"{_url}/graphql")
+    _crawler = RysolvCrawler(_database,
+                             _logger,
+                             transport=_transport,
+                             scheduler=PollScheduler(request_budget=1e9))
+    _telegram = FakeTelegram(latency)
+    _dispatcher = NotificationDispatcher(_telegram.send,
+                                         _logger,
+                                         DispatcherOptions(global_rate=1e9, chat_rate=1e9))
+    _dispatcher.start()
+    _cycles = []
+    _notify_time = 0.0
+    _changed: List[Dict] = []
+    try:
+        for _cycle in range(cycles + 1):
+            if _cycle:
+                _changed = requests.post(f"{_url}/churn", json={"ratio": churn}).json()
+            _before = _written()
+            _stats = _crawler.crawl()
+            _after = _written()
+            _stats["documents"] = _after["documents"] - _before["documents"]
+            _stats["write_seconds"] = _after["seconds"] - _before["seconds"]
+            _start = time.monotonic()
+            _sent = _telegram.sent
+            for _item in _changed:
+                _text = render_issue_update(_item["issue_id"], comments=[_item["comment"]])
+                for _user_id in _subscribers.watchers(_item["issue_id"]):
+                    _dispatcher.submit(_user_id, _text)
+            _dispatcher.join()
+            _stats["notifications"] = _telegram.sent - _sent
+            _stats["notify_seconds"] = time.monotonic() - _start
+            _notify_time += _stats["notify_seconds"]
+            _cycles.append(_stats)
+    finally:
+        _dispatcher.stop()
+        _transport.close()
+    _warm = _cycles[1:] or _cycles
+    _documents = sum(_stats["documents"] for _stats in _cycles)
+    _write_seconds = sum(_stats["write_seconds"] for _stats in _cycles)
+    _notifications = sum(_stats["notifications"] for _stats in _cycles)
+    return {
+        "size": size,
+        "cycles": _cycles,
+        "cold_cycle_seconds": _cycles[0]["duration"],
+        "warm_cycle_seconds": statistics.median(_stats["duration"] for _stats in _warm),
+        "writes_per_second": _documents / _write_seconds if _write_seconds else 0.0,
+        "notifications_per_second": _notifications / _notify_time if _notify_time else 0.0,
+        # kilobytes on linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def compare(previous: Dict, current: Dict, threshold: float) -> List[str]:
+    """
+
+    compare two reports
+    :param previous:
+    :param current:
+    :param threshold: relative change considered as a regression
+    :return: regressions
+    """
+    _previous = {_result["size"]: _result for _result in previous["results"]}
+    _regressions = []
+    print(f"{'size':>8} {'metric':<26} {'previous':>12} {'current':>12} {'change':>8}")
+    for _result in current["results"]:
+        _before = _previous.get(_result["size"])
+        if _before is None:
+            continue
+        for _metric, _higher_is_better in METRICS.items():
+            _old, _new = _before[_metric], _result[_metric]
+            _change = (_new - _old) / _old if _old else 0.0
+            _regressed = (-_change if _higher_is_better else _change) > threshold
+            print(f"{_result['size']:>8} {_metric:<26} {_old:>12.3f} {_new:>12.3f} "
+                  f"{_change:>+7.1%}{' !' if _regressed else ''}")
+            if _regressed:
+                _regressions.append(f"{_metric} of size {_result['size']}")
+    return _regressions
+
+
+def main() -> None:
+    """
+
+    main function
+    :return:
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--sizes", type=str, default="1000,10000,50000")
+    parser.add_argument("--cycles", type=int, default=3, help="Warm cycles per size")
+    parser.add_argument("--churn", type=float, default=0.01,
+                        help="Fraction of issues changed between cycles")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--watches", type=int, default=20, help="Watched issues per user")
+    parser.add_argument("--telegram-latency", type=float, default=0.0)
+    parser.add_argument("--db-url", type=str, default=None,
+                        help="Local mongod, in memory backend by default")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default=None, help="Write JSON report")
+    parser.add_argument("--compare", type=str, default=None,
+                        help="Previous JSON report, exit 1 on regression")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    _results = []
+    for _size in [int(_size) for _size in args.sizes.split(",")]:
+        _ports = Queue()
+        _server = Process(target=serve, args=(_size, args.seed, _ports), daemon=True)
+        _server.start()
+        try:
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                _result = executor.submit(run_size,
+                                          _size,
+                                          _ports.get(),
+                                          args.cycles,
+                                          args.churn,
+                                          args.users,
+                                          args.watches,
+                                          args.telegram_latency,
+                                          args.db_url,
+                                          args.seed).result()
+        finally:
+            _server.terminate()
+        print(f"size {_size}: cold {_result['cold_cycle_seconds']:.2f}s, "
+              f"warm {_result['warm_cycle_seconds']:.2f}s, "
+              f"{_result['writes_per_second']:.0f} writes/s, "
+              f"{_result['notifications_per_second']:.0f} notifications/s, "
+              f"peak rss {_result['peak_rss_mb']:.0f}MB")
+        _results.append(_result)
+    _report = {
+        "version": __version__,
+        "python": platform.python_version(),
+        "backend": "mongodb" if args.db_url else "memory",
+        "parameters": {_key: _value for _key, _value in vars(args).items()
+                       if _key not in ("output", "compare", "threshold")},
+        "results": _results,
+    }
+    if args.output:
+        with open(args.output, "w") as _file:
+            json.dump(_report, _file, indent=2)
+    if args.compare:
+        with open(args.compare, "r") as _file:
+            _regressions = compare(json.load(_file), _report, args.threshold)
+        if _regressions:
+            print("Regressions: " + ", ".join(_regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
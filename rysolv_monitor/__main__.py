@@ -3,24 +3,70 @@
 main entrypoint
 """
 from threading import Thread
-from argparse import ArgumentParser
+from argparse import ArgumentParser, Namespace
+from logging import Logger
 import os
 import logging
 
 from pymongo import MongoClient
+from pymongo.write_concern import WriteConcern
 
-from rysolv_monitor.crawler import RysolvCrawler
-from rysolv_monitor.database import  RysolvDatabase
-from rysolv_monitor.telegram_bot import RysolvBot
+from rysolv_monitor.crawler import CrawlerOptions, RysolvCrawler
+from rysolv_monitor.database import RysolvDatabase, WriteOptions
+from rysolv_monitor.schema import SchemaMismatch
+from rysolv_monitor.telegram_bot import BotOptions, RysolvBot
+from rysolv_monitor.transport import RysolvTransport, TransportOptions
+from rysolv_monitor.outbox import sender_partitions
+from rysolv_monitor.leader import LeaderLease
+from rysolv_monitor.digest import DigestFlusher
+from rysolv_monitor.snapshot import SnapshotRecorder, SnapshotReplayer
+from rysolv_monitor.scheduler import PollScheduler, SchedulerOptions
+from rysolv_monitor.metrics import start_metrics_server
 from rysolv_monitor.logger import configure_logger
 
-def main() -> None:
+def _write_concern(value: str) -> WriteConcern:
     """
 
-    main function
+    write concern from a w option, a number of nodes or a tag like majority
+    :param value:
+    :return:
+    """
+    return WriteConcern(w=int(value) if value.isdigit() else value)
+
+def _env_flag(name: str) -> bool:
+    """
+
+    boolean environment variable, set by 1, true or yes
+    :param name:
+    :return:
+    """
+    return os.getenv(name, "").lower() in ("1", "true", "yes")
+
+def build_parser() -> ArgumentParser:
+    """
+
+    command line parser, every option defaults to its environment variable
     :return:
     """
     parser = ArgumentParser()
+    parser.add_argument("--mode",
+                        help="all runs every component, bot everything but outbox senders, "
+                             "sender only an outbox sender",
+                        choices=["all", "bot", "sender"],
+                        default=os.getenv("MODE", "all"))
+    parser.add_argument("--sender-index",
+                        help="Index of this sender among --sender-count senders",
+                        type=int,
+                        default=int(os.getenv("SENDER_INDEX", "0")))
+    parser.add_argument("--sender-count",
+                        help="Number of sender processes sharing outbox partitions",
+                        type=int,
+                        default=int(os.getenv("SENDER_COUNT", "1")))
+    parser.add_argument("--leader-ttl",
+                        help="Seconds a standby replica waits for a dead crawler leader "
+                             "before taking over, 0 disables leader election",
+                        type=float,
+                        default=float(os.getenv("LEADER_TTL", "10")))
     parser.add_argument("--verbose",
                         help="Set log level to DEBUG",
                         action="store_true",
@@ -34,26 +80,216 @@ def main() -> None:
     parser.add_argument("--db-name",
                         type=str,
                         default=os.getenv("DB_NAME", "rysolv"))
+    parser.add_argument("--db-max-pool-size",
+                        help="Max connections of the mongodb client pool",
+                        type=int,
+                        default=int(os.getenv("DB_MAX_POOL_SIZE", "20")))
+    parser.add_argument("--db-timeout",
+                        help="Server selection, connect and socket timeout of mongodb in seconds",
+                        type=float,
+                        default=float(os.getenv("DB_TIMEOUT", "10")))
+    parser.add_argument("--db-write-retries",
+                        help="Number of retries of a write failed with a transient error",
+                        type=int,
+                        default=int(os.getenv("DB_WRITE_RETRIES", "3")))
+    parser.add_argument("--write-batch-size",
+                        help="Number of documents per unordered bulk write",
+                        type=int,
+                        default=int(os.getenv("WRITE_BATCH_SIZE", "500")))
+    parser.add_argument("--crawl-write-concern",
+                        help="Write concern w of issues, comments, fingerprints and resume tokens",
+                        type=str,
+                        default=os.getenv("CRAWL_WRITE_CONCERN", "1"))
+    parser.add_argument("--user-write-concern",
+                        help="Write concern w of every other collection: subscriptions, "
+                             "changelogs, outbox, leases, digests and pending updates, "
+                             "lowering it weakens leader election and notification delivery",
+                        type=str,
+                        default=os.getenv("USER_WRITE_CONCERN", "majority"))
+    parser.add_argument("--crawler-workers",
+                        help="Number of concurrent comment requests",
+                        type=int,
+                        default=int(os.getenv("CRAWLER_WORKERS", "8")))
+    parser.add_argument("--comments-batch-size",
+                        help="Number of issues per comments query",
+                        type=int,
+                        default=int(os.getenv("COMMENTS_BATCH_SIZE", "20")))
+    parser.add_argument("--issues-chunk-size",
+                        help="Number of issues stored and refreshed at once during a sweep",
+                        type=int,
+                        default=int(os.getenv("ISSUES_CHUNK_SIZE", "500")))
+    parser.add_argument("--sleep-time",
+                        help="Seconds between two issues sweeps",
+                        type=int,
+                        default=int(os.getenv("SLEEP_TIME", "30")))
+    parser.add_argument("--request-budget",
+                        help="Max rysolv api requests per minute",
+                        type=float,
+                        default=float(os.getenv("REQUEST_BUDGET", "60")))
+    parser.add_argument("--metrics-port",
+                        help="Serve prometheus metrics on this port, 0 to disable",
+                        type=int,
+                        default=int(os.getenv("METRICS_PORT", "0")))
+    parser.add_argument("--metrics-host",
+                        type=str,
+                        default=os.getenv("METRICS_HOST", "127.0.0.1"))
+    parser.add_argument("--http-timeout",
+                        help="Read timeout of rysolv api requests in seconds",
+                        type=float,
+                        default=float(os.getenv("HTTP_TIMEOUT", "30")))
+    parser.add_argument("--http-retries",
+                        help="Number of retries of a failed rysolv api request",
+                        type=int,
+                        default=int(os.getenv("HTTP_RETRIES", "4")))
+    parser.add_argument("--notifier-workers",
+                        help="Number of telegram sender threads",
+                        type=int,
+                        default=int(os.getenv("NOTIFIER_WORKERS", "4")))
+    parser.add_argument("--update-window",
+                        help="Seconds updates of an issue are merged before notifying",
+                        type=float,
+                        default=float(os.getenv("UPDATE_WINDOW", "10")))
+    parser.add_argument("--record",
+                        help="Record rysolv api exchanges to this gzipped snapshot",
+                        type=str,
+                        default=os.getenv("RECORD"))
+    parser.add_argument("--replay",
+                        help="Replay rysolv api exchanges from this snapshot instead of "
+                             "the network",
+                        type=str,
+                        default=os.getenv("REPLAY"))
+    parser.add_argument("--replay-speed",
+                        help="Time compression of the replay, 0 to replay as fast as possible",
+                        type=float,
+                        default=float(os.getenv("REPLAY_SPEED", "0")))
+    parser.add_argument("--check-only",
+                        help="Only check database collections, validators and indexes at "
+                             "startup, fail instead of migrating",
+                        action="store_true",
+                        default=_env_flag("CHECK_ONLY"))
+    return parser
+
+def open_database(parser: ArgumentParser, parsed: Namespace) -> RysolvDatabase:
+    """
+
+    connect to mongodb and check or migrate collections, exit when they
+    need a migration and startup is check only
+    :param parser:
+    :param parsed: parsed arguments
+    :return:
+    """
+    _timeout_ms = int(parsed.db_timeout * 1000)
+    _db_client = MongoClient(f"mongodb://{parsed.db_url}",
+                             maxPoolSize=parsed.db_max_pool_size,
+                             serverSelectionTimeoutMS=_timeout_ms,
+                             connectTimeoutMS=_timeout_ms,
+                             socketTimeoutMS=_timeout_ms)
+    _write_concerns = {"crawl": _write_concern(parsed.crawl_write_concern),
+                       "subscriptions": _write_concern(parsed.user_write_concern)}
+    try:
+        return RysolvDatabase(_db_client[parsed.db_name],
+                              WriteOptions(batch_size=parsed.write_batch_size,
+                                           max_retries=parsed.db_write_retries),
+                              write_concerns=_write_concerns,
+                              check_only=parsed.check_only)
+    except SchemaMismatch as error:
+        parser.exit(1, f"{error}, start once without --check-only to migrate\n")
+    return None
+
+def build_crawler(parsed: Namespace, database: RysolvDatabase, logger: Logger) -> RysolvCrawler:
+    """
+
+    crawler on the rysolv api, or on a snapshot with --record or --replay
+    :param parsed: parsed arguments
+    :param database:
+    :param logger:
+    :return:
+    """
+    _transport = RysolvTransport(logger,
+                                 TransportOptions(
+                                     # comments workers and the issues stream
+                                     pool_size=parsed.crawler_workers + 1,
+                                     read_timeout=parsed.http_timeout,
+                                     max_retries=parsed.http_retries))
+    _sleep_time = parsed.sleep_time
+    if parsed.record:
+        _transport = SnapshotRecorder(_transport, parsed.record, logger)
+    elif parsed.replay:
+        _transport = SnapshotReplayer(parsed.replay, logger, speed=parsed.replay_speed)
+        # recorded offsets already pace the replay
+        _sleep_time = 0
+    _scheduler = PollScheduler(SchedulerOptions(min_interval=parsed.sleep_time),
+                               request_budget=parsed.request_budget)
+    return RysolvCrawler(database,
+                         logger,
+                         CrawlerOptions(sleep_time=_sleep_time,
+                                        max_workers=parsed.crawler_workers,
+                                        batch_size=parsed.comments_batch_size,
+                                        chunk_size=parsed.issues_chunk_size),
+                         transport=_transport,
+                         scheduler=_scheduler)
+
+def main() -> None:
+    """
+
+    main function
+    :return:
+    """
+    parser = build_parser()
     parsed = parser.parse_args()
-    _db_client = MongoClient(f"mongodb://{parsed.db_url}")
-    _database = RysolvDatabase(_db_client[parsed.db_name])
+    if parsed.record and parsed.replay:
+        parser.error("--record and --replay are mutually exclusive")
+    try:
+        _partitions = sender_partitions(parsed.sender_index, parsed.sender_count)
+    except ValueError as error:
+        parser.error(str(error))
+    _database = open_database(parser, parsed)
 
     log_level = logging.DEBUG if parsed.verbose else logging.INFO
+    if parsed.metrics_port:
+        start_metrics_server(parsed.metrics_port, host=parsed.metrics_host)
 
     bot_logger = configure_logger("bot", log_level)
-    bot = RysolvBot(parsed.telegram_token, _database, bot_logger)
-#   bot.check_version()
+    bot = RysolvBot(parsed.telegram_token,
+                    _database,
+                    bot_logger,
+                    BotOptions(notifier_workers=parsed.notifier_workers,
+                               update_window=parsed.update_window,
+                               sender_partitions=_partitions))
+    if parsed.mode in ("all", "sender"):
+        bot.sender.dispatcher.start()
+    if parsed.mode == "sender":
+        bot.sender.run()
+        return
+    if parsed.mode == "all":
+        bot.sender.start()
+    bot.coalescer.start()
     crawler_logger = configure_logger("crawler", log_level)
-    crawler = RysolvCrawler(_database, crawler_logger, sleep_time=30)
-    monitor_issue_thread = Thread(target=bot.run_monitor_issue, args=())
-    monitor_comment_thread = Thread(target=bot.run_monitor_comment, args=())
-    crawler_thread = Thread(target=crawler.run, args=())
-    monitor_issue_thread.start()
-    monitor_comment_thread.start()
+    # singleton components run on the replica holding their lease
+    leases = dict.fromkeys(("crawler", "digest", "monitor"))
+    if parsed.leader_ttl:
+        leases = {"crawler": LeaderLease(_database, "crawler", crawler_logger,
+                                         ttl=parsed.leader_ttl),
+                  "digest": LeaderLease(_database, "digest", bot_logger, ttl=parsed.leader_ttl),
+                  "monitor": LeaderLease(_database, "monitor", bot_logger,
+                                         ttl=parsed.leader_ttl)}
+        for _lease in leases.values():
+            _lease.start()
+    digest = DigestFlusher(_database, bot_logger, leader=leases["digest"])
+    digest.start()
+    bot.subscribers.bootstrap(_database)
+#   bot.check_version()
+    crawler = build_crawler(parsed, _database, crawler_logger)
+    monitor_thread = Thread(target=bot.run_monitor, args=(leases["monitor"],))
+    crawler_thread = Thread(target=crawler.run, args=(leases["crawler"],))
+    monitor_thread.start()
     crawler_thread.start()
     bot.run_telegram_bot()
-    monitor_issue_thread.join()
-    monitor_comment_thread.join()
+    digest.stop()
+    for _lease in leases.values():
+        if _lease is not None:
+            _lease.stop()
+    monitor_thread.join()
     crawler_thread.join()
 
 if __name__ == "__main__":
@@ -0,0 +1,210 @@
+"""
+
+changestream module
+"""
+from typing import Callable, Dict, List, Optional, Union
+from logging import Logger
+from threading import Event
+import time
+
+from pymongo.change_stream import ChangeStream
+from pymongo.collection import Collection
+from pymongo.database import Database
+from pymongo.errors import OperationFailure
+
+from .database import RysolvDatabase
+from .metrics import CHANGE_EVENTS
+
+# server error codes of a resume token which is no longer in the oplog
+# CappedPositionLost, InvalidResumeToken, ChangeStreamFatalError, ChangeStreamHistoryLost
+RESUME_LOST_CODES = frozenset([136, 260, 280, 286])
+
+
+class ResumeCheckpoint:
+    """
+
+    ResumeCheckpoint class, persist the resume token of a change stream
+    every N events or T seconds
+    """
+    def __init__(self,
+                 database: RysolvDatabase,
+                 name: str,
+                 every: int = 100,
+                 interval: float = 5.0):
+        self.database = database
+        self.name = name
+        self.every = every
+        self.interval = interval
+        self._token = None
+        self._pending = 0
+        self._flushed_at = time.monotonic()
+
+    def load(self) -> Optional[Dict]:
+        """
+
+        load last persisted token
+        :return:
+        """
+        return self.database.find_resume_token(self.name)
+
+    def update(self, token: Dict) -> None:
+        """
+
+        record the token of a handled event
+        :param token:
+        :return:
+        """
+        self._token = token
+        self._pending += 1
+        if self._pending >= self.every or \
+                time.monotonic() - self._flushed_at >= self.interval:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+
+        persist the last recorded token
+        :return:
+        """
+        if self._pending:
+            self.database.write_resume_token(self.name, self._token)
+            self._pending = 0
+        self._flushed_at = time.monotonic()
+
+    def clear(self) -> None:
+        """
+
+        forget the persisted token
+        :return:
+        """
+        self._token = None
+        self._pending = 0
+        self.database.delete_resume_token(self.name)
+
+
+def open_stream(target: Union[Collection, Database],
+                pipeline: List[Dict],
+                checkpoint: ResumeCheckpoint,
+                logger: Logger) -> ChangeStream:
+    """
+
+    open a change stream resuming after the checkpoint, start from now
+    when the token has aged out of the oplog
+    :param target: collection or database to watch
+    :param pipeline:
+    :param checkpoint:
+    :param logger:
+    :return:
+    """
+    _token = checkpoint.load()
+    if _token:
+        try:
+            return target.watch(pipeline, full_document="updateLookup", resume_after=_token)
+        except OperationFailure as error:
+            if error.code not in RESUME_LOST_CODES:
+                raise
+            logger.warning("Can't resume %s change stream, events since last run are lost: %s",
+                           checkpoint.name,
+                           error)
+            checkpoint.clear()
+    return target.watch(pipeline, full_document="updateLookup")
+
+
+class ChangeStreamRouter:
+    """
+
+    ChangeStreamRouter class, single database level change stream routing
+    events to the handlers registered for their collection
+    """
+    def __init__(self,
+                 database: RysolvDatabase,
+                 checkpoint: ResumeCheckpoint,
+                 logger: Logger,
+                 retry_backoff: float = 5.0):
+        self.database = database
+        self.checkpoint = checkpoint
+        self.logger = logger
+        self.retry_backoff = retry_backoff
+        self._handlers: Dict[str, List[Callable[[Dict], None]]] = {}
+        self._stop = Event()
+
+    def register(self, collection_name: str, handler: Callable[[Dict], None]) -> None:
+        """
+
+        register a handler of change events on a collection
+        :param collection_name:
+        :param handler:
+        :return:
+        """
+        self._handlers.setdefault(collection_name, []).append(handler)
+
+    def stop(self) -> None:
+        """
+
+        stop consuming once the change being handled is done
+        :return:
+        """
+        self._stop.set()
+
+    def run(self,
+            on_open: Optional[Callable[[], None]] = None,
+            active: Optional[Callable[[], bool]] = None) -> None:
+        """
+
+        consume change events until stopped, the stream is reopened from the
+        last checkpoint when it fails or a handler fails, so a change is only
+        checkpointed once handled and a failed one is handled again
+        :param on_open: called every time the stream is open, before the first event
+        :param active: consume only while true, e.g. while holding a lease
+        :return:
+        """
+        pipeline = [{"$match": {"ns.coll": {"$in": list(self._handlers)}}}]
+        _active = active or (lambda: True)
+        while not self._stop.is_set() and _active():
+            try:
+                self._consume(pipeline, on_open, _active)
+            except Exception: # pylint: disable=broad-except
+                self.logger.exception("Change stream interrupted, reopen it in %ss",
+                                      self.retry_backoff)
+                self._stop.wait(self.retry_backoff)
+
+    def _consume(self,
+                 pipeline: List[Dict],
+                 on_open: Optional[Callable[[], None]],
+                 active: Callable[[], bool]) -> None:
+        """
+
+        consume change events of a stream resumed after the checkpoint,
+        polled so active is checked while no event comes
+        :param pipeline:
+        :param on_open:
+        :param active:
+        :return:
+        """
+        with open_stream(self.database.database, pipeline, self.checkpoint, self.logger) as stream:
+            if on_open:
+                on_open()
+            try:
+                while stream.alive and not self._stop.is_set() and active():
+                    change = stream.try_next()
+                    if change is None:
+                        continue
+                    self.dispatch(change)
+                    self.checkpoint.update(change["_id"])
+            finally:
+                self.checkpoint.flush()
+
+    def dispatch(self, change: Dict) -> None:
+        """
+
+        call handlers of the change collection, a failing handler raises
+        :param change:
+        :return:
+        """
+        _collection_name = change["ns"]["coll"]
+        CHANGE_EVENTS.inc(collection=_collection_name, operation=change["operationType"])
+        self.logger.debug("Change on %s collection operationType: %s",
+                          _collection_name,
+                          change["operationType"])
+        for handler in self._handlers.get(_collection_name, ()):
+            handler(change)
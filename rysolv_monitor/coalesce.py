@@ -0,0 +1,178 @@
+"""
+
+coalesce module
+"""
+from typing import Callable, Dict, Iterable, List, Optional
+from logging import Logger
+from threading import Condition, Thread
+import time
+
+from bson import ObjectId
+
+from .database import RysolvDatabase
+
+
+class UpdateCoalescer:
+    """
+
+    UpdateCoalescer class, hold update events of an issue for a window
+    starting at its first event, then flush them as one with the union of
+    changed fields and the new comments, events are persisted in the
+    PendingUpdates collection when a database is given so they survive a
+    crash once their change is checkpointed
+    """
+    def __init__(self,
+                 flush: Callable[[str, List[str], List[Dict]], None],
+                 logger: Logger,
+                 window: float = 10.0,
+                 database: Optional[RysolvDatabase] = None):
+        self.flush = flush
+        self.logger = logger
+        self.window = window
+        self.database = database
+        # issue id -> [deadline, changed fields, new comments, persisted entry ids]
+        self._pending: Dict[str, List] = {}
+        self._condition = Condition()
+        self._thread = None
+
+    def start(self) -> None:
+        """
+
+        start flushing thread, calling it again is a no-op
+        :return:
+        """
+        if self._thread is None:
+            self._thread = Thread(target=self._run, name="coalescer", daemon=True)
+            self._thread.start()
+
+    def add(self, issue_id: str, fields: Iterable[str], comments: Iterable[Dict] = ()) -> None:
+        """
+
+        add an update event, persisted before it is held so a failing write
+        leaves the event to be handled again
+        :param issue_id:
+        :param fields: changed fields
+        :param comments: new comments
+        :return:
+        """
+        _fields = set(fields)
+        _comments = list(comments)
+        with self._condition:
+            _entry = self._pending.get(issue_id)
+            _new = _entry is None
+            if _new:
+                _entry = [time.monotonic() + self.window, set(), [], [ObjectId()]]
+            if self.database is not None:
+                self.database.write_pending_update(_entry[3][0],
+                                                   issue_id,
+                                                   sorted(_fields),
+                                                   _comments,
+                                                   time.time() + _entry[0] - time.monotonic())
+            if _new:
+                self._pending[issue_id] = _entry
+                self._condition.notify()
+            _entry[1].update(_fields)
+            _entry[2].extend(_comment for _comment in _comments if _comment not in _entry[2])
+
+    def restore(self) -> int:
+        """
+
+        hold update events persisted by a previous run, e.g. of a crashed
+        replica, until their original deadline
+        :return: number of restored entries
+        """
+        if self.database is None:
+            return 0
+        _documents = self.database.find_pending_updates()
+        _now = time.time()
+        _restored = 0
+        with self._condition:
+            _held = {_id for _entry in self._pending.values() for _id in _entry[3]}
+            for _document in _documents:
+                if _document["_id"] in _held:
+                    continue
+                _entry = self._pending.get(_document["issue_id"])
+                if _entry is None:
+                    _entry = [time.monotonic() + max(0.0, _document["due"] - _now), set(), [], []]
+                    self._pending[_document["issue_id"]] = _entry
+                _entry[1].update(_document.get("fields") or ())
+                _entry[2].extend(_document.get("comments") or ())
+                _entry[3].append(_document["_id"])
+                _restored += 1
+            self._condition.notify()
+        return _restored
+
+    def clear(self) -> None:
+        """
+
+        forget held updates, e.g. once another replica took the monitor over
+        and restores them
+        :return:
+        """
+        with self._condition:
+            self._pending = {}
+
+    def flush_due(self, now: float) -> float:
+        """
+
+        flush issues whose window is over
+        :param now: monotonic time
+        :return: seconds until next deadline
+        """
+        _due = []
+        with self._condition:
+            for _issue_id, _entry in list(self._pending.items()):
+                if _entry[0] <= now:
+                    _due.append((_issue_id, _entry))
+                    del self._pending[_issue_id]
+            _next = min((_entry[0] for _entry in self._pending.values()),
+                        default=now + self.window)
+        for _issue_id, _entry in _due:
+            self._flush(_issue_id, _entry)
+        return max(0.0, _next - now)
+
+    def flush_all(self) -> None:
+        """
+
+        flush every pending issue now
+        :return:
+        """
+        with self._condition:
+            _due = list(self._pending.items())
+            self._pending = {}
+        for _issue_id, _entry in _due:
+            self._flush(_issue_id, _entry)
+
+    def _flush(self, issue_id: str, entry: List) -> None:
+        _, _fields, _comments, _ids = entry
+        try:
+            self.flush(issue_id, sorted(_fields), _comments)
+        except Exception: # pylint: disable=broad-except
+            self.logger.exception("Fail to flush updates of issue %s, retry in %ss",
+                                  issue_id,
+                                  self.window)
+            self._requeue(issue_id, entry)
+            return
+        if self.database is not None:
+            try:
+                self.database.delete_pending_updates(_ids)
+            except Exception: # pylint: disable=broad-except
+                self.logger.exception("Fail to delete flushed updates of issue %s", issue_id)
+
+    def _requeue(self, issue_id: str, entry: List) -> None:
+        with self._condition:
+            _entry = self._pending.get(issue_id)
+            if _entry is None:
+                entry[0] = time.monotonic() + self.window
+                self._pending[issue_id] = entry
+                self._condition.notify()
+            else:
+                _entry[1].update(entry[1])
+                _entry[2][:0] = entry[2]
+                _entry[3].extend(entry[3])
+
+    def _run(self) -> None:
+        while True:
+            _wait = self.flush_due(time.monotonic())
+            with self._condition:
+                self._condition.wait(_wait)
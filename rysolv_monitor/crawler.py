@@ -2,98 +2,55 @@
 
 crawler module
 """
-from typing import List, Dict
+from typing import List, Dict, Iterator, NamedTuple, Optional, Set, Tuple
 from logging import Logger
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
 import time
 from datetime import datetime
 
-import requests
-
 from .types import (
     Issue,
     Comment
 )
-from .constant import BASE_URL
 from .database import RysolvDatabase
+from .transport import RysolvTransport, TransportOptions
+from .snapshot import SnapshotExhausted
+from .stream import iter_array
+from .scheduler import PollScheduler, SchedulerOptions
+from .leader import LeaderLease, LeaseLost
+from .metrics import (
+    CRAWL_CYCLE_SECONDS,
+    CRAWL_ISSUES,
+    CRAWL_COMMENTS
+)
 
 
-class RysolvCrawler:
+class CrawlerOptions(NamedTuple):
     """
 
-    RysolvCrawler class
+    CrawlerOptions class, crawl pacing and batching
     """
-    DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
-
-    def __init__(self,
-                 database: RysolvDatabase,
-                 logger: Logger,
-                 sleep_time: int = 5):
-        self.database = database
-        self.sleep_time = sleep_time
-        self.logger = logger
+    # seconds between two issues sweeps
+    sleep_time: int = 5
+    # concurrent comments queries
+    max_workers: int = 8
+    # issues per comments query
+    batch_size: int = 20
+    # max comments per comments query
+    batch_comments: int = 200
+    # issues stored and refreshed at once during a sweep
+    chunk_size: int = 500
 
-    def run(self) -> None:
-        """
-
-        run function
-        :return:
-        """
-        self.logger.info("Run monitor issue")
-        self._monitor_issue()
-
-    def _monitor_issue(self):
-        while True:
-            _data = self.fetch_issues()
-            self.logger.info("Find %s issues", len(_data))
-            _result = self.database.write_issues(_data)
-            self.logger.debug("Update issues collections %d modified %d upserted",
-                              _result.modified_count,
-                              _result.upserted_count)
-            _comments = []
-            for _issue in _data:
-                _comments.append({"issue_id": _issue["id"],
-                                  "comments": self.fetch_comments_by_issue_id(_issue["id"])})
-            if _comments:
-                _result = self.database.write_comments(_comments)
-                self.logger.debug("Update comments collections %d modified %d upserted",
-                                  _result.modified_count,
-                                  _result.upserted_count)
-            self.logger.info("Sleep %ds", self.sleep_time)
-            time.sleep(self.sleep_time)
 
-    def fetch_comments_by_issue_id(self, issue_id: str) -> List[Comment]:
-        """
-
-        fetch comments by issue id
-        :param issue_id:
-        :return:
-        """
-        _query = """
-    query {{
-      getIssueComments(issueId: \"{issue_id}\") {{
-        body
-        createdDate
-        githubUrl
-        isGithubComment
-        profilePic
-        userId
-        username
-      }}
-    }}
-    """.format(issue_id=issue_id)
-        _result_data = self._query(_query)
-        if "data" not in _result_data or \
-                "getIssueComments" not in _result_data["data"]:
-            raise Exception(f"Can't find data in response body: {_result_data}")
-        return _result_data["data"]["getIssueComments"]
-
-    def fetch_issues(self) -> List[Issue]:
-        """
+class RysolvCrawler:
+    """
 
-        fetch function
-        :return:
-        """
-        _query = """
+    RysolvCrawler class
+    """
+    DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+    ISSUES_QUERY = """
     query {
       getIssues {
         __typename
@@ -124,41 +81,398 @@ class RysolvCrawler:
       }
     }
   """
-        _result_data = self._query(_query)
-        if "data" not in _result_data or \
-            "getIssues" not in _result_data["data"] or \
-            "issues" not in _result_data["data"]["getIssues"]:
-            raise Exception(f"Can't find data in response body: {_result_data}")
-        _issues = []
-        for item in _result_data["data"]["getIssues"]["issues"]:
-            item["createdDate"] = self.convert_to_datetime(item["createdDate"])
-            item["modifiedDate"] = self.convert_to_datetime(item["modifiedDate"])
-            _issues.append(Issue(item))
-        return _issues
+
+    def __init__(self,
+                 database: RysolvDatabase,
+                 logger: Logger,
+                 options: CrawlerOptions = CrawlerOptions(),
+                 transport: Optional[RysolvTransport] = None,
+                 scheduler: Optional[PollScheduler] = None):
+        self.database = database
+        self.options = options
+        self.logger = logger
+        self.transport = transport or RysolvTransport(
+            logger, TransportOptions(pool_size=options.max_workers + 1))
+        self.scheduler = scheduler or PollScheduler(
+            SchedulerOptions(min_interval=options.sleep_time))
+        # fingerprints by issue id, lazily loaded from database
+        self._fingerprints = None
+
+    def run(self, leader: Optional[LeaderLease] = None) -> None:
+        """
+
+        run function, only while holding the lease when replicas share the
+        database
+        :param leader: crawler lease
+        :return:
+        """
+        self.logger.info("Run monitor issue")
+        self._monitor_issue(leader)
+
+    def _monitor_issue(self, leader: Optional[LeaderLease]):
+        _standby = False
+        while True:
+            # standby replicas only crawl once they take the lease over
+            if leader is not None:
+                if not leader.wait(self.options.sleep_time or 1):
+                    _standby = True
+                    continue
+                if _standby:
+                    # the previous leader wrote since caches were loaded
+                    self.reset_caches()
+                    _standby = False
+            try:
+                self.crawl(leader)
+            except LeaseLost:
+                self.logger.warning("Lost crawler lease, abort crawl cycle")
+                _standby = True
+                continue
+            except SnapshotExhausted:
+                self.logger.info("Snapshot replayed, stop monitor issue")
+                return
+            except Exception: # pylint: disable=broad-except
+                self.logger.exception("Crawl cycle failed")
+            self.logger.info("Sleep %ds", self.options.sleep_time)
+            time.sleep(self.options.sleep_time)
+
+    def reset_caches(self) -> None:
+        """
+
+        drop fingerprints and database caches, reloaded on next crawl
+        :return:
+        """
+        self._fingerprints = None
+        self.database.reset_caches()
 
     @staticmethod
-    def _query(query: str) -> Dict:
-        _data = {"query": query}
-        _headers = {
-            "content-type": "application/json",
-            "user-agent": """Mozilla/5.0 (X11; Linux x86_64) """
-                          """AppleWebKit/537.36 (KHTML, like Gecko) """
-                          """Chrome/87.0.4280.141 Safari/537.36""",
+    def _check_lease(leader: Optional[LeaderLease]) -> None:
+        """
+
+        raise LeaseLost when the crawler lease lapsed
+        :param leader:
+        :return:
+        """
+        if leader is not None and not leader.is_leader():
+            raise LeaseLost(leader.name)
+
+    def crawl(self, leader: Optional[LeaderLease] = None) -> Dict:
+        """
+
+        run a single crawl cycle, issues are parsed from the response stream
+        and stored, scheduled and refreshed chunk by chunk
+        :param leader: crawler lease, the cycle is aborted once it lapsed
+        :return: cycle statistics
+        """
+        _start = time.monotonic()
+        # the issues sweep is always done, it only takes from the budget
+        self.scheduler.budget.reserve()
+        _watched_ids = self.database.find_watched_issue_ids()
+        # issues seen this cycle, slimmed to what refreshing their comments needs
+        _seen: Dict[str, Issue] = {}
+        _changed_ids = set()
+        # due issues not seen yet this cycle
+        _pending: Dict[str, None] = {}
+        # due issues are refreshed once they fill a batch per worker
+        _due: List[Issue] = []
+        # due, refreshed issues and fetched comments
+        _totals = Counter()
+        for _chunk in self._chunks(self.iter_issues()):
+            # another replica may have taken the lease over since the sweep began
+            self._check_lease(leader)
+            _changed_ids.update(self._store(_chunk, _seen, _watched_ids))
+            _pending.update(dict.fromkeys(
+                self.scheduler.pop_due(request_cost=1.0 / self.options.batch_size)))
+            _ready = [_issue_id for _issue_id in _pending if _issue_id in _seen]
+            for _issue_id in _ready:
+                del _pending[_issue_id]
+                _due.append(_seen[_issue_id])
+            if len(_due) < self.options.batch_size * self.options.max_workers:
+                continue
+            _totals.update(self._refresh(_due, _changed_ids))
+            _due = []
+        self._check_lease(leader)
+        _totals.update(self._refresh(_due, _changed_ids))
+        self.scheduler.forget(set(_seen))
+        self.logger.info("Find %s issues", len(_seen))
+        _stats = {
+            "issues": len(_seen),
+            "changed": len(_changed_ids),
+            "refreshed": _totals["refreshed"],
+            "skipped": len(_seen) - _totals["due"],
+            "failed": _totals["due"] - _totals["refreshed"],
+            "duration": time.monotonic() - _start,
         }
-        resp = requests.post(f"{BASE_URL}/graphql", json=_data, headers=_headers)
-        if not resp.status_code == 200:
-            msg = f"Fail to query on {BASE_URL}, got {resp.status_code}" \
-                  f"instead of 200, reason: {resp.reason}"
-            raise Exception(msg)
+        CRAWL_CYCLE_SECONDS.observe(_stats["duration"])
+        CRAWL_COMMENTS.inc(_totals["comments"])
+        for _state in ("issues", "changed", "refreshed", "skipped", "failed"):
+            CRAWL_ISSUES.set(_stats[_state], state=_state)
+        self.logger.info("Cycle done in %.2fs: %d issues, %d changed, %d refreshed, "
+                         "%d skipped, %d failed",
+                         _stats["duration"],
+                         _stats["issues"],
+                         _stats["changed"],
+                         _stats["refreshed"],
+                         _stats["skipped"],
+                         _stats["failed"])
+        return _stats
+
+    def _chunks(self, issues: Iterator[Issue]) -> Iterator[List[Issue]]:
+        _issues = iter(issues)
+        while True:
+            _chunk = list(islice(_issues, self.options.chunk_size))
+            if not _chunk:
+                return
+            yield _chunk
+
+    def _store(self,
+               issues: List[Issue],
+               seen: Dict[str, Issue],
+               watched_ids: Set[str]) -> Set[str]:
+        """
+
+        store a chunk of swept issues and schedule them
+        :param issues:
+        :param seen: issues seen this cycle, completed with the chunk
+        :param watched_ids: ids of issues having watchers
+        :return: ids of issues whose fingerprint changed
+        """
+        _result = self.database.write_issues(issues)
+        self.logger.debug("Update issues collections %d modified %d upserted %d skipped",
+                          _result.modified_count,
+                          _result.upserted_count,
+                          _result.skipped_count)
+        _changed_ids = {_issue["id"] for _issue in self.changed_issues(issues)}
+        for _issue in issues:
+            seen[_issue["id"]] = Issue(id=_issue["id"],
+                                       comments=_issue.get("comments"),
+                                       modifiedDate=_issue.get("modifiedDate"))
+            self.scheduler.observe(_issue,
+                                   _issue["id"] in _changed_ids,
+                                   _issue["id"] in watched_ids)
+        return _changed_ids
+
+    def _refresh(self, issues: List[Issue], changed_ids: Set[str]) -> Dict[str, int]:
+        """
+
+        fetch and store comments of due issues, then reschedule them
+        :param issues: due issues
+        :param changed_ids: ids of issues whose fingerprint changed
+        :return: number of due and refreshed issues and of fetched comments
+        """
+        _comments_by_issue = self.fetch_comments(issues)
+        _refreshed = [_issue for _issue in issues if _issue["id"] in _comments_by_issue]
+        _comments = []
+        for _issue in _refreshed:
+            # comments of an issue seen for the first time are announced with the issue
+            _initial = _issue["id"] not in self._fingerprints
+            for _comment in _comments_by_issue[_issue["id"]]:
+                _comments.append(Comment(_comment,
+                                         issue_id=_issue["id"],
+                                         comment_key=RysolvDatabase.comment_key(_comment),
+                                         initial=_initial))
+        if _comments:
+            _result = self.database.write_comments(_comments)
+            self.logger.debug("Update comments collections %d upserted %d skipped",
+                              _result.upserted_count,
+                              _result.skipped_count)
+        self.update_fingerprints(_refreshed)
+        for _issue in issues:
+            self.scheduler.record(_issue["id"],
+                                  _issue["id"] in changed_ids or
+                                  _issue["id"] not in _comments_by_issue)
+        return {"due": len(issues), "refreshed": len(_refreshed), "comments": len(_comments)}
+
+    @staticmethod
+    def fingerprint(issue: Issue) -> Tuple:
+        """
+
+        fingerprint of an issue, it changes whenever comments may have changed
+        :param issue:
+        :return:
+        """
+        return issue.get("comments"), issue.get("modifiedDate")
+
+    def changed_issues(self, issues: List[Issue]) -> List[Issue]:
+        """
+
+        filter issues which are new or whose fingerprint changed
+        :param issues:
+        :return:
+        """
+        if self._fingerprints is None:
+            self._fingerprints = {_issue_id: self.fingerprint(item)
+                                  for _issue_id, item in self.database.find_fingerprints().items()}
+        return [_issue for _issue in issues
+                if self._fingerprints.get(_issue["id"]) != self.fingerprint(_issue)]
+
+    def update_fingerprints(self, issues: List[Issue]) -> None:
+        """
+
+        store fingerprints of refreshed issues in memory and database
+        :param issues:
+        :return:
+        """
+        _fingerprints = []
+        for _issue in issues:
+            _comments, _modified_date = self.fingerprint(_issue)
+            self._fingerprints[_issue["id"]] = (_comments, _modified_date)
+            _fingerprints.append({"issue_id": _issue["id"],
+                                  "comments": _comments,
+                                  "modifiedDate": _modified_date})
+        if _fingerprints:
+            self.database.write_fingerprints(_fingerprints)
+
+    def fetch_comments(self, issues: List[Issue]) -> Dict[str, List[Comment]]:
+        """
+
+        fetch comments of many issues concurrently, in batches of aliased
+        queries, an issue which fails is logged and left out of the result
+        :param issues:
+        :return: comments by issue id
+        """
+        _comments = {}
+        with ThreadPoolExecutor(max_workers=self.options.max_workers) as executor:
+            _futures = [executor.submit(self._fetch_comments_batch, _batch)
+                        for _batch in self._batch_issues(issues)]
+            for _future in as_completed(_futures):
+                _comments.update(_future.result())
+        return _comments
+
+    def _batch_issues(self, issues: List[Issue]) -> Iterator[List[str]]:
+        """
+
+        split issues in batches of at most batch_size ids, the comments
+        count of each issue is used to bound the response payload
+        :param issues:
+        :return:
+        """
+        _batch = []
+        _batch_comments = 0
+        for _issue in issues:
+            _issue_comments = _issue.get("comments") or 0
+            if _batch and (len(_batch) >= self.options.batch_size or
+                           _batch_comments + _issue_comments > self.options.batch_comments):
+                yield _batch
+                _batch = []
+                _batch_comments = 0
+            _batch.append(_issue["id"])
+            _batch_comments += _issue_comments
+        if _batch:
+            yield _batch
+
+    def _fetch_comments_batch(self, issue_ids: List[str]) -> Dict[str, List[Comment]]:
+        """
+
+        fetch a batch, issues missing from the batch response are retried
+        one by one so a single failure doesn't drop the whole batch
+        :param issue_ids:
+        :return:
+        """
+        _comments = {}
+        if len(issue_ids) > 1:
+            try:
+                _comments = self.fetch_comments_by_issue_ids(issue_ids)
+            except Exception as error: # pylint: disable=broad-except
+                self.logger.warning("Fail to fetch comments batch of %d issues: %s",
+                                    len(issue_ids),
+                                    error)
+        for _issue_id in issue_ids:
+            if _issue_id in _comments:
+                continue
+            try:
+                _comments[_issue_id] = self.fetch_comments_by_issue_id(_issue_id)
+            except Exception as error: # pylint: disable=broad-except
+                self.logger.warning("Fail to fetch comments of issue %s: %s",
+                                    _issue_id,
+                                    error)
+        return _comments
+
+    def fetch_comments_by_issue_id(self, issue_id: str) -> List[Comment]:
+        """
+
+        fetch comments by issue id
+        :param issue_id:
+        :return:
+        """
+        _comments = self.fetch_comments_by_issue_ids([issue_id])
+        if issue_id not in _comments:
+            raise Exception(f"Can't find comments of issue {issue_id} in response body")
+        return _comments[issue_id]
+
+    def fetch_comments_by_issue_ids(self, issue_ids: List[str]) -> Dict[str, List[Comment]]:
+        """
+
+        fetch comments of several issues in a single query, each issue is
+        aliased c0, c1, ... and ids whose field is null are left out
+        :param issue_ids:
+        :return: comments by issue id
+        """
+        _result_data = self._query(self._comments_query(issue_ids))
+        if not _result_data.get("data"):
+            raise Exception(f"Can't find data in response body: {_result_data}")
+        _comments = {}
+        for _index, _issue_id in enumerate(issue_ids):
+            _data = _result_data["data"].get(f"c{_index}")
+            if isinstance(_data, list):
+                _comments[_issue_id] = _data
+        return _comments
+
+    @staticmethod
+    def _comments_query(issue_ids: List[str]) -> str:
+        """
+
+        build aliased getIssueComments query
+        :param issue_ids:
+        :return:
+        """
+        _fields = """
+        c{index}: getIssueComments(issueId: \"{issue_id}\") {{
+          body
+          createdDate
+          githubUrl
+          isGithubComment
+          profilePic
+          userId
+          username
+        }}"""
+        return "query {{{fields}\n}}".format(
+            fields="".join(_fields.format(index=_index, issue_id=_issue_id)
+                           for _index, _issue_id in enumerate(issue_ids)))
+
+    def fetch_issues(self) -> List[Issue]:
+        """
+
+        fetch function
+        :return:
+        """
+        return list(self.iter_issues())
+
+    def iter_issues(self) -> Iterator[Issue]:
+        """
+
+        parse issues one by one from the getIssues response stream
+        :return:
+        """
+        for item in iter_array(self.transport.stream(self.ISSUES_QUERY), "issues"):
+            item["createdDate"] = self.convert_to_datetime(item["createdDate"])
+            item["modifiedDate"] = self.convert_to_datetime(item["modifiedDate"])
+            yield Issue(item)
 
-        return resp.json()
+    def _query(self, query: str) -> Dict:
+        return self.transport.query(query)
 
     @classmethod
     def convert_to_datetime(cls, date_str: str) -> datetime:
         """
 
-        convert to datetime
+        convert to datetime, api dates are ISO 8601 in UTC so fromisoformat
+        parses them once the Z suffix is dropped, strptime is the fallback
         :param date_str:
         :return:
         """
+        if date_str.endswith("Z"):
+            try:
+                return datetime.fromisoformat(date_str[:-1])
+            except ValueError:
+                pass
         return datetime.strptime(date_str, cls.DATE_FORMAT)
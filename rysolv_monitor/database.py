@@ -2,82 +2,577 @@
 
 database module
 """
-from enum import Enum, auto
-import os
-from typing import Dict, List, Optional
+from datetime import datetime, timezone
+from enum import Enum
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+import hashlib
 import json
+import random
 import time
 
-from pymongo import DESCENDING, UpdateOne
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
 from pymongo.results import UpdateResult, DeleteResult, BulkWriteResult
 from pymongo.database import Database
-from pymongo.errors import CollectionInvalid
+from pymongo.errors import (
+    AutoReconnect,
+    BulkWriteError,
+    DuplicateKeyError,
+    PyMongoError,
+    WTimeoutError
+)
+from pymongo.write_concern import WriteConcern
+from bson import ObjectId
 
 from .types import (
     Issue,
-    Comment
+    Comment,
+    Filter
+)
+from .metrics import (
+    BULK_WRITE_SECONDS,
+    BULK_WRITE_DOCUMENTS,
+    WRITE_RETRIES
 )
+from .schema import RysolvCollections, SchemaMismatch, SchemaMixin
+
+# field holding the content hash of crawled documents
+HASH_FIELD = "content_hash"
+
+# write concern profile of each collection, crawl data is refetched anyway
+WRITE_PROFILES = {
+    RysolvCollections.Users.name: "subscriptions",
+    RysolvCollections.WatchIssues.name: "subscriptions",
+    RysolvCollections.Changelogs.name: "subscriptions",
+    RysolvCollections.Issues.name: "crawl",
+    RysolvCollections.Comments.name: "crawl",
+    RysolvCollections.Fingerprints.name: "crawl",
+    RysolvCollections.ResumeTokens.name: "crawl",
+    RysolvCollections.Outbox.name: "subscriptions",
+    # a lease acknowledged by a primary rolled back later would make two leaders
+    RysolvCollections.Leases.name: "subscriptions",
+    RysolvCollections.Filters.name: "subscriptions",
+    RysolvCollections.DigestBuffer.name: "subscriptions",
+    RysolvCollections.PendingUpdates.name: "subscriptions",
+}
+DEFAULT_WRITE_CONCERNS = {
+    "crawl": WriteConcern(w=1),
+    "subscriptions": WriteConcern(w="majority"),
+}
+DUPLICATE_KEY_CODE = 11000
+# notification jobs are spread by user id over partitions claimed by senders
+OUTBOX_PARTITIONS = 64
+
+
+class OutboxStatus(Enum):
+    """
+
+    OutboxStatus class, status of notification jobs, values are stored
+    """
+    PENDING = "pending"
+    LEASED = "leased"
+    SENT = "sent"
+    FAILED = "failed"
+
+
+def is_transient(error: PyMongoError) -> bool:
+    """
+
+    is error worth a retry: network errors and elections, write concern
+    timeouts, and duplicate keys of concurrent upserts
+    :param error:
+    :return:
+    """
+    if isinstance(error, (AutoReconnect, WTimeoutError)) or \
+            error.has_error_label("RetryableWriteError"):
+        return True
+    if isinstance(error, BulkWriteError):
+        _errors = error.details.get("writeErrors", [])
+        return bool(_errors) and \
+            all(_error.get("code") == DUPLICATE_KEY_CODE for _error in _errors) and \
+            not error.details.get("writeConcernErrors")
+    return False
+
+
+class WriteOptions(NamedTuple):
+    """
+
+    WriteOptions class, bulk write batching and retries
+    """
+    # documents per bulk write
+    batch_size: int = 500
+    ordered: bool = False
+    # retries of a write failed with a transient error, jittered exponential backoff
+    max_retries: int = 3
+    retry_backoff: float = 0.1
+
+
+class WriteSummary:
+    """
+
+    WriteSummary class, aggregate results of chunked bulk writes
+    """
+    def __init__(self):
+        self.matched_count = 0
+        self.modified_count = 0
+        self.upserted_count = 0
+        self.skipped_count = 0
+
+    def add(self, result: BulkWriteResult) -> None:
+        """
+
+        add bulk write result
+        :param result:
+        :return:
+        """
+        self.matched_count += result.matched_count
+        self.modified_count += result.modified_count
+        self.upserted_count += result.upserted_count
+
+    def skip(self, count: int = 1) -> None:
+        """
+
+        count documents left out of the write as unchanged
+        :param count:
+        :return:
+        """
+        self.skipped_count += count
+
+
+class _OutboxMixin:
+    """
+
+    _OutboxMixin class, notification jobs of RysolvDatabase
+    """
+    @staticmethod
+    def outbox_partition(user_id: int) -> int:
+        """
+
+        outbox partition of a user
+        :param user_id:
+        :return:
+        """
+        return user_id % OUTBOX_PARTITIONS
+
+    def write_outbox(self,
+                     text: str,
+                     user_ids: Iterable[int],
+                     batch_size: int = 100) -> WriteSummary:
+        """
+
+        write notification jobs, one per partition and batch of recipients
+        :param text:
+        :param user_ids:
+        :param batch_size: recipients per job
+        :return:
+        """
+        _partitions: Dict[int, List[int]] = {}
+        for _user_id in user_ids:
+            _partitions.setdefault(self.outbox_partition(_user_id), []).append(_user_id)
+        _now = time.time()
+        _operations = []
+        for _partition, _user_ids in sorted(_partitions.items()):
+            for _index in range(0, len(_user_ids), batch_size):
+                _job = {"partition": _partition,
+                        "user_ids": _user_ids[_index:_index + batch_size],
+                        "text": text,
+                        "status": OutboxStatus.PENDING.value,
+                        "attempts": 0,
+                        "lease_until": _now,
+                        "created": _now}
+                # client side ids keep retried upserts idempotent
+                _operations.append(UpdateOne({"_id": ObjectId()},
+                                             {"$setOnInsert": _job},
+                                             upsert=True))
+        _summary = WriteSummary()
+        for _chunk in self._chunks(_operations):
+            _summary.add(self._bulk_write(RysolvCollections.Outbox.name, _chunk))
+        return _summary
+
+    def claim_outbox_job(self, owner: str, partitions: List[int], lease: float) -> Optional[Dict]:
+        """
+
+        lease the oldest claimable job of partitions, pending or with an
+        expired lease, e.g. of a crashed sender
+        :param owner: sender id
+        :param partitions:
+        :param lease: seconds
+        :return: job, None when there is nothing to send
+        """
+        _now = time.time()
+        _filter = {"status": {"$in": [OutboxStatus.PENDING.value, OutboxStatus.LEASED.value]},
+                   "partition": {"$in": partitions},
+                   "lease_until": {"$lte": _now}}
+        _update = {"$set": {"status": OutboxStatus.LEASED.value,
+                            "lease_owner": owner,
+                            "lease_until": _now + lease},
+                   "$inc": {"attempts": 1}}
+        return self._retry(RysolvCollections.Outbox.name,
+                           lambda: self.collections[RysolvCollections.Outbox.name]
+                           .find_one_and_update(_filter,
+                                                _update,
+                                                sort=[("lease_until", ASCENDING)],
+                                                return_document=ReturnDocument.AFTER))
+
+    def complete_outbox_job(self,
+                            job_id: ObjectId,
+                            owner: str,
+                            delivered: List[int],
+                            retry_user_ids: List[int],
+                            retry_at: Optional[float] = None) -> UpdateResult:
+        """
+
+        release a leased job, sent, failed, or pending again for the
+        recipients to retry, a job leased since by another sender is left alone
+        :param job_id:
+        :param owner: sender id
+        :param delivered: recipients sent to
+        :param retry_user_ids: recipients failed with a transient error
+        :param retry_at: retry time of the recipients, None gives up
+        :return:
+        """
+        if retry_user_ids and retry_at is not None:
+            _data = {"status": OutboxStatus.PENDING.value,
+                     "user_ids": retry_user_ids,
+                     "lease_owner": None,
+                     "lease_until": retry_at}
+        else:
+            _data = {"status": (OutboxStatus.FAILED if retry_user_ids else OutboxStatus.SENT).value,
+                     "lease_owner": None,
+                     "finished": datetime.now(timezone.utc)}
+        _update = {"$set": _data, "$addToSet": {"delivered": {"$each": delivered}}}
+        return self._retry(RysolvCollections.Outbox.name,
+                           lambda: self.collections[RysolvCollections.Outbox.name]
+                           .update_one({"_id": job_id, "lease_owner": owner}, _update))
+
+
+class _LeaseMixin:
+    """
+
+    _LeaseMixin class, leader leases of RysolvDatabase
+    """
+    def server_time(self) -> float:
+        """
+
+        current time of the mongodb server, one clock shared by every replica
+        :return: seconds since epoch
+        """
+        _local_time = self.database.command("isMaster")["localTime"]
+        return _local_time.replace(tzinfo=timezone.utc).timestamp()
+
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """
+
+        take or renew a lease held by owner or expired, leases of dead
+        owners are also removed by a ttl index once expired, lease times are
+        read from the server clock so skewed replica clocks can't steal a
+        live lease
+        :param name: lease name
+        :param owner:
+        :param ttl: seconds
+        :return: whether owner holds the lease
+        """
+        _now = self.server_time()
+        _filter = {"name": name, "$or": [{"owner": owner}, {"lease_until": {"$lt": _now}}]}
+        _data = {"name": name,
+                 "owner": owner,
+                 "lease_until": _now + ttl,
+                 "expires_at": datetime.fromtimestamp(_now + ttl, timezone.utc)}
+        try:
+            self._upsert_one(RysolvCollections.Leases.name, _filter, _data)
+        except DuplicateKeyError:
+            # held by another owner, the upsert collided with its document
+            return False
+        return True
+
+    def release_lease(self, name: str, owner: str) -> DeleteResult:
+        """
+
+        release a lease held by owner
+        :param name: lease name
+        :param owner:
+        :return:
+        """
+        return self.collections[RysolvCollections.Leases.name].delete_one({"name": name,
+                                                                           "owner": owner})
+
+
+class _FilterMixin:
+    """
 
-SCHEMA_DIR = os.path.join(os.path.dirname(__file__), "schemas")
+    _FilterMixin class, new issue filters of RysolvDatabase
+    """
+    def update_filter(self, _filter: Filter) -> UpdateResult:
+        """
 
+        set the new issue filter of a user
+        :param _filter:
+        :return:
+        """
+        _data = dict(_filter.to_document(), last_update=time.time())
+        return self._upsert_one(RysolvCollections.Filters.name, {"user_id": _filter.user_id}, _data)
 
-class RysolvCollections(Enum):
+    def find_filter(self, user_id: int) -> Optional[Filter]:
+        """
+
+        find the new issue filter of a user
+        :param user_id:
+        :return:
+        """
+        _document = self.collections[RysolvCollections.Filters.name].find_one({"user_id": user_id})
+        return Filter(_document) if _document else None
+
+    def find_filters(self) -> List[Dict]:
+        """
+
+        find filters
+        :return:
+        """
+        return self.collections[RysolvCollections.Filters.name].find({})
+
+    def delete_filter(self, user_id: int) -> DeleteResult:
+        """
+
+        delete the new issue filter of a user, who then gets every new issue
+        :param user_id:
+        :return:
+        """
+        return self.collections[RysolvCollections.Filters.name].delete_one({"user_id": user_id})
+
+
+class _DigestMixin:
     """
 
-    RysolvCollections class
+    _DigestMixin class, digest mode of RysolvDatabase users
     """
-    Users = auto()
-    WatchIssues = auto()
-    Issues = auto()
-    Comments = auto()
-    Changelogs = auto()
+    def update_user_digest(self, user_id: int, digest: Optional[float]) -> UpdateResult:
+        """
+
+        set seconds between digests of a registered user
+        :param user_id:
+        :param digest: None to be notified right away
+        :return:
+        """
+        _data = {"digest": digest, "last_update": time.time()}
+        return self._retry(RysolvCollections.Users.name,
+                           lambda: self.collections[RysolvCollections.Users.name].update_one(
+                               {"user_id": user_id}, {"$set": _data}))
+
+    def write_digest(self, text: str, digests: Dict[int, float]) -> WriteSummary:
+        """
+
+        buffer a notification of users in digest mode, due at the next
+        multiple of their digest period so each user's events flush together
+        :param text:
+        :param digests: user id -> seconds between digests
+        :return:
+        """
+        _now = time.time()
+        _operations = [UpdateOne({"_id": ObjectId()},
+                                 {"$setOnInsert": {"user_id": _user_id,
+                                                   "text": text,
+                                                   "created": _now,
+                                                   "due": (_now // _digest + 1) * _digest}},
+                                 upsert=True)
+                       for _user_id, _digest in digests.items()]
+        _summary = WriteSummary()
+        for _chunk in self._chunks(_operations):
+            _summary.add(self._bulk_write(RysolvCollections.DigestBuffer.name, _chunk))
+        return _summary
+
+    def find_due_digest_users(self, now: float) -> List[int]:
+        """
 
-def _load_schema_file(collection_name: str) -> Dict:
-    _file_path = os.path.join(SCHEMA_DIR, f"{collection_name}.json")
-    with open(_file_path, "r") as _file:
-        return json.load(_file)
+        users with buffered notifications due
+        :param now:
+        :return:
+        """
+        return self.collections[RysolvCollections.DigestBuffer.name].distinct(
+            "user_id", {"due": {"$lte": now}})
 
+    def find_digest_entries(self, user_id: int, now: float) -> List[Dict]:
+        """
 
-class RysolvDatabase:
+        buffered notifications of a user due, oldest first
+        :param user_id:
+        :param now:
+        :return:
+        """
+        return list(self.collections[RysolvCollections.DigestBuffer.name].find(
+            {"user_id": user_id, "due": {"$lte": now}}).sort("created", ASCENDING))
+
+    def delete_digest_entries(self, ids: List[ObjectId]) -> DeleteResult:
+        """
+
+        delete buffered notifications
+        :param ids:
+        :return:
+        """
+        return self.collections[RysolvCollections.DigestBuffer.name].delete_many(
+            {"_id": {"$in": ids}})
+
+
+class _WatchIssueMixin:
+    """
+
+    _WatchIssueMixin class, issue watchers of RysolvDatabase users
+    """
+    def update_watch_issue(self, user_id: int, issue_id: str) -> UpdateResult:
+        """
+
+        update watch issue
+        :param user_id:
+        :param issue_id:
+        :return:
+        """
+        _filter = {"user_id": user_id, "issue_id": issue_id}
+        _data = {"user_id": user_id, "issue_id": issue_id, "last_update": time.time()}
+        return self._upsert_one(RysolvCollections.WatchIssues.name, _filter, _data)
+
+    def delete_watch_issue(self, user_id: int, issue_id: str) -> DeleteResult:
+        """
+
+        delete watch issue
+        :param user_id:
+        :param issue_id:
+        :return:
+        """
+        _filter = {"user_id": user_id, "issue_id": issue_id}
+        return self.collections[RysolvCollections.WatchIssues.name].delete_one(_filter)
+
+    def find_watch_issues(self, _filter: dict = None) -> List[Dict]:
+        """
+
+        find watch issue
+        :return:
+        """
+        return self.collections[RysolvCollections.WatchIssues.name].find(_filter)
+
+    def find_watched_issue_page(self,
+                                user_id: int,
+                                after: Optional[str] = None,
+                                before: Optional[str] = None,
+                                limit: int = 20) -> Tuple[List[str], bool, bool]:
+        """
+
+        page of issue ids watched by a user in issue id order, keyset
+        paginated and covered by the (user_id, issue_id) index
+        :param user_id:
+        :param after: issue id the page starts after
+        :param before: issue id the page ends before
+        :param limit: page size
+        :return: issue ids, whether there are previous and next pages
+        """
+        _filter = {"user_id": user_id}
+        _direction = ASCENDING
+        if after is not None:
+            _filter["issue_id"] = {"$gt": after}
+        elif before is not None:
+            _filter["issue_id"] = {"$lt": before}
+            _direction = DESCENDING
+        # one more to know whether the page is the last one
+        cursor = self.collections[RysolvCollections.WatchIssues.name] \
+            .find(_filter, {"_id": 0, "issue_id": 1}) \
+            .sort([("user_id", _direction), ("issue_id", _direction)]) \
+            .limit(limit + 1)
+        _issue_ids = [_document["issue_id"] for _document in cursor]
+        _more = len(_issue_ids) > limit
+        _issue_ids = _issue_ids[:limit]
+        if before is not None:
+            _issue_ids.reverse()
+            return _issue_ids, _more, True
+        return _issue_ids, after is not None, _more
+
+    def find_watched_issue_ids(self) -> Set[str]:
+        """
+
+        find ids of issues having at least one watcher
+        :return:
+        """
+        return set(self.collections[RysolvCollections.WatchIssues.name].distinct("issue_id"))
+
+
+class _PendingUpdateMixin:
+    """
+
+    _PendingUpdateMixin class, held issue updates of RysolvDatabase
+    """
+    def write_pending_update(self,
+                             entry_id: ObjectId,
+                             issue_id: str,
+                             fields: List[str],
+                             comments: List[Dict],
+                             due: float) -> UpdateResult:
+        """
+
+        persist update events held by the coalescer, $addToSet keeps a
+        retried write from adding them twice
+        :param entry_id: coalescer entry
+        :param issue_id:
+        :param fields: changed fields
+        :param comments: new comments
+        :param due: flush time
+        :return:
+        """
+        _collection_name = RysolvCollections.PendingUpdates.name
+        return self._retry(_collection_name,
+                           lambda: self.collections[_collection_name].update_one(
+                               {"_id": entry_id},
+                               {"$setOnInsert": {"issue_id": issue_id, "due": due},
+                                "$addToSet": {"fields": {"$each": fields},
+                                              "comments": {"$each": comments}}},
+                               upsert=True))
+
+    def find_pending_updates(self) -> List[Dict]:
+        """
+
+        update events held by coalescers, first due first
+        :return:
+        """
+        return list(self.collections[RysolvCollections.PendingUpdates.name].find()
+                    .sort("due", ASCENDING))
+
+    def delete_pending_updates(self, ids: List[ObjectId]) -> DeleteResult:
+        """
+
+        delete flushed update events
+        :param ids:
+        :return:
+        """
+        return self.collections[RysolvCollections.PendingUpdates.name].delete_many(
+            {"_id": {"$in": ids}})
+
+
+class RysolvDatabase(SchemaMixin,
+                     _OutboxMixin,
+                     _LeaseMixin,
+                     _FilterMixin,
+                     _DigestMixin,
+                     _WatchIssueMixin,
+                     _PendingUpdateMixin):
     """
 
     RysolvDatabase class
     """
-    SCHEMAS = {
-        RysolvCollections.Users.name: _load_schema_file(RysolvCollections.Users.name),
-        RysolvCollections.WatchIssues.name: _load_schema_file(RysolvCollections.WatchIssues.name),
-        RysolvCollections.Issues.name: _load_schema_file(RysolvCollections.Issues.name),
-        RysolvCollections.Comments.name: _load_schema_file(RysolvCollections.Comments.name),
-        RysolvCollections.Changelogs.name: _load_schema_file(RysolvCollections.Changelogs.name),
-    }
-    def __init__(self, database: Database):
+    def __init__(self,
+                 database: Database,
+                 options: WriteOptions = WriteOptions(),
+                 write_concerns: Optional[Dict[str, WriteConcern]] = None,
+                 check_only: bool = False):
         self.database = database
-        self.collections = {}
-        self._init_collections()
-
-    def _init_collections(self):
-        for collection_name in RysolvCollections.__members__.keys():
-            try:
-                self.database.create_collection(collection_name)
-                if collection_name == RysolvCollections.Users.name:
-                    self.database[collection_name].create_index([("user_id", DESCENDING)],
-                                                                unique=True)
-                elif collection_name == RysolvCollections.Issues.name:
-                    self.database[collection_name].create_index([("id", DESCENDING)],
-                                                                unique=True)
-                elif collection_name == RysolvCollections.Comments.name:
-                    self.database[collection_name].create_index([("issue_id", DESCENDING)],
-                                                                unique=True)
-                elif collection_name == RysolvCollections.WatchIssues.name:
-                    self.database[collection_name].create_index([("user_id", DESCENDING),
-                                                                 ("issue_id", DESCENDING)],
-                                                                unique=True)
-                elif collection_name == RysolvCollections.Changelogs.name:
-                    self.database[collection_name].create_index([("version", DESCENDING)],
-                                                                unique=True)
-            except CollectionInvalid:
-                pass
-            self.collections[collection_name] = self.database[collection_name]
+        self.options = options
+        _write_concerns = dict(DEFAULT_WRITE_CONCERNS, **(write_concerns or {}))
+        self.collections = {
+            _name: database[_name].with_options(
+                write_concern=_write_concerns[WRITE_PROFILES[_name]])
+            for _name in RysolvCollections.__members__
+        }
+        # content hashes by collection name then document key, lazily loaded
+        self._hashes = {}
+        # (issue id, comment key) of stored comments, lazily loaded
+        self._comment_keys = None
+        _pending = self.reconcile(apply=not check_only)
+        if check_only and _pending:
+            raise SchemaMismatch(_pending)
 
     def write_changelog(self, changelog: Dict) -> UpdateResult:
         """
@@ -87,10 +582,7 @@ class RysolvDatabase:
         :return:
         """
         _filter = {"version": changelog["version"]}
-        _data_set = {"$set": changelog}
-        return self.collections[RysolvCollections.Changelogs.name].update_one(_filter,
-                                                                              _data_set,
-                                                                              upsert=True)
+        return self._upsert_one(RysolvCollections.Changelogs.name, _filter, changelog)
 
     def find_last_version(self) -> Optional[str]:
         """
@@ -106,105 +598,280 @@ class RysolvDatabase:
             _version = data[0]
         return _version
 
-    def write_comments(self, comments: List[Comment]) -> BulkWriteResult:
+    def write_comments(self, comments: List[Comment]) -> WriteSummary:
         """
 
-        write comments
+        insert comments which are not stored yet, a comment is identified by
+        its issue_id and comment_key
         :param comments:
         return:
         """
-        _operations = [UpdateOne({"issue_id": item["issue_id"]}, {"$set": item}, upsert=True)
-                       for item in comments]
-        return self.collections[RysolvCollections.Comments.name].bulk_write(_operations)
+        _keys = self._find_comment_keys()
+        _summary = WriteSummary()
+        _new = []
+        for item in comments:
+            if (item["issue_id"], item["comment_key"]) in _keys:
+                _summary.skip()
+            else:
+                _new.append(item)
+        BULK_WRITE_DOCUMENTS.inc(_summary.skipped_count,
+                                 collection=RysolvCollections.Comments.name,
+                                 result="skipped")
+        for _chunk in self._chunks(_new):
+            _operations = [UpdateOne({"issue_id": item["issue_id"],
+                                      "comment_key": item["comment_key"]},
+                                     {"$setOnInsert": item.to_document()},
+                                     upsert=True)
+                           for item in _chunk]
+            _summary.add(self._bulk_write(RysolvCollections.Comments.name, _operations))
+            _keys.update((item["issue_id"], item["comment_key"]) for item in _chunk)
+        return _summary
+
+    def _find_comment_keys(self) -> Set[Tuple[str, str]]:
+        if self._comment_keys is None:
+            cursor = self.collections[RysolvCollections.Comments.name].find(
+                {}, projection={"_id": 0, "issue_id": 1, "comment_key": 1})
+            self._comment_keys = {(item["issue_id"], item["comment_key"]) for item in cursor}
+        return self._comment_keys
+
+    @staticmethod
+    def comment_key(comment: Comment) -> str:
+        """
+
+        key of a comment within its issue
+        :param comment:
+        :return:
+        """
+        _data = "\x00".join([str(comment.get("userId")),
+                             str(comment.get("createdDate")),
+                             str(comment.get("githubUrl"))])
+        return hashlib.sha1(_data.encode("utf-8")).hexdigest()
 
-    def write_issues(self, issues: List[Issue]) -> BulkWriteResult:
+    def _bulk_write(self, collection_name: str, operations: List) -> BulkWriteResult:
+        """
+
+        bulk write, timed and counted, retried on transient errors since
+        every operation is an idempotent upsert, unordered unless configured
+        :param collection_name:
+        :param operations:
+        :return:
+        """
+        with BULK_WRITE_SECONDS.time(collection=collection_name):
+            _result = self._retry(collection_name,
+                                  lambda: self.collections[collection_name].bulk_write(
+                                      operations, ordered=self.options.ordered))
+        BULK_WRITE_DOCUMENTS.inc(_result.upserted_count,
+                                 collection=collection_name,
+                                 result="upserted")
+        BULK_WRITE_DOCUMENTS.inc(_result.modified_count,
+                                 collection=collection_name,
+                                 result="modified")
+        return _result
+
+    def _retry(self, collection_name: str, write: Callable[[], Any]) -> Any:
+        """
+
+        run write, retried with jittered exponential backoff on transient errors
+        :param collection_name:
+        :param write:
+        :return:
+        """
+        _attempt = 0
+        while True:
+            try:
+                return write()
+            except PyMongoError as error:
+                if _attempt >= self.options.max_retries or not is_transient(error):
+                    raise
+                WRITE_RETRIES.inc(collection=collection_name)
+                time.sleep(random.uniform(0, self.options.retry_backoff * 2 ** _attempt))
+                _attempt += 1
+
+    def _upsert_one(self, collection_name: str, _filter: Dict, _data: Dict) -> UpdateResult:
+        """
+
+        idempotent single document upsert, retried on transient errors
+        :param collection_name:
+        :param _filter:
+        :param _data:
+        :return:
+        """
+        return self._retry(collection_name,
+                           lambda: self.collections[collection_name].update_one(
+                               _filter, {"$set": _data}, upsert=True))
+
+    def _chunks(self, items: List) -> Iterator[List]:
+        for _index in range(0, len(items), self.options.batch_size):
+            yield items[_index:_index + self.options.batch_size]
+
+    def write_issues(self, issues: List[Issue]) -> WriteSummary:
         """
 
         write issues
         :param issues:
         return:
         """
-        _operations = [UpdateOne({"id": item["id"]}, {"$set": item}, upsert=True)
-                       for item in issues]
-        return self.collections[RysolvCollections.Issues.name].bulk_write(_operations)
+        return self._write_changed(RysolvCollections.Issues.name,
+                                   "id",
+                                   [_issue.to_document() for _issue in issues])
 
-    def find_comments(self, _filter: dict = None) -> List[Dict]:
+    def _write_changed(self, collection_name: str, key: str, documents: List[Dict]) -> WriteSummary:
         """
 
-        find watch issue
+        upsert only new or changed documents, in unordered chunks of batch_size
+        :param collection_name:
+        :param key:
+        :param documents:
         :return:
         """
-        return self.collections[RysolvCollections.Comments.name].find(_filter)
+        _hashes = self._find_hashes(collection_name, key)
+        _summary = WriteSummary()
+        _changed = []
+        for item in documents:
+            _hash = self.content_hash(item)
+            if _hashes.get(item[key]) == _hash:
+                _summary.skip()
+            else:
+                _changed.append((item, _hash))
+        BULK_WRITE_DOCUMENTS.inc(_summary.skipped_count,
+                                 collection=collection_name,
+                                 result="skipped")
+        for _chunk in self._chunks(_changed):
+            _operations = [UpdateOne({key: item[key]},
+                                     {"$set": {**item, HASH_FIELD: _hash}},
+                                     upsert=True)
+                           for item, _hash in _chunk]
+            _summary.add(self._bulk_write(collection_name, _operations))
+            _hashes.update((item[key], _hash) for item, _hash in _chunk)
+        return _summary
+
+    def _find_hashes(self, collection_name: str, key: str) -> Dict[str, str]:
+        if collection_name not in self._hashes:
+            cursor = self.collections[collection_name].find({},
+                                                            projection={"_id": 0,
+                                                                        key: 1,
+                                                                        HASH_FIELD: 1})
+            self._hashes[collection_name] = {item[key]: item.get(HASH_FIELD)
+                                             for item in cursor}
+        return self._hashes[collection_name]
+
+    @staticmethod
+    def content_hash(document: Dict) -> str:
+        """
 
-    def find_users(self) -> List[Dict]:
+        content hash of a document
+        :param document:
+        :return:
         """
+        _data = json.dumps(document, sort_keys=True, default=str)
+        return hashlib.sha1(_data.encode("utf-8")).hexdigest()
 
-        find users
+    def find_fingerprints(self) -> Dict[str, Dict]:
+        """
+
+        find issue fingerprints
+        :return: fingerprints by issue id
+        """
+        cursor = self.collections[RysolvCollections.Fingerprints.name].find({},
+                                                                            projection={"_id": 0})
+        return {item["issue_id"]: item for item in cursor}
+
+    def write_fingerprints(self, fingerprints: List[Dict]) -> WriteSummary:
+        """
+
+        write issue fingerprints
+        :param fingerprints:
         :return:
         """
-        return self.collections[RysolvCollections.Users.name].find({})
+        _summary = WriteSummary()
+        for _chunk in self._chunks(fingerprints):
+            _operations = [UpdateOne({"issue_id": item["issue_id"]}, {"$set": item}, upsert=True)
+                           for item in _chunk]
+            _summary.add(self._bulk_write(RysolvCollections.Fingerprints.name, _operations))
+        return _summary
+
+    def find_resume_token(self, name: str) -> Optional[Dict]:
+        """
 
-    def update_user(self, user_id: int) -> UpdateResult:
+        find change stream resume token
+        :param name: change stream name
+        :return:
         """
+        _document = self.collections[RysolvCollections.ResumeTokens.name].find_one({"name": name})
+        return _document["token"] if _document else None
 
-        update user
-        :param user_id:
+    def write_resume_token(self, name: str, token: Dict) -> UpdateResult:
+        """
+
+        write change stream resume token
+        :param name: change stream name
+        :param token:
         :return:
         """
-        _filter = {"user_id": user_id}
-        _data = {"user_id": user_id, "last_update": time.time()}
-        return self.collections[RysolvCollections.Users.name].update_one(_filter,
-                                                                                  {"$set": _data},
-                                                                                  upsert=True)
+        _filter = {"name": name}
+        _data = {"name": name, "token": token, "last_update": time.time()}
+        return self._upsert_one(RysolvCollections.ResumeTokens.name, _filter, _data)
 
-    def delete_user(self, user_id: int) -> DeleteResult:
+    def delete_resume_token(self, name: str) -> DeleteResult:
         """
 
-        delete user by user_id
-        :param user_id:
+        delete change stream resume token
+        :param name: change stream name
         :return:
         """
-        _filter = {"user_id": user_id}
-        return self.collections[RysolvCollections.Users.name].delete_one(_filter)
+        return self.collections[RysolvCollections.ResumeTokens.name].delete_one({"name": name})
 
-    def update_watch_issue(self, user_id: int, issue_id: str) -> UpdateResult:
+    def find_comments(self, _filter: dict = None) -> List[Dict]:
         """
 
-        update watch issue
+        find watch issue
+        :return:
+        """
+        return self.collections[RysolvCollections.Comments.name].find(_filter)
+
+    def find_users(self) -> List[Dict]:
+        """
+
+        find users
+        :return:
+        """
+        return self.collections[RysolvCollections.Users.name].find({})
+
+    def find_user(self, user_id: int) -> Optional[Dict]:
+        """
+
+        find registered user
         :param user_id:
-        :param issue_id:
         :return:
         """
-        _filter = {"user_id": user_id, "issue_id": issue_id}
-        _data = {"user_id": user_id, "issue_id": issue_id, "last_update": time.time()}
-        return self.collections[RysolvCollections.WatchIssues.name].update_one(_filter,
-                                                                               {"$set": _data},
-                                                                               upsert=True)
+        return self.collections[RysolvCollections.Users.name].find_one({"user_id": user_id})
 
-    def delete_watch_issue(self, user_id: int, issue_id: str) -> DeleteResult:
+    def update_user(self, user_id: int) -> UpdateResult:
         """
 
-        delete watch issue
+        update user
         :param user_id:
-        :param issue_id:
         :return:
         """
-        _filter = {"user_id": user_id, "issue_id": issue_id}
-        return self.collections[RysolvCollections.WatchIssues.name].delete_one(_filter)
+        _filter = {"user_id": user_id}
+        _data = {"user_id": user_id, "last_update": time.time()}
+        return self._upsert_one(RysolvCollections.Users.name, _filter, _data)
 
-    def find_watch_issues(self, _filter: dict = None) -> List[Dict]:
+    def delete_user(self, user_id: int) -> DeleteResult:
         """
 
-        find watch issue
+        delete user by user_id
+        :param user_id:
         :return:
         """
-        return self.collections[RysolvCollections.WatchIssues.name].find(_filter)
+        _filter = {"user_id": user_id}
+        return self.collections[RysolvCollections.Users.name].delete_one(_filter)
 
-    def clear(self) -> None:
+    def reset_caches(self) -> None:
         """
 
-        clear database
+        drop content hashes and comment keys, lazily reloaded
         :return:
         """
-        for collection_name in RysolvCollections.__members__.keys():
-            self.database.drop_collection(collection_name)
+        self._hashes = {}
+        self._comment_keys = None
@@ -0,0 +1,114 @@
+"""
+
+digest module, notifications of users in digest mode are buffered in the
+DigestBuffer collection and flushed as combined messages once due
+"""
+from typing import Optional
+from logging import Logger
+import re
+import time
+
+from .database import RysolvDatabase
+from .leader import LeaderLease
+from .render import render_digest
+from .metrics import DIGEST_NOTIFICATIONS
+from .worker import Worker
+
+# /digest periods, e.g. 15m, 1h, 1d
+PERIOD_REGEX = re.compile(r"^(\d+)([mhd])$")
+PERIOD_UNITS = {"m": 60, "h": 3600, "d": 86400}
+MIN_PERIOD = 5 * 60
+
+
+def parse_period(text: str) -> Optional[float]:
+    """
+
+    parse a digest period
+    :param text: like 15m, 1h or off
+    :return: seconds, None for off
+    """
+    _text = text.strip().lower()
+    if _text in ("off", "none", "0"):
+        return None
+    _match = PERIOD_REGEX.match(_text)
+    if not _match:
+        raise ValueError(f"Unknown digest period {text}, use e.g. 15m, 1h, 1d or off")
+    _period = int(_match.group(1)) * PERIOD_UNITS[_match.group(2)]
+    if _period < MIN_PERIOD:
+        raise ValueError(f"Digest period must be at least {MIN_PERIOD // 60}m")
+    return float(_period)
+
+
+def format_period(period: float) -> str:
+    """
+
+    format a digest period
+    :param period: seconds
+    :return:
+    """
+    for _unit, _seconds in sorted(PERIOD_UNITS.items(), key=lambda _item: -_item[1]):
+        if period % _seconds == 0:
+            return f"{int(period // _seconds)}{_unit}"
+    return f"{period:g}s"
+
+
+class DigestFlusher:
+    """
+
+    DigestFlusher class, write due digests of every user to the outbox,
+    only while holding the lease when replicas share the buffer
+    """
+    def __init__(self,
+                 database: RysolvDatabase,
+                 logger: Logger,
+                 interval: float = 30.0,
+                 leader: Optional[LeaderLease] = None):
+        self.database = database
+        self.logger = logger
+        self.interval = interval
+        self.leader = leader
+        self._worker = Worker(self._step, "digest")
+
+    def start(self) -> None:
+        """
+
+        start flushing thread, calling it again is a no-op
+        :return:
+        """
+        self._worker.start()
+
+    def stop(self) -> None:
+        """
+
+        stop flushing thread
+        :return:
+        """
+        self._worker.stop()
+
+    def flush_due(self, now: float) -> int:
+        """
+
+        write due digests to the outbox, a crash between writing a digest
+        and deleting its buffered notifications sends it again
+        :param now:
+        :return: number of digest messages
+        """
+        _messages = 0
+        for _user_id in self.database.find_due_digest_users(now):
+            _entries = self.database.find_digest_entries(_user_id, now)
+            if not _entries:
+                continue
+            for _text in render_digest([_entry["text"] for _entry in _entries]):
+                self.database.write_outbox(_text, [_user_id])
+                _messages += 1
+            self.database.delete_digest_entries([_entry["_id"] for _entry in _entries])
+            DIGEST_NOTIFICATIONS.inc(len(_entries), stage="flushed")
+        return _messages
+
+    def _step(self) -> float:
+        if self.leader is None or self.leader.is_leader():
+            try:
+                self.flush_due(time.time())
+            except Exception: # pylint: disable=broad-except
+                self.logger.exception("Fail to flush digests")
+        return self.interval
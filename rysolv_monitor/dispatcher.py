@@ -0,0 +1,234 @@
+"""
+
+dispatcher module
+"""
+from typing import Callable, Dict, NamedTuple, Optional
+from logging import Logger
+from queue import Queue
+from threading import Lock, Thread
+import time
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+
+from .ratelimit import ChatRateLimiter
+from .metrics import (
+    NOTIFICATIONS,
+    NOTIFICATION_SEND_SECONDS,
+    NOTIFICATION_QUEUE_DEPTH
+)
+
+
+class DispatcherOptions(NamedTuple):
+    """
+
+    DispatcherOptions class, workers, queue bound, rate limits and retries
+    """
+    workers: int = 4
+    # submit blocks past this many waiting messages
+    queue_size: int = 10000
+    # messages per second, over all chats and per chat
+    global_rate: float = 25.0
+    chat_rate: float = 1.0
+    # sends retried on telegram flood control
+    max_retries: int = 3
+
+
+class _SendStats:
+    """
+
+    _SendStats class, thread safe counters of the dispatcher
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self._counters = {
+            "sent": 0,
+            "failed": 0,
+            "rate_limited": 0,
+            "send_time": 0.0,
+            "max_send_time": 0.0,
+        }
+
+    def incr(self, name: str) -> None:
+        """
+
+        increment a counter
+        :param name:
+        :return:
+        """
+        with self._lock:
+            self._counters[name] += 1
+
+    def sent(self, elapsed: float) -> None:
+        """
+
+        count a sent message
+        :param elapsed: send duration
+        :return:
+        """
+        with self._lock:
+            self._counters["sent"] += 1
+            self._counters["send_time"] += elapsed
+            self._counters["max_send_time"] = max(self._counters["max_send_time"], elapsed)
+
+    def snapshot(self) -> Dict:
+        """
+
+        copy of the counters
+        :return:
+        """
+        with self._lock:
+            return dict(self._counters)
+
+
+class NotificationDispatcher:
+    """
+
+    NotificationDispatcher class, send messages from a bounded queue with a
+    pool of workers, within telegram global and per chat rate limits
+    """
+    # idle chat buckets are pruned past this size
+    MAX_CHAT_BUCKETS = 10000
+    # delivery results
+    SENT = "sent"
+    FAILED = "failed"
+    RETRY = "retry"
+
+    def __init__(self,
+                 send: Callable[[int, str], None],
+                 logger: Logger,
+                 options: DispatcherOptions = DispatcherOptions()):
+        self.send = send
+        self.logger = logger
+        self.options = options
+        self._queue = Queue(maxsize=options.queue_size)
+        self._limiter = ChatRateLimiter(options.global_rate,
+                                        options.chat_rate,
+                                        max_chats=self.MAX_CHAT_BUCKETS)
+        self._threads = []
+        self._stats = _SendStats()
+        NOTIFICATION_QUEUE_DEPTH.set_function(lambda: self.queue_depth)
+
+    def start(self) -> None:
+        """
+
+        start workers, calling it again is a no-op
+        :return:
+        """
+        if self._threads:
+            return
+        for _index in range(self.options.workers):
+            _thread = Thread(target=self._work, name=f"notifier-{_index}", daemon=True)
+            _thread.start()
+            self._threads.append(_thread)
+
+    def stop(self) -> None:
+        """
+
+        stop workers once the queue is drained
+        :return:
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        for _thread in self._threads:
+            _thread.join()
+        self._threads = []
+
+    def submit(self,
+               user_id: int,
+               text: str,
+               done: Optional[Callable[[int, str], None]] = None) -> None:
+        """
+
+        enqueue a message, block while the queue is full
+        :param user_id:
+        :param text:
+        :param done: called with user_id and the delivery result, one of
+        SENT, FAILED or RETRY, from a worker thread
+        :return:
+        """
+        self._queue.put((user_id, text, done))
+
+    def join(self) -> None:
+        """
+
+        wait until every submitted message has been handled
+        :return:
+        """
+        self._queue.join()
+
+    @property
+    def queue_depth(self) -> int:
+        """
+
+        number of messages waiting to be sent
+        :return:
+        """
+        return self._queue.qsize()
+
+    def stats(self) -> Dict:
+        """
+
+        snapshot of dispatcher counters
+        :return:
+        """
+        _stats = self._stats.snapshot()
+        _stats["queue_depth"] = self.queue_depth
+        _stats["avg_send_time"] = _stats["send_time"] / _stats["sent"] if _stats["sent"] else 0.0
+        return _stats
+
+    def _work(self) -> None:
+        while True:
+            _item = self._queue.get()
+            try:
+                if _item is None:
+                    return
+                _user_id, _text, _done = _item
+                try:
+                    _result = self._deliver(_user_id, _text)
+                except Exception: # pylint: disable=broad-except
+                    self.logger.exception("Unexpected error while sending notification")
+                    _result = self.RETRY
+                if _done is not None:
+                    _done(_user_id, _result)
+            except Exception: # pylint: disable=broad-except
+                self.logger.exception("Unexpected error while reporting notification")
+            finally:
+                self._queue.task_done()
+
+    def _deliver(self, user_id: int, text: str) -> str:
+        _attempt = 0
+        while True:
+            _wait = self._limiter.reserve(user_id)
+            if _wait:
+                time.sleep(_wait)
+            _start = time.monotonic()
+            try:
+                self.send(user_id, text)
+            except RetryAfter as error:
+                self._incr("rate_limited")
+                if _attempt >= self.options.max_retries:
+                    self.logger.warning("Give up sending to %s after %d retries", user_id, _attempt)
+                    self._incr("failed")
+                    return self.RETRY
+                self.logger.info("Rate limited, retry sending to %s in %ss",
+                                 user_id,
+                                 error.retry_after)
+                time.sleep(error.retry_after)
+                _attempt += 1
+                continue
+            except TelegramError as error:
+                self.logger.warning("Fail to send message to %s: %s", user_id, error)
+                self._incr("failed")
+                # network errors and timeouts may pass later, blocked chats won't
+                if isinstance(error, NetworkError) and not isinstance(error, BadRequest):
+                    return self.RETRY
+                return self.FAILED
+            _elapsed = time.monotonic() - _start
+            NOTIFICATIONS.inc(result="sent")
+            NOTIFICATION_SEND_SECONDS.observe(_elapsed)
+            self._stats.sent(_elapsed)
+            return self.SENT
+
+    def _incr(self, name: str) -> None:
+        NOTIFICATIONS.inc(result=name)
+        self._stats.incr(name)
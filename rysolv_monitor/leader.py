@@ -0,0 +1,135 @@
+"""
+
+leader module, lease based leader election stored in mongodb so only one
+replica runs a component while the others stand by
+"""
+from logging import Logger
+from threading import Event
+import os
+import socket
+import time
+import uuid
+
+from .database import RysolvDatabase
+from .metrics import LEADER
+from .worker import Worker
+
+
+class LeaseLost(Exception):
+    """
+
+    LeaseLost class, raised by a leader's work once its lease lapsed
+    """
+
+
+class _Term(Event):
+    """
+
+    _Term class, set while this replica leads, until is the monotonic time the
+    held lease lapses at, measured from before the renewal request so it
+    lapses here first
+    """
+    def __init__(self):
+        super().__init__()
+        self.until = 0.0
+
+    def is_valid(self) -> bool:
+        """
+
+        is the held lease unexpired
+        :return:
+        """
+        return time.monotonic() < self.until
+
+
+class LeaderLease:
+    """
+
+    LeaderLease class, renew a named lease every ttl / 3 seconds, a standby
+    replica takes it over once the leader missed renewing it for ttl seconds
+    """
+    def __init__(self, database: RysolvDatabase, name: str, logger: Logger, ttl: float = 10.0):
+        self.database = database
+        self.name = name
+        self.logger = logger
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._term = _Term()
+        self._worker = Worker(self._step, f"lease-{name}")
+
+    def start(self) -> None:
+        """
+
+        start heartbeat thread, calling it again is a no-op
+        :return:
+        """
+        self._worker.start()
+
+    def stop(self) -> None:
+        """
+
+        stop heartbeats and release the lease so a standby takes over now
+        :return:
+        """
+        self._worker.stop()
+        if self._term.is_set():
+            self._term.until = 0.0
+            self._set_leader(False)
+            try:
+                self.database.release_lease(self.name, self.owner)
+            except Exception: # pylint: disable=broad-except
+                self.logger.exception("Fail to release lease %s", self.name)
+
+    def renew(self) -> bool:
+        """
+
+        take or renew the lease once
+        :return: whether this replica is the leader
+        """
+        _start = time.monotonic()
+        try:
+            _acquired = self.database.acquire_lease(self.name, self.owner, self.ttl)
+        except Exception: # pylint: disable=broad-except
+            self.logger.exception("Fail to renew lease %s", self.name)
+            _acquired = False
+        if _acquired:
+            self._term.until = _start + self.ttl
+        # a failed renewal keeps the lease until it lapses, a standby can't
+        # take it before
+        self._set_leader(self.is_leader())
+        return self._term.is_set()
+
+    def is_leader(self) -> bool:
+        """
+
+        does this replica hold an unexpired lease
+        :return:
+        """
+        return self._term.is_valid()
+
+    def wait(self, timeout: float) -> bool:
+        """
+
+        wait to be the leader
+        :param timeout: seconds
+        :return: whether this replica is the leader
+        """
+        if self._term.wait(timeout) and not self.is_leader():
+            # lapsed while heartbeats are late
+            self._set_leader(False)
+            self._worker.wait(timeout)
+        return self.is_leader()
+
+    def _set_leader(self, leader: bool) -> None:
+        if leader != self._term.is_set():
+            if leader:
+                self.logger.info("Lead %s as %s", self.name, self.owner)
+                self._term.set()
+            else:
+                self.logger.info("Stand by for %s as %s", self.name, self.owner)
+                self._term.clear()
+        LEADER.set(int(leader), name=self.name)
+
+    def _step(self) -> float:
+        self.renew()
+        return self.ttl / 3
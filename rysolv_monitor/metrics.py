@@ -0,0 +1,388 @@
+"""
+
+metrics module, prometheus text exposition
+"""
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+import bisect
+import time
+
+# default histogram buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    _pairs = [f'{_name}="{_escape_label(str(_value))}"'
+              for _name, _value in zip(labelnames, values)]
+    if extra:
+        _pairs.append(extra)
+    return "{" + ",".join(_pairs) + "}" if _pairs else ""
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """
+
+    _Metric class, base of labelled metrics
+    """
+    TYPE = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = Lock()
+        self._values: Dict[Tuple, object] = {}
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(labels.get(_name, "") for _name in self.labelnames)
+
+    def render(self) -> List[str]:
+        """
+
+        exposition lines
+        :return:
+        """
+        _lines = [f"# HELP {self.name} {self.documentation}",
+                  f"# TYPE {self.name} {self.TYPE}"]
+        with self._lock:
+            _items = sorted(self._values.items())
+        for _key, _value in _items:
+            _lines.extend(self._render_sample(_key, _value))
+        return _lines
+
+    def clear(self) -> None:
+        """
+
+        drop every sample, e.g. of label values no longer reported
+        :return:
+        """
+        with self._lock:
+            self._values.clear()
+
+    def _render_sample(self, key: Tuple, value) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    """
+
+    Counter class
+    """
+    TYPE = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """
+
+        increment counter
+        :param amount:
+        :param labels:
+        :return:
+        """
+        _key = self._key(labels)
+        with self._lock:
+            self._values[_key] = self._values.get(_key, 0) + amount
+
+    def value(self, **labels) -> float:
+        """
+
+        current value
+        :param labels:
+        :return:
+        """
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """
+
+    Gauge class, set directly or read from a function at scrape time
+    """
+    TYPE = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._functions: Dict[Tuple, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels) -> None:
+        """
+
+        set gauge
+        :param value:
+        :param labels:
+        :return:
+        """
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, function: Callable[[], float], **labels) -> None:
+        """
+
+        read gauge from function at scrape time
+        :param function:
+        :param labels:
+        :return:
+        """
+        with self._lock:
+            self._functions[self._key(labels)] = function
+
+    def render(self) -> List[str]:
+        with self._lock:
+            _functions = list(self._functions.items())
+        for _key, _function in _functions:
+            _value = _function()
+            with self._lock:
+                self._values[_key] = _value
+        return super().render()
+
+
+class Histogram(_Metric):
+    """
+
+    Histogram class
+    """
+    TYPE = "histogram"
+
+    def __init__(self,
+                 name: str,
+                 documentation: str,
+                 labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        """
+
+        observe a value
+        :param value:
+        :param labels:
+        :return:
+        """
+        _key = self._key(labels)
+        _index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            _sample = self._values.get(_key)
+            if _sample is None:
+                # [per bucket counts, +Inf count, sum]
+                _sample = [[0] * len(self.buckets), 0, 0.0]
+                self._values[_key] = _sample
+            if _index < len(self.buckets):
+                _sample[0][_index] += 1
+            _sample[1] += 1
+            _sample[2] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """
+
+        observe duration of the block
+        :param labels:
+        :return:
+        """
+        _start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - _start, **labels)
+
+    def count(self, **labels) -> int:
+        """
+
+        number of observations
+        :param labels:
+        :return:
+        """
+        with self._lock:
+            _sample = self._values.get(self._key(labels))
+            return _sample[1] if _sample else 0
+
+    def sum(self, **labels) -> float:
+        """
+
+        sum of observations
+        :param labels:
+        :return:
+        """
+        with self._lock:
+            _sample = self._values.get(self._key(labels))
+            return _sample[2] if _sample else 0.0
+
+    def _render_sample(self, key: Tuple, value) -> List[str]:
+        _counts, _total, _sum = value
+        _lines = []
+        _cumulative = 0
+        for _bound, _count in zip(self.buckets, _counts):
+            _cumulative += _count
+            _labels = _format_labels(self.labelnames, key, f'le="{_format_value(_bound)}"')
+            _lines.append(f"{self.name}_bucket{_labels} {_cumulative}")
+        _labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+        _lines.append(f"{self.name}_bucket{_labels} {_total}")
+        _labels = _format_labels(self.labelnames, key)
+        _lines.append(f"{self.name}_sum{_labels} {_format_value(_sum)}")
+        _lines.append(f"{self.name}_count{_labels} {_total}")
+        return _lines
+
+
+class MetricsRegistry:
+    """
+
+    MetricsRegistry class
+    """
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        """
+
+        register a metric, a metric with the same name is returned instead
+        :param metric:
+        :return:
+        """
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        """
+
+        register counter
+        """
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        """
+
+        register gauge
+        """
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self,
+                  name: str,
+                  documentation: str,
+                  labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        """
+
+        register histogram
+        """
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """
+
+        prometheus text exposition of every metric
+        :return:
+        """
+        with self._lock:
+            _metrics = list(self._metrics.values())
+        _lines = []
+        for _metric in _metrics:
+            _lines.extend(_metric.render())
+        return "\n".join(_lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# crawler
+QUERY_SECONDS = REGISTRY.histogram("rysolv_query_seconds",
+                                   "Latency of rysolv graphql requests",
+                                   ("status",))
+CRAWL_CYCLE_SECONDS = REGISTRY.histogram("rysolv_crawl_cycle_seconds",
+                                         "Duration of crawl cycles",
+                                         buckets=(1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+CRAWL_ISSUES = REGISTRY.gauge("rysolv_crawl_issues",
+                              "Issues of the last crawl cycle by state",
+                              ("state",))
+CRAWL_COMMENTS = REGISTRY.counter("rysolv_crawl_comments_total",
+                                  "Comments fetched")
+# database
+BULK_WRITE_SECONDS = REGISTRY.histogram("rysolv_bulk_write_seconds",
+                                        "Latency of bulk writes",
+                                        ("collection",))
+BULK_WRITE_DOCUMENTS = REGISTRY.counter("rysolv_bulk_write_documents_total",
+                                        "Documents of bulk writes by result",
+                                        ("collection", "result"))
+WRITE_RETRIES = REGISTRY.counter("rysolv_write_retries_total",
+                                 "Writes retried after a transient error",
+                                 ("collection",))
+# replicas
+LEADER = REGISTRY.gauge("rysolv_leader",
+                        "1 when this replica holds the lease",
+                        ("name",))
+# bot
+CHANGE_EVENTS = REGISTRY.counter("rysolv_change_events_total",
+                                 "Change stream events received",
+                                 ("collection", "operation"))
+NOTIFICATIONS = REGISTRY.counter("rysolv_notifications_total",
+                                 "Notifications by result",
+                                 ("result",))
+NOTIFICATION_SEND_SECONDS = REGISTRY.histogram("rysolv_notification_send_seconds",
+                                               "Latency of telegram send_message")
+OUTBOX_JOBS = REGISTRY.counter("rysolv_outbox_jobs_total",
+                               "Outbox jobs completed by result",
+                               ("result",))
+DIGEST_NOTIFICATIONS = REGISTRY.counter("rysolv_digest_notifications_total",
+                                        "Notifications of users in digest mode by stage",
+                                        ("stage",))
+NOTIFICATION_QUEUE_DEPTH = REGISTRY.gauge("rysolv_notification_queue_depth",
+                                          "Notifications waiting to be sent")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """
+
+    _MetricsHandler class
+    """
+    registry = REGISTRY
+
+    def do_GET(self): # pylint: disable=invalid-name
+        """
+
+        serve metrics
+        """
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        _body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(_body)))
+        self.end_headers()
+        self.wfile.write(_body)
+
+    def log_message(self, format, *args):
+        """
+
+        requests are not logged
+        """
+
+
+def start_metrics_server(port: int,
+                         host: str = "127.0.0.1",
+                         registry: Optional[MetricsRegistry] = None) -> ThreadingHTTPServer:
+    """
+
+    serve metrics on http://host:port/metrics from a daemon thread
+    :param port:
+    :param host:
+    :param registry:
+    :return:
+    """
+    _handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry or REGISTRY})
+    _server = ThreadingHTTPServer((host, port), _handler)
+    _server.daemon_threads = True
+    Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+    return _server
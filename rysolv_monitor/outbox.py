@@ -0,0 +1,234 @@
+"""
+
+outbox module, notification jobs are persisted in the Outbox collection and
+drained by sender workers, possibly in several processes, claiming jobs by
+lease so a crashed sender's jobs are sent again once its lease expires
+"""
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+from logging import Logger
+from threading import Condition, Lock
+import os
+import socket
+import time
+import uuid
+
+from .database import RysolvDatabase, OUTBOX_PARTITIONS
+from .dispatcher import NotificationDispatcher
+from .metrics import OUTBOX_JOBS
+from .worker import Worker
+
+
+def sender_partitions(index: int, count: int) -> List[int]:
+    """
+
+    outbox partitions drained by a sender out of count
+    :param index: sender index, from 0 to count - 1
+    :param count: number of senders
+    :return:
+    """
+    if not 0 <= index < count:
+        raise ValueError(f"Sender index {index} out of range of {count} senders")
+    return [_partition for _partition in range(OUTBOX_PARTITIONS) if _partition % count == index]
+
+
+class SenderOptions(NamedTuple):
+    """
+
+    SenderOptions class, drained partitions, job leases and retries
+    """
+    partitions: Sequence[int] = tuple(range(OUTBOX_PARTITIONS))
+    # seconds a claimed job is held before another sender may claim it
+    lease: float = 60.0
+    poll_interval: float = 1.0
+    max_attempts: int = 5
+    # seconds per attempt before recipients of a job are retried
+    retry_backoff: float = 30.0
+    # messages handed to the dispatcher and not sent yet, bounded so
+    # leased jobs are done well before their lease expires
+    max_pending: int = 500
+
+
+class OutboxSender:
+    """
+
+    OutboxSender class, claim jobs of its partitions, deliver them through
+    the dispatcher and persist their status, delivery is at least once
+    """
+    def __init__(self,
+                 database: RysolvDatabase,
+                 dispatcher: NotificationDispatcher,
+                 logger: Logger,
+                 options: SenderOptions = SenderOptions()):
+        self.database = database
+        self.dispatcher = dispatcher
+        self.logger = logger
+        self.options = options
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._in_flight = _InFlight(options.max_pending)
+        self._worker = Worker(self._step, "outbox-sender")
+
+    def start(self) -> None:
+        """
+
+        start claiming thread, calling it again is a no-op
+        :return:
+        """
+        self._worker.start()
+
+    def stop(self) -> None:
+        """
+
+        stop claiming jobs, jobs in flight are still completed
+        :return:
+        """
+        self._worker.stop()
+
+    def run(self) -> None:
+        """
+
+        claim and send jobs until stopped
+        :return:
+        """
+        self.logger.info("Run outbox sender %s on %d partitions",
+                         self.owner,
+                         len(self.options.partitions))
+        self._worker.run()
+
+    def _step(self) -> float:
+        if not self._in_flight.wait(self.options.poll_interval):
+            return 0.0
+        try:
+            _claimed = self.drain_once()
+        except Exception: # pylint: disable=broad-except
+            self.logger.exception("Fail to claim outbox jobs")
+            _claimed = False
+        return 0.0 if _claimed else self.options.poll_interval
+
+    def drain_once(self) -> bool:
+        """
+
+        claim one job and hand it to the dispatcher
+        :return: whether a job was claimed
+        """
+        _job = self.database.claim_outbox_job(self.owner,
+                                              list(self.options.partitions),
+                                              self.options.lease)
+        if _job is None:
+            return False
+        _delivered = set(_job.get("delivered") or ())
+        _user_ids = [_user_id for _user_id in _job["user_ids"] if _user_id not in _delivered]
+        if _job["attempts"] > self.options.max_attempts:
+            self.logger.warning("Give up outbox job %s after %d attempts",
+                                _job["_id"],
+                                _job["attempts"] - 1)
+            self._complete(_job, [], _user_ids)
+            return True
+        if not _user_ids:
+            self._complete(_job, [], [])
+            return True
+        _tracker = _JobTracker(_job, _user_ids)
+        self._in_flight.add(len(_user_ids))
+        for _user_id in _user_ids:
+            self.dispatcher.submit(_user_id,
+                                   _job["text"],
+                                   lambda user_id, result, tracker=_tracker:
+                                   self._on_result(tracker, user_id, result))
+        return True
+
+    def _on_result(self, tracker: "_JobTracker", user_id: int, result: str) -> None:
+        self._in_flight.done()
+        if tracker.add(user_id, result):
+            self._complete(tracker.job, *tracker.results())
+
+    def _complete(self, job: Dict, delivered: List[int], retry: List[int]) -> None:
+        _retry_at = None
+        if retry and job["attempts"] < self.options.max_attempts:
+            _retry_at = time.time() + self.options.retry_backoff * job["attempts"]
+        _result = self.database.complete_outbox_job(job["_id"],
+                                                    self.owner,
+                                                    delivered,
+                                                    retry,
+                                                    _retry_at)
+        if not _result.matched_count:
+            self.logger.warning("Lease of outbox job %s expired before completion", job["_id"])
+        _status = "retry" if _retry_at is not None else "failed" if retry else "sent"
+        OUTBOX_JOBS.inc(result=_status)
+
+
+class _InFlight:
+    """
+
+    _InFlight class, bounded count of messages handed to the dispatcher
+    """
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._count = 0
+        self._condition = Condition()
+
+    def add(self, count: int) -> None:
+        """
+
+        count messages handed to the dispatcher
+        :param count:
+        :return:
+        """
+        with self._condition:
+            self._count += count
+
+    def done(self) -> None:
+        """
+
+        count a message handled by the dispatcher
+        :return:
+        """
+        with self._condition:
+            self._count -= 1
+            self._condition.notify_all()
+
+    def wait(self, timeout: float) -> bool:
+        """
+
+        wait until fewer messages than limit are in flight
+        :param timeout: seconds
+        :return: whether there are
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._count < self.limit, timeout)
+
+
+class _JobTracker:
+    """
+
+    _JobTracker class, delivery results of a job's recipients
+    """
+    def __init__(self, job: Dict, user_ids: List[int]):
+        self.job = job
+        self._delivered: List[int] = []
+        self._retry: List[int] = []
+        self._remaining = len(user_ids)
+        self._lock = Lock()
+
+    def add(self, user_id: int, result: str) -> bool:
+        """
+
+        record a recipient result
+        :param user_id:
+        :param result: dispatcher result
+        :return: whether every recipient is done
+        """
+        with self._lock:
+            if result == NotificationDispatcher.SENT:
+                self._delivered.append(user_id)
+            elif result == NotificationDispatcher.RETRY:
+                self._retry.append(user_id)
+            self._remaining -= 1
+            return self._remaining == 0
+
+    def results(self) -> Tuple[List[int], List[int]]:
+        """
+
+        recipients done so far
+        :return: delivered user ids and user ids to retry
+        """
+        with self._lock:
+            return list(self._delivered), list(self._retry)
@@ -0,0 +1,122 @@
+"""
+
+ratelimit module
+"""
+from threading import Lock
+from typing import Dict, List, Optional
+import time
+
+
+class TokenBucket:
+    """
+
+    TokenBucket class, thread safe token bucket with reservations
+    """
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = Lock()
+
+    def _refill(self) -> None:
+        _now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (_now - self._updated) * self.rate)
+        self._updated = _now
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        """
+
+        take tokens, the bucket may go in debt so concurrent callers queue up
+        :param tokens:
+        :return: seconds to wait before using the tokens
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= tokens
+            return max(0.0, -self._tokens / self.rate)
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """
+
+        take tokens only when available now
+        :param tokens:
+        :return: whether tokens were taken
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens < tokens:
+                return False
+            self._tokens -= tokens
+            return True
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """
+
+        take tokens and wait until they are available
+        :param tokens:
+        :return: waited seconds
+        """
+        _wait = self.reserve(tokens)
+        if _wait:
+            time.sleep(_wait)
+        return _wait
+
+    def is_full(self) -> bool:
+        """
+
+        is the bucket full, i.e. unused since at least capacity / rate seconds
+        :return:
+        """
+        with self._lock:
+            self._refill()
+            return self._tokens >= self.capacity
+
+
+class ChatRateLimiter:
+    """
+
+    ChatRateLimiter class, a global token bucket plus one bucket per chat,
+    buckets of idle chats are pruned past max_chats
+    """
+    def __init__(self, global_rate: float, chat_rate: float, max_chats: int = 10000):
+        self.chat_rate = chat_rate
+        self.max_chats = max_chats
+        self._global_bucket = TokenBucket(global_rate)
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._lock = Lock()
+
+    def reserve(self, chat_id: int) -> float:
+        """
+
+        take a token of the chat and a global one
+        :param chat_id:
+        :return: seconds to wait before sending to the chat
+        """
+        return max(self._chat_bucket(chat_id).reserve(), self._global_bucket.reserve())
+
+    def prune(self) -> int:
+        """
+
+        forget buckets of chats idle long enough for them to be full
+        :return: number of pruned buckets
+        """
+        with self._lock:
+            return self._prune()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        with self._lock:
+            _bucket = self._chat_buckets.get(chat_id)
+            if _bucket is None:
+                if len(self._chat_buckets) >= self.max_chats:
+                    self._prune()
+                _bucket = TokenBucket(self.chat_rate)
+                self._chat_buckets[chat_id] = _bucket
+            return _bucket
+
+    def _prune(self) -> int:
+        _idle: List[int] = [_chat_id for _chat_id, _bucket in self._chat_buckets.items()
+                            if _bucket.is_full()]
+        for _chat_id in _idle:
+            del self._chat_buckets[_chat_id]
+        return len(_idle)
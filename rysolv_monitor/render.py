@@ -0,0 +1,294 @@
+"""
+
+render module, MarkdownV2 messages
+"""
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from .utils import (
+    escape,
+    url_from_issue
+)
+
+# templates, static parts are already escaped
+NEW_ISSUE_TEMPLATE = "*New {type} from {organization}*\n" \
+                     r"Name\: {name}" \
+                     r"\- Language\: {language}" "\n" \
+                     r" Funded amount\: {funded_amount}$ \- {comments} comments" \
+                     r" \- {attempting} attemptings" "\n" \
+                     "[Rysolv]({url})\n" \
+                     "[Github]({repo})\n" \
+                     r"Last update\: {modified_date}"
+ISSUE_UPDATE_TEMPLATE = "New modification on issue [{issue_id}]({url})"
+CHANGED_FIELDS_TEMPLATE = r"Changed\: {fields}"
+COMMENT_TEMPLATE = r"\- *{username}*\: {snippet}"
+# max length of a comment body in notifications
+SNIPPET_LENGTH = 100
+WATCHERS_TEMPLATE = "*List of watchers:*\n{watchers}"
+WATCHER_TEMPLATE = r"\* Issue [{issue_id}]({url})"
+NO_WATCHER = "No watcher found"
+# prefix of watchers page navigation callbacks
+WATCHERS_CALLBACK = "watchers"
+FILTER_TEMPLATE = "*New issues filter:*\n{criteria}"
+FILTER_CRITERION_TEMPLATE = r"\- {name}\: {values}"
+NO_FILTER = "No filter, you get every new issue"
+DIGEST_TEMPLATE = r"*Digest, {count} notifications*"
+DIGEST_SEPARATOR = "\n\n"
+# telegram max message length
+MESSAGE_LENGTH = 4096
+# suffix of a line cut to fit in a message
+TRUNCATED = "…"
+
+
+class RenderCache:
+    """
+
+    RenderCache class, thread safe LRU cache of rendered messages
+    """
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[str]:
+        """
+
+        get rendered message
+        :param key:
+        :return:
+        """
+        with self._lock:
+            _value = self._data.get(key)
+            if _value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._data.move_to_end(key)
+            return _value
+
+    def put(self, key: Hashable, value: str) -> None:
+        """
+
+        store rendered message
+        :param key:
+        :param value:
+        :return:
+        """
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        """
+
+        clear cache
+        :return:
+        """
+        with self._lock:
+            self._data.clear()
+
+
+# rendered new issue messages by (issue id, modifiedDate)
+ISSUE_CACHE = RenderCache()
+
+
+def render_issue(issue: Dict) -> str:
+    """
+
+    render new issue message, once per issue version
+    :param issue:
+    :return:
+    """
+    _key = (issue.get("id"), issue.get("modifiedDate"))
+    _text = ISSUE_CACHE.get(_key)
+    if _text is None:
+        _text = NEW_ISSUE_TEMPLATE.format(
+            type=escape(issue.get("type") or ""),
+            organization=escape(issue.get("organizationName") or ""),
+            name=escape(issue.get("name") or ""),
+            language=escape(",".join(issue.get("language") or [])),
+            funded_amount=escape(str(issue.get("fundedAmount"))),
+            comments=escape(str(issue.get("comments"))),
+            attempting=len(issue.get("attempting") or []),
+            url=url_from_issue(issue.get("id")),
+            repo=issue.get("repo"),
+            modified_date=escape(str(issue.get("modifiedDate"))))
+        ISSUE_CACHE.put(_key, _text)
+    return _text
+
+
+def render_issue_update(issue_id: str,
+                        fields: Iterable[str] = (),
+                        comments: Iterable[Dict] = ()) -> str:
+    """
+
+    render modification on issue message
+    :param issue_id:
+    :param fields: changed fields
+    :param comments: new comments
+    :return:
+    """
+    _lines = [ISSUE_UPDATE_TEMPLATE.format(issue_id=escape(issue_id),
+                                           url=url_from_issue(issue_id))]
+    if fields:
+        _lines.append(CHANGED_FIELDS_TEMPLATE.format(fields=escape(", ".join(fields))))
+    _lines.extend(render_comment(_comment) for _comment in comments)
+    return "\n".join(_lines)
+
+
+def render_comment(comment: Dict) -> str:
+    """
+
+    render a comment line, author and start of the body
+    :param comment:
+    :return:
+    """
+    _body = " ".join((comment.get("body") or "").split())
+    if len(_body) > SNIPPET_LENGTH:
+        _body = _body[:SNIPPET_LENGTH - len(TRUNCATED)] + TRUNCATED
+    return COMMENT_TEMPLATE.format(username=escape(comment.get("username") or "anonymous"),
+                                   snippet=escape(_body))
+
+
+def render_watchers(issue_ids: Iterable[str]) -> str:
+    """
+
+    render list of watched issues
+    :param issue_ids:
+    :return:
+    """
+    _watchers = "\n".join(WATCHER_TEMPLATE.format(issue_id=escape(_issue_id),
+                                                  url=url_from_issue(_issue_id))
+                          for _issue_id in issue_ids)
+    if not _watchers:
+        return NO_WATCHER
+    return WATCHERS_TEMPLATE.format(watchers=_watchers)
+
+
+def render_watchers_keyboard(issue_ids: List[str],
+                             has_previous: bool,
+                             has_next: bool) -> Optional[InlineKeyboardMarkup]:
+    """
+
+    navigation keyboard of a watchers page, the cursor is in callback data
+    :param issue_ids: issue ids of the page
+    :param has_previous:
+    :param has_next:
+    :return:
+    """
+    _buttons = []
+    if has_previous and issue_ids:
+        _buttons.append(InlineKeyboardButton(
+            "‹ Previous", callback_data=f"{WATCHERS_CALLBACK}<{issue_ids[0]}"))
+    if has_next and issue_ids:
+        _buttons.append(InlineKeyboardButton(
+            "Next ›", callback_data=f"{WATCHERS_CALLBACK}>{issue_ids[-1]}"))
+    return InlineKeyboardMarkup([_buttons]) if _buttons else None
+
+
+def parse_watchers_cursor(data: str) -> Tuple[str, str]:
+    """
+
+    parse watchers page callback data
+    :param data:
+    :return: after or before, and the issue id
+    """
+    _cursor = data[len(WATCHERS_CALLBACK):]
+    return ("after" if _cursor[:1] == ">" else "before"), _cursor[1:]
+
+
+def render_filter(_filter: Optional[Dict]) -> str:
+    """
+
+    render new issues filter of a user
+    :param _filter:
+    :return:
+    """
+    _filter = _filter or {}
+    _criteria = [(_name, ", ".join(_filter.get(_field)))
+                 for _name, _field in (("Languages", "languages"),
+                                       ("Organizations", "organizations"),
+                                       ("Types", "types"))
+                 if _filter.get(_field)]
+    if _filter.get("min_funded"):
+        _criteria.append(("Min funded amount", f"{_filter.get('min_funded'):g}$"))
+    if not _criteria:
+        return escape(NO_FILTER)
+    return FILTER_TEMPLATE.format(criteria="\n".join(
+        FILTER_CRITERION_TEMPLATE.format(name=escape(_name), values=escape(_values))
+        for _name, _values in _criteria))
+
+
+def _truncate(line: str, limit: int) -> str:
+    """
+
+    cut a line longer than limit, never leaving a dangling escape backslash
+    :param line:
+    :param limit:
+    :return:
+    """
+    _line = line[:limit - len(TRUNCATED)]
+    if (len(_line) - len(_line.rstrip("\\"))) % 2:
+        _line = _line[:-1]
+    return _line + TRUNCATED
+
+
+def _split_notification(text: str, limit: int) -> List[str]:
+    """
+
+    split a notification longer than limit between lines, entities of the
+    templates never span lines so they stay balanced
+    :param text: rendered notification
+    :param limit: max piece length
+    :return: pieces
+    """
+    if len(text) <= limit:
+        return [text]
+    _pieces = []
+    _lines: List[str] = []
+    _length = -1
+    for _line in text.split("\n"):
+        if len(_line) > limit:
+            _line = _truncate(_line, limit)
+        if _lines and _length + 1 + len(_line) > limit:
+            _pieces.append("\n".join(_lines))
+            _lines = []
+            _length = -1
+        _lines.append(_line)
+        _length += 1 + len(_line)
+    _pieces.append("\n".join(_lines))
+    return _pieces
+
+
+def render_digest(texts: List[str], limit: int = MESSAGE_LENGTH) -> List[str]:
+    """
+
+    render buffered notifications as few messages as possible, a notification
+    is only split between lines when it doesn't fit in a message of its own
+    :param texts: rendered notifications
+    :param limit: max message length
+    :return: messages
+    """
+    _header = DIGEST_TEMPLATE.format(count=len(texts))
+    # a piece always fits after the header so it is never sent alone
+    _piece_limit = limit - len(_header) - len(DIGEST_SEPARATOR)
+    _messages = []
+    _parts = [_header]
+    _length = len(_header)
+    for _text in texts:
+        for _piece in _split_notification(_text, _piece_limit):
+            if _parts and _length + len(DIGEST_SEPARATOR) + len(_piece) > limit:
+                _messages.append(DIGEST_SEPARATOR.join(_parts))
+                _parts = []
+                _length = -len(DIGEST_SEPARATOR)
+            _parts.append(_piece)
+            _length += len(DIGEST_SEPARATOR) + len(_piece)
+    _messages.append(DIGEST_SEPARATOR.join(_parts))
+    return _messages
@@ -0,0 +1,171 @@
+"""
+
+scheduler module
+"""
+from typing import Dict, List, NamedTuple, Optional, Set
+from datetime import datetime, timedelta
+import heapq
+import time
+
+from .ratelimit import TokenBucket
+from .types import Issue
+
+
+class SchedulerOptions(NamedTuple):
+    """
+
+    SchedulerOptions class, poll intervals in seconds and hot issue criteria
+    """
+    min_interval: float = 30.0
+    base_interval: float = 300.0
+    max_interval: float = 21600.0
+    # interval factor of open issues left unchanged by a poll
+    backoff: float = 2.0
+    funded_threshold: float = 50.0
+    # issues modified within this window are hot
+    active_window: timedelta = timedelta(days=1)
+
+
+class PollScheduler:
+    """
+
+    PollScheduler class, priority queue of issues keyed by the next time
+    their comments are due, within a request budget per minute
+
+    Changed issues are due at once. Watched, funded or recently modified
+    issues are polled every min_interval, other open issues start at
+    base_interval and back off up to max_interval while unchanged, closed
+    issues are polled every max_interval.
+    """
+    def __init__(self,
+                 options: SchedulerOptions = SchedulerOptions(),
+                 request_budget: float = 60.0):
+        self.options = options
+        self.budget = TokenBucket(request_budget / 60.0, capacity=request_budget)
+        # (due, issue id), outdated entries are skipped on pop
+        self._heap = []
+        # issue id -> {"due", "interval", "hot", "open"}
+        self._state: Dict[str, Dict] = {}
+
+    def observe(self,
+                issue: Issue,
+                changed: bool,
+                watched: bool,
+                now: Optional[float] = None) -> None:
+        """
+
+        update an issue seen in the issues sweep
+        :param issue:
+        :param changed: fingerprint changed since last refresh
+        :param watched: issue has watchers
+        :param now: monotonic time
+        :return:
+        """
+        now = time.monotonic() if now is None else now
+        _state = self._state.get(issue["id"])
+        _hot = watched or self._is_hot(issue)
+        _open = issue.get("open", True) is not False
+        # changed issues go before any overdue poll
+        _urgent = now - self.options.max_interval
+        if _state is None:
+            _state = {"due": None, "interval": self._base(_hot, _open), "hot": _hot, "open": _open}
+            self._state[issue["id"]] = _state
+            self._push(issue["id"], _urgent if changed else now, force=True)
+        elif changed:
+            self._push(issue["id"], _urgent, force=True)
+        if _hot != _state["hot"] or _open != _state["open"]:
+            _state["hot"] = _hot
+            _state["open"] = _open
+            _state["interval"] = self._base(_hot, _open)
+            if _state["due"] is not None and _state["due"] > now + _state["interval"]:
+                self._push(issue["id"], now + _state["interval"])
+
+    def forget(self, issue_ids: Set[str]) -> None:
+        """
+
+        keep only issues still returned by the api
+        :param issue_ids: current issue ids
+        :return:
+        """
+        for _issue_id in set(self._state) - set(issue_ids):
+            del self._state[_issue_id]
+        if len(self._heap) > 2 * len(self._state) + 64:
+            self._heap = [(_state["due"], _issue_id) for _issue_id, _state in self._state.items()
+                          if _state["due"] is not None]
+            heapq.heapify(self._heap)
+
+    def pop_due(self, now: Optional[float] = None, request_cost: float = 1.0) -> List[str]:
+        """
+
+        pop due issues, most overdue first, while the budget allows
+        :param now: monotonic time
+        :param request_cost: budget spent per issue, i.e. 1 / issues per request
+        :return: issue ids
+        """
+        now = time.monotonic() if now is None else now
+        _due = []
+        while self._heap and self._heap[0][0] <= now:
+            _time, _issue_id = self._heap[0]
+            _state = self._state.get(_issue_id)
+            if _state is None or _state["due"] != _time:
+                heapq.heappop(self._heap)
+                continue
+            if not self.budget.try_acquire(request_cost):
+                break
+            heapq.heappop(self._heap)
+            _state["due"] = None
+            _due.append(_issue_id)
+        return _due
+
+    def record(self, issue_id: str, changed: bool, now: Optional[float] = None) -> None:
+        """
+
+        reschedule an issue after its comments were fetched, or failed
+        :param issue_id:
+        :param changed: comments changed, a failed fetch counts as changed
+        :param now: monotonic time
+        :return:
+        """
+        now = time.monotonic() if now is None else now
+        _state = self._state.get(issue_id)
+        if _state is None:
+            return
+        _base = self._base(_state["hot"], _state["open"])
+        if changed or not _state["open"]:
+            _state["interval"] = _base
+        else:
+            _cap = _base if _state["hot"] else self.options.max_interval
+            _state["interval"] = min(_state["interval"] * self.options.backoff, _cap)
+        self._push(issue_id, now + _state["interval"], force=True)
+
+    def next_due(self) -> Optional[float]:
+        """
+
+        earliest due time
+        :return: monotonic time
+        """
+        _times = [_state["due"] for _state in self._state.values() if _state["due"] is not None]
+        return min(_times, default=None)
+
+    def __len__(self) -> int:
+        return len(self._state)
+
+    def _push(self, issue_id: str, due: float, force: bool = False) -> None:
+        _state = self._state[issue_id]
+        if not force and _state["due"] is None:
+            # being fetched, record() reschedules it
+            return
+        _state["due"] = due
+        heapq.heappush(self._heap, (due, issue_id))
+
+    def _base(self, hot: bool, is_open: bool) -> float:
+        if not is_open:
+            return self.options.max_interval
+        return self.options.min_interval if hot else self.options.base_interval
+
+    def _is_hot(self, issue: Issue) -> bool:
+        if (issue.get("fundedAmount") or 0) >= self.options.funded_threshold:
+            return True
+        _modified_date = issue.get("modifiedDate")
+        return isinstance(_modified_date, datetime) and \
+            datetime.utcnow() - _modified_date <= self.options.active_window
@@ -0,0 +1,178 @@
+"""
+
+schema module
+"""
+from enum import Enum
+from functools import lru_cache
+import os
+from typing import Dict, List, Tuple
+import json
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import CollectionInvalid
+
+SCHEMA_DIR = os.path.join(os.path.dirname(__file__), "schemas")
+
+# collections, members are named after the mongodb collections they stand for
+RysolvCollections = Enum("RysolvCollections", [
+    "Users",
+    "WatchIssues",
+    "Issues",
+    "Comments",
+    "Changelogs",
+    "Fingerprints",
+    "ResumeTokens",
+    "Outbox",
+    "Leases",
+    "Filters",
+    "DigestBuffer",
+    "PendingUpdates",
+])
+
+# seconds finished jobs are kept
+OUTBOX_RETENTION = 7 * 24 * 3600
+# validation level of applied schemas, existing invalid documents are left alone
+VALIDATION_LEVEL = "moderate"
+INDEXES = {
+    RysolvCollections.Users.name: [IndexModel([("user_id", DESCENDING)], unique=True)],
+    RysolvCollections.WatchIssues.name: [IndexModel([("user_id", DESCENDING),
+                                                     ("issue_id", DESCENDING)],
+                                                    unique=True)],
+    RysolvCollections.Issues.name: [IndexModel([("id", DESCENDING)], unique=True)],
+    RysolvCollections.Comments.name: [IndexModel([("issue_id", DESCENDING),
+                                                  ("comment_key", DESCENDING)],
+                                                 unique=True)],
+    RysolvCollections.Changelogs.name: [IndexModel([("version", DESCENDING)], unique=True)],
+    RysolvCollections.Fingerprints.name: [IndexModel([("issue_id", DESCENDING)], unique=True)],
+    RysolvCollections.ResumeTokens.name: [IndexModel([("name", DESCENDING)], unique=True)],
+    RysolvCollections.Outbox.name: [IndexModel([("status", ASCENDING),
+                                                ("partition", ASCENDING),
+                                                ("lease_until", ASCENDING)]),
+                                    IndexModel([("finished", ASCENDING)],
+                                               expireAfterSeconds=OUTBOX_RETENTION)],
+    RysolvCollections.Leases.name: [IndexModel([("name", DESCENDING)], unique=True),
+                                    IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0)],
+    RysolvCollections.Filters.name: [IndexModel([("user_id", DESCENDING)], unique=True)],
+    RysolvCollections.DigestBuffer.name: [IndexModel([("due", ASCENDING), ("user_id", ASCENDING)]),
+                                          IndexModel([("user_id", ASCENDING), ("due", ASCENDING),
+                                                      ("created", ASCENDING)])],
+    RysolvCollections.PendingUpdates.name: [IndexModel([("due", ASCENDING)])],
+}
+# comments index of one document per issue, see _migrate_comments
+LEGACY_COMMENTS_INDEX = (("issue_id", DESCENDING),)
+
+
+@lru_cache(maxsize=None)
+def load_schema(collection_name: str) -> Dict:
+    """
+
+    json schema of a collection, read on first use
+    :param collection_name:
+    :return:
+    """
+    _file_path = os.path.join(SCHEMA_DIR, f"{collection_name}.json")
+    with open(_file_path, "r") as _file:
+        return json.load(_file)
+
+
+def _index_spec(index: Dict) -> Tuple[Tuple, bool]:
+    """
+
+    comparable key and uniqueness of an index document
+    :param index: list_indexes item or IndexModel.document
+    :return:
+    """
+    return tuple((_field, int(_direction)) for _field, _direction in index["key"].items()), \
+        bool(index.get("unique"))
+
+
+class SchemaMismatch(Exception):
+    """
+
+    SchemaMismatch class, database is missing collections, validators or
+    indexes and startup is check only
+    """
+    def __init__(self, pending: List[str]):
+        super().__init__("Database needs migration: " + ", ".join(pending))
+        self.pending = pending
+
+
+class SchemaMixin:
+    """
+
+    SchemaMixin class, collections, validators and indexes of RysolvDatabase
+    """
+    def reconcile(self, apply: bool = True) -> List[str]:
+        """
+
+        diff collections, validators and indexes with the expected ones, a
+        single listCollections then listIndexes per existing collection, and
+        create only what is missing, indexes in one createIndexes per collection
+        :param apply: apply changes, else only report them
+        :return: pending changes, applied when apply
+        """
+        _names = list(RysolvCollections.__members__)
+        _existing = {_item["name"]: _item.get("options", {})
+                     for _item in self.database.list_collections(filter={"name": {"$in": _names}})}
+        _pending = []
+        for _name in _names:
+            _collection = self.collections[_name]
+            _validator = {"$jsonSchema": load_schema(_name)}
+            _indexes = set()
+            if _name not in _existing:
+                _pending.append(f"create collection {_name}")
+                if apply:
+                    self._create_collection(_name, _validator)
+            else:
+                if _existing[_name].get("validator") != _validator:
+                    _pending.append(f"set validator of {_name}")
+                    if apply:
+                        self.database.command("collMod",
+                                              _name,
+                                              validator=_validator,
+                                              validationLevel=VALIDATION_LEVEL)
+                _indexes = {_index_spec(_index) for _index in _collection.list_indexes()}
+            if _name == RysolvCollections.Comments.name and \
+                    (LEGACY_COMMENTS_INDEX, True) in _indexes:
+                _pending.append(f"migrate {_name} to one document per comment")
+                if apply:
+                    self._migrate_comments()
+            _missing = [_index for _index in INDEXES[_name]
+                        if _index_spec(_index.document) not in _indexes]
+            if _missing:
+                _pending.append(f"create {len(_missing)} indexes on {_name}")
+                if apply:
+                    _collection.create_indexes(_missing)
+        return _pending
+
+    def _create_collection(self, collection_name: str, validator: Dict) -> None:
+        try:
+            self.database.create_collection(collection_name,
+                                            validator=validator,
+                                            validationLevel=VALIDATION_LEVEL)
+        except CollectionInvalid:
+            # created meanwhile by another replica, its validator is checked next start
+            pass
+
+    def _migrate_comments(self) -> None:
+        """
+
+        move from one document per issue holding a comments array to one
+        document per comment, legacy documents are dropped and fingerprints
+        reset so the crawler refetches every comment
+        :return:
+        """
+        _collection = self.collections[RysolvCollections.Comments.name]
+        _collection.drop_index(list(LEGACY_COMMENTS_INDEX))
+        _collection.delete_many({"comments": {"$exists": True}})
+        self.collections[RysolvCollections.Fingerprints.name].delete_many({})
+
+    def clear(self) -> None:
+        """
+
+        clear database
+        :return:
+        """
+        for collection_name in RysolvCollections.__members__:
+            self.database.drop_collection(collection_name)
+        self.reset_caches()
@@ -0,0 +1,197 @@
+"""
+
+snapshot module, record rysolv api exchanges and replay them offline
+"""
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+from collections import deque
+from logging import Logger
+from threading import Lock
+import gzip
+import json
+import re
+import time
+
+from .transport import QueryError
+
+SNAPSHOT_VERSION = 1
+# alias and issue id of each getIssueComments field of a comments query
+COMMENTS_ALIAS = re.compile(r'(c\d+): getIssueComments\(issueId: "([^"]+)"\)')
+
+
+class SnapshotExhausted(Exception):
+    """
+
+    SnapshotExhausted class, every recorded exchange was replayed
+    """
+
+
+class SnapshotRecorder:
+    """
+
+    SnapshotRecorder class, transport wrapper appending every query, with
+    its response or error and time offset, to a gzipped json lines file
+    """
+    def __init__(self, transport, path: str, logger: Logger):
+        self.transport = transport
+        self.path = path
+        self.logger = logger
+        self._lock = Lock()
+        self._start = time.monotonic()
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+        self._write({"version": SNAPSHOT_VERSION, "created": time.time()})
+        self.logger.info("Record rysolv api exchanges to %s", path)
+
+    def query(self, query: str) -> Dict:
+        """
+
+        forward query to the wrapped transport and record the exchange
+        :param query:
+        :return: response body
+        """
+        _offset = time.monotonic() - self._start
+        try:
+            _response = self.transport.query(query)
+        except QueryError as error:
+            self._write({"t": _offset,
+                         "query": query,
+                         "error": str(error),
+                         "status_code": error.status_code})
+            raise
+        self._write({"t": _offset, "query": query, "response": _response})
+        return _response
+
+    def stream(self, query: str) -> Iterator[str]:
+        """
+
+        like query, the whole body is needed to record it
+        :param query:
+        :return: response body text
+        """
+        yield json.dumps(self.query(query))
+
+    def _write(self, record: Dict) -> None:
+        _line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._file.write(_line)
+            # keep the snapshot readable up to the last exchange after a crash
+            self._file.flush()
+
+    def close(self) -> None:
+        """
+
+        close snapshot and wrapped transport
+        :return:
+        """
+        with self._lock:
+            self._file.close()
+        self.transport.close()
+
+
+class SnapshotReplayer:
+    """
+
+    SnapshotReplayer class, transport answering queries from a snapshot
+
+    Issues sweeps are replayed in recorded order. Comments queries are
+    answered per issue with the latest comments recorded up to the current
+    sweep, since the issues due for comments depend on the scheduler clock
+    and concurrent batches are not issued in a fixed order. With speed, a
+    sweep is not answered before its recorded offset divided by speed,
+    speed 0 replays as fast as possible.
+    """
+    def __init__(self, path: str, logger: Logger, speed: float = 0.0):
+        self.path = path
+        self.speed = speed
+        self._lock = Lock()
+        self._start: Optional[float] = None
+        self._sweeps: Dict[str, Deque[Dict]] = {}
+        # number of sweeps loaded, then replayed
+        self._sweep_count = 0
+        # issue id -> [(sweep count, comments or None when the fetch failed)]
+        self._comments: Dict[str, List[Tuple[int, Optional[List]]]] = {}
+        with gzip.open(path, "rt", encoding="utf-8") as _file:
+            _header = json.loads(next(_file))
+            if _header.get("version") != SNAPSHOT_VERSION:
+                raise ValueError(f"Unsupported snapshot version {_header.get('version')} "
+                                 f"in {path}")
+            for _line in _file:
+                self._load(json.loads(_line))
+        self._sweep_count = 0
+        logger.info("Replay %d issues sweeps from %s", self.remaining, path)
+
+    def _load(self, record: Dict) -> None:
+        _aliases = COMMENTS_ALIAS.findall(record["query"])
+        if not _aliases:
+            self._sweeps.setdefault(record["query"], deque()).append(record)
+            self._sweep_count += 1
+            return
+        _data = (record.get("response") or {}).get("data") or {}
+        for _alias, _issue_id in _aliases:
+            self._comments.setdefault(_issue_id, []).append((self._sweep_count,
+                                                             _data.get(_alias)))
+
+    @property
+    def remaining(self) -> int:
+        """
+
+        number of issues sweeps not replayed yet
+        :return:
+        """
+        return sum(len(_records) for _records in self._sweeps.values())
+
+    def query(self, query: str) -> Dict:
+        """
+
+        answer query from the snapshot
+        :param query:
+        :return: recorded response body
+        """
+        _aliases = COMMENTS_ALIAS.findall(query)
+        if _aliases:
+            with self._lock:
+                return {"data": {_alias: self._find_comments(_issue_id)
+                                 for _alias, _issue_id in _aliases}}
+        with self._lock:
+            if self._start is None:
+                self._start = time.monotonic()
+            _records = self._sweeps.get(query)
+            if _records is None:
+                raise QueryError(f"Query not found in snapshot {self.path}")
+            if not _records:
+                raise SnapshotExhausted(f"Every issues sweep of {self.path} was replayed")
+            _record = _records.popleft()
+            self._sweep_count += 1
+        if self.speed:
+            _wait = self._start + _record["t"] / self.speed - time.monotonic()
+            if _wait > 0:
+                time.sleep(_wait)
+        if "error" in _record:
+            raise QueryError(_record["error"], _record.get("status_code"))
+        return _record["response"]
+
+    def stream(self, query: str) -> Iterator[str]:
+        """
+
+        like query
+        :param query:
+        :return: response body text
+        """
+        yield json.dumps(self.query(query))
+
+    def _find_comments(self, issue_id: str) -> Optional[List]:
+        _records = self._comments.get(issue_id)
+        if not _records:
+            return None
+        _comments = _records[0][1]
+        for _sweep, _recorded in _records:
+            if _sweep > self._sweep_count:
+                break
+            _comments = _recorded
+        return _comments
+
+    def close(self) -> None:
+        """
+
+        nothing to release
+        :return:
+        """
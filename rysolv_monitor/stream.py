@@ -0,0 +1,89 @@
+"""
+
+stream module, incremental parse of a json array out of a response body
+"""
+from typing import Dict, Iterable, Iterator
+import json
+import re
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+class StreamError(Exception):
+    """
+
+    StreamError class, malformed or truncated body
+    """
+
+
+def _find_array(chunks: Iterator[str], key: str) -> str:
+    """
+
+    read chunks up to the start of the array held by key
+    :param chunks:
+    :param key:
+    :return: the buffered text following the opening bracket
+    """
+    _marker = re.compile(r'"' + re.escape(key) + r'"\s*:\s*\[')
+    _buffer = ""
+    _head = ""
+    # keep a tail long enough for a split marker
+    while True:
+        _match = _marker.search(_buffer)
+        if _match:
+            return _buffer[_match.end():]
+        _buffer = _buffer[-(len(key) + 64):]
+        _chunk = next(chunks, None)
+        if _chunk is None:
+            raise StreamError(f"Can't find {key} array in response body: {_head}")
+        _head = (_head + _chunk)[:512]
+        _buffer += _chunk
+
+
+def iter_array(chunks: Iterable[str], key: str) -> Iterator[Dict]:
+    """
+
+    yield the items of the first array held by key, only one item and one
+    chunk are kept in memory, keys are matched as "key": so the key must not
+    appear as an object key before the array
+    :param chunks: text chunks of a json body
+    :param key:
+    :return:
+    """
+    _chunks = iter(chunks)
+    _buffer = _find_array(_chunks, key)
+    _consumed = 0
+    _expect_item = True
+    while True:
+        _consumed = _WHITESPACE.match(_buffer, _consumed).end()
+        if _consumed < len(_buffer):
+            _char = _buffer[_consumed]
+            if _char == "]":
+                return
+            if not _expect_item:
+                if _char != ",":
+                    raise StreamError(f"Unexpected {_char!r} in {key} array")
+                _consumed += 1
+                _expect_item = True
+                continue
+            try:
+                _item, _end = _DECODER.raw_decode(_buffer, _consumed)
+            except json.JSONDecodeError:
+                # the item may be split across chunks
+                _end = len(_buffer)
+            # an item ending the buffer may be a truncated number, read more
+            if _end < len(_buffer):
+                yield _item
+                # compact bodies separate items with a bare comma
+                if _buffer[_end] == ",":
+                    _consumed = _end + 1
+                else:
+                    _consumed = _end
+                    _expect_item = False
+                continue
+        _chunk = next(_chunks, None)
+        if _chunk is None:
+            raise StreamError(f"Truncated {key} array")
+        _buffer = _buffer[_consumed:] + _chunk
+        _consumed = 0
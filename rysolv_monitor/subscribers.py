@@ -0,0 +1,329 @@
+"""
+
+subscribers module
+"""
+from typing import Dict, Iterable, List, Mapping, Optional, Set, Tuple
+from threading import RLock
+import bisect
+
+from .database import RysolvDatabase, RysolvCollections
+from .types import Filter
+
+
+def _discard(mapping: Dict, key, value) -> None:
+    """
+
+    discard value from the set of key, dropping the set once empty
+    :param mapping: key -> set of values
+    :param key:
+    :param value:
+    :return:
+    """
+    _values = mapping.get(key)
+    if _values is not None:
+        _values.discard(value)
+        if not _values:
+            del mapping[key]
+
+
+class FilterIndex:
+    """
+
+    FilterIndex class, inverted index of subscription filters, matching an
+    issue costs the candidates of its most selective criterion rather than
+    every filter
+    """
+    def __init__(self):
+        self._filters: Dict[int, Filter] = {}
+        # criterion -> value -> user ids, and user ids without that criterion
+        self._postings: Dict[str, Dict[str, Set[int]]] = {"languages": {},
+                                                          "organizations": {},
+                                                          "types": {}}
+        self._unconstrained: Dict[str, Set[int]] = {"languages": set(),
+                                                    "organizations": set(),
+                                                    "types": set()}
+        # sorted (min funded amount, user id)
+        self._funded: List[Tuple[float, int]] = []
+
+    def __len__(self) -> int:
+        return len(self._filters)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._filters
+
+    def add(self, _filter: Filter) -> None:
+        """
+
+        add or replace the filter of a user
+        :param _filter:
+        :return:
+        """
+        self.remove(_filter.user_id)
+        self._filters[_filter.user_id] = _filter
+        for _criterion, _postings in self._postings.items():
+            _values = _filter[_criterion]
+            if not _values:
+                self._unconstrained[_criterion].add(_filter.user_id)
+            for _value in _values or ():
+                _postings.setdefault(_value, set()).add(_filter.user_id)
+        bisect.insort(self._funded, (_filter.min_funded or 0, _filter.user_id))
+
+    def remove(self, user_id: int) -> None:
+        """
+
+        remove the filter of a user
+        :param user_id:
+        :return:
+        """
+        _filter = self._filters.pop(user_id, None)
+        if _filter is None:
+            return
+        for _criterion, _postings in self._postings.items():
+            self._unconstrained[_criterion].discard(user_id)
+            for _value in _filter[_criterion] or ():
+                _discard(_postings, _value, user_id)
+        _entry = (_filter.min_funded or 0, user_id)
+        _index = bisect.bisect_left(self._funded, _entry)
+        if _index < len(self._funded) and self._funded[_index] == _entry:
+            del self._funded[_index]
+
+    def match(self, issue: Mapping) -> List[int]:
+        """
+
+        user ids of filters matching issue
+        :param issue:
+        :return:
+        """
+        _values = {
+            "languages": {_value.lower() for _value in issue.get("language") or []},
+            "organizations": {(issue.get("organizationName") or "").lower()},
+            "types": {(issue.get("type") or "").lower()},
+        }
+        _candidates: List[Iterable[int]] = []
+        for _criterion, _postings in self._postings.items():
+            _sets = [_postings[_value] for _value in _values[_criterion] if _value in _postings]
+            _sets.append(self._unconstrained[_criterion])
+            _candidates.append(_sets)
+        # funded thresholds met are a prefix
+        _funded_count = bisect.bisect_right(self._funded,
+                                            (issue.get("fundedAmount") or 0, float("inf")))
+        _sizes = [sum(len(_set) for _set in _sets) for _sets in _candidates]
+        if _funded_count <= min(_sizes):
+            _users: Iterable[int] = (_user_id for _, _user_id in self._funded[:_funded_count])
+        else:
+            _users = set().union(*_candidates[_sizes.index(min(_sizes))])
+        return [_user_id for _user_id in _users if self._filters[_user_id].matches(issue)]
+
+
+class SubscriberIndex:
+    """
+
+    SubscriberIndex class, in memory copy of Users and WatchIssues kept
+    fresh by change events
+    """
+    def __init__(self):
+        self._lock = RLock()
+        self._clear()
+
+    def _clear(self) -> None:
+        # registered user id -> seconds between digests, None when notified
+        # right away
+        self._users: Dict[int, Optional[float]] = {}
+        # issue id -> user ids
+        self._watchers: Dict[str, Set[int]] = {}
+        # user id -> issue ids
+        self._watched: Dict[int, Set[str]] = {}
+        # collection name -> document _id -> user id or (user id, issue id),
+        # to resolve deletions
+        self._documents: Dict[str, Dict] = {RysolvCollections.Users.name: {},
+                                            RysolvCollections.WatchIssues.name: {},
+                                            RysolvCollections.Filters.name: {}}
+        self._filters = FilterIndex()
+        # registered users without filter, they get every new issue
+        self._unfiltered: Set[int] = set()
+
+    def bootstrap(self, database: RysolvDatabase) -> None:
+        """
+
+        load the whole index from database, documents are read before the
+        lock is taken so readers are only held while the index is rebuilt
+        :param database:
+        :return:
+        """
+        _users = list(database.find_users())
+        _watches = list(database.find_watch_issues())
+        _filters = list(database.find_filters())
+        with self._lock:
+            self._clear()
+            for user in _users:
+                self.add_user(user["_id"], user["user_id"], user.get("digest"))
+            for watch in _watches:
+                self.add_watch(watch["_id"], watch["user_id"], watch["issue_id"])
+            for _filter in _filters:
+                self.add_filter(_filter["_id"], Filter(_filter))
+
+    def apply_change(self, collection_name: str, change: Dict) -> None:
+        """
+
+        apply a change event of Users, WatchIssues or Filters collections
+        :param collection_name:
+        :param change:
+        :return:
+        """
+        _id = change["documentKey"]["_id"]
+        _document = change.get("fullDocument")
+        if change["operationType"] == "delete" or \
+                (change["operationType"] in ("insert", "update", "replace") and _document is None):
+            if collection_name == RysolvCollections.Users.name:
+                self.remove_user(_id)
+            elif collection_name == RysolvCollections.WatchIssues.name:
+                self.remove_watch(_id)
+            elif collection_name == RysolvCollections.Filters.name:
+                self.remove_filter(_id)
+        elif change["operationType"] in ("insert", "update", "replace"):
+            if collection_name == RysolvCollections.Users.name:
+                self.add_user(_id, _document["user_id"], _document.get("digest"))
+            elif collection_name == RysolvCollections.WatchIssues.name:
+                self.add_watch(_id, _document["user_id"], _document["issue_id"])
+            elif collection_name == RysolvCollections.Filters.name:
+                self.add_filter(_id, Filter(_document))
+
+    def add_user(self, _id, user_id: int, digest: Optional[float] = None) -> None:
+        """
+
+        add registered user
+        :param _id: document id
+        :param user_id:
+        :param digest: seconds between digests, None to be notified right away
+        :return:
+        """
+        with self._lock:
+            self.remove_user(_id)
+            self._documents[RysolvCollections.Users.name][_id] = user_id
+            self._users[user_id] = digest or None
+            if user_id not in self._filters:
+                self._unfiltered.add(user_id)
+
+    def remove_user(self, _id) -> None:
+        """
+
+        remove registered user
+        :param _id: document id
+        :return:
+        """
+        with self._lock:
+            _user_id = self._documents[RysolvCollections.Users.name].pop(_id, None)
+            if _user_id is not None:
+                self._users.pop(_user_id, None)
+                self._unfiltered.discard(_user_id)
+
+    def add_watch(self, _id, user_id: int, issue_id: str) -> None:
+        """
+
+        add issue watcher
+        :param _id: document id
+        :param user_id:
+        :param issue_id:
+        :return:
+        """
+        with self._lock:
+            self.remove_watch(_id)
+            self._documents[RysolvCollections.WatchIssues.name][_id] = (user_id, issue_id)
+            self._watchers.setdefault(issue_id, set()).add(user_id)
+            self._watched.setdefault(user_id, set()).add(issue_id)
+
+    def remove_watch(self, _id) -> None:
+        """
+
+        remove issue watcher
+        :param _id: document id
+        :return:
+        """
+        with self._lock:
+            _watch = self._documents[RysolvCollections.WatchIssues.name].pop(_id, None)
+            if _watch is None:
+                return
+            _user_id, _issue_id = _watch
+            _discard(self._watchers, _issue_id, _user_id)
+            _discard(self._watched, _user_id, _issue_id)
+
+    def add_filter(self, _id, _filter: Filter) -> None:
+        """
+
+        add or replace the new issue filter of a user
+        :param _id: document id
+        :param _filter:
+        :return:
+        """
+        with self._lock:
+            self.remove_filter(_id)
+            self._documents[RysolvCollections.Filters.name][_id] = _filter.user_id
+            self._filters.add(_filter)
+            self._unfiltered.discard(_filter.user_id)
+
+    def remove_filter(self, _id) -> None:
+        """
+
+        remove the new issue filter of a user
+        :param _id: document id
+        :return:
+        """
+        with self._lock:
+            _user_id = self._documents[RysolvCollections.Filters.name].pop(_id, None)
+            if _user_id is None:
+                return
+            self._filters.remove(_user_id)
+            if _user_id in self._users:
+                self._unfiltered.add(_user_id)
+
+    def users(self) -> List[int]:
+        """
+
+        registered user ids
+        :return:
+        """
+        with self._lock:
+            return list(self._users)
+
+    def watchers(self, issue_id: str) -> List[int]:
+        """
+
+        user ids watching an issue
+        :param issue_id:
+        :return:
+        """
+        with self._lock:
+            return list(self._watchers.get(issue_id, ()))
+
+    def watched_issues(self, user_id: int) -> List[str]:
+        """
+
+        issue ids watched by a user
+        :param user_id:
+        :return:
+        """
+        with self._lock:
+            return list(self._watched.get(user_id, ()))
+
+    def recipients(self, issue: Mapping) -> List[int]:
+        """
+
+        registered user ids to notify of a new issue, users without filter
+        and users whose filter matches
+        :param issue:
+        :return:
+        """
+        with self._lock:
+            return list(self._unfiltered) + [_user_id for _user_id in self._filters.match(issue)
+                                             if _user_id in self._users]
+
+    def digests(self, user_ids: Iterable[int]) -> Dict[int, float]:
+        """
+
+        seconds between digests of users in digest mode
+        :param user_ids:
+        :return:
+        """
+        with self._lock:
+            return {_user_id: self._users[_user_id] for _user_id in user_ids
+                    if self._users.get(_user_id)}
@@ -3,37 +3,85 @@
 telegram_bot module
 """
 import re
-from typing import List, Optional
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
 from logging import Logger
 import os
 
-from telegram import Update
+from telegram import InlineKeyboardMarkup, Update
+from telegram.error import BadRequest
 from telegram.ext import (
     Updater,
+    CallbackQueryHandler,
     CommandHandler,
 )
 
 import rysolv_monitor
 from rysolv_monitor.database import (
     RysolvDatabase,
-    RysolvCollections
+    RysolvCollections,
+    HASH_FIELD,
+    OUTBOX_PARTITIONS
 )
 from rysolv_monitor.utils import (
-    url_from_issue,
     escape,
     parse_changelog
 )
+from rysolv_monitor.render import (
+    WATCHERS_CALLBACK,
+    parse_watchers_cursor,
+    render_filter,
+    render_issue_update,
+    render_watchers,
+    render_watchers_keyboard
+)
 from rysolv_monitor.types import (
-    Issue
+    Issue,
+    Comment,
+    Filter
+)
+from rysolv_monitor.dispatcher import DispatcherOptions, NotificationDispatcher
+from rysolv_monitor.outbox import OutboxSender, SenderOptions
+from rysolv_monitor.digest import format_period, parse_period
+from rysolv_monitor.metrics import DIGEST_NOTIFICATIONS
+from rysolv_monitor.subscribers import SubscriberIndex
+from rysolv_monitor.coalesce import UpdateCoalescer
+from rysolv_monitor.leader import LeaderLease
+from rysolv_monitor.changestream import (
+    ChangeStreamRouter,
+    ResumeCheckpoint
 )
 
 
+class BotOptions(NamedTuple):
+    """
+
+    BotOptions class, notification delivery and change stream tuning
+    """
+    notifier_workers: int = 4
+    # resume token is saved every N events or every interval seconds
+    checkpoint_every: int = 100
+    checkpoint_interval: float = 5.0
+    # seconds updates of an issue are held to be notified as one
+    update_window: float = 10.0
+    # outbox partitions sent by this process, all of them by default
+    sender_partitions: Sequence[int] = tuple(range(OUTBOX_PARTITIONS))
+
+
 class RysolvBot:
     """
 
     RysolvBot class
     """
 
+    # /filter criteria keys -> Filter fields
+    FILTER_KEYS = {
+        "language": "languages",
+        "org": "organizations",
+        "type": "types",
+        "funded": "min_funded",
+    }
+    # watchers per /list_watchers page
+    WATCHERS_PAGE_SIZE = 20
     UUID_REGEX= r"\b[0-9a-f]{8}\b-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-\b[0-9a-f]{12}\b"
     TELEGRAM_USAGE_COMMANDS = [
         "/register - Sign up for receiving new issue",
@@ -42,16 +90,35 @@ class RysolvBot:
         "/watch [ID]... - Watch one or multiple issue modification",
         "/list_watchers - List issue subscription",
         "/delete_watcher [ID]... - Delete issue subscription",
+        "/filter [language=go,rust] [org=NAME,...] [type=bug,feature] [funded=AMOUNT] - "
+        "Only receive new issues matching every criterion, show filter without criterion",
+        "/clear_filter - Receive every new issue",
+        "/digest [15m|1h|1d|off] - Receive notifications grouped in one message per period, "
+        "show period without argument",
         "/version - Show current version",
         "/help - Print help message"
     ]
     def __init__(self,
                  telegram_token: str,
                  database: RysolvDatabase,
-                 logger: Logger):
+                 logger: Logger,
+                 options: BotOptions = BotOptions()):
         self.updater = Updater(token=telegram_token, use_context=True)
         self.database = database
         self.logger = logger
+        self.options = options
+        self.sender = OutboxSender(database,
+                                   NotificationDispatcher(
+                                       self.send_message,
+                                       logger,
+                                       DispatcherOptions(workers=options.notifier_workers)),
+                                   logger,
+                                   SenderOptions(partitions=options.sender_partitions))
+        self.subscribers = SubscriberIndex()
+        self.coalescer = UpdateCoalescer(self._notify_update,
+                                         logger,
+                                         window=options.update_window,
+                                         database=database)
 
     def check_version(self) -> None:
         """
@@ -69,30 +136,52 @@ class RysolvBot:
             if rysolv_monitor.__version__ in _change_log:
                 msg = f"New version {rysolv_monitor.__version__}\n" \
                       f"{_change_log[rysolv_monitor.__version__]}"
-                self.notify_users(escape(msg), self.database.find_users())
+                self.notify_users(escape(msg), self.subscribers.users())
                 _data_set = {"version": rysolv_monitor.__version__,
                              "text": _change_log[rysolv_monitor.__version__]}
                 _result = self.database.write_changelog(_data_set)
 #               if _result.updated_count == 0:
 #                   self.logger.warning("Fail to add new changelog")
 
-    def run_monitor_issue(self) -> None:
+    def run_monitor(self, leader: Optional[LeaderLease] = None) -> None:
         """
 
-        run monitoring issue
+        run monitor of issues, comments and subscribers, on a single
+        database change stream, only while holding the lease when replicas
+        share the database
+        :param leader: monitor lease
         :return:
         """
-        self.logger.info("Run monitor issue")
-        self._monitor_issue()
+        self.logger.info("Run monitor")
+        _router = ChangeStreamRouter(self.database, self._checkpoint("database"), self.logger)
+        _router.register(RysolvCollections.Issues.name, self._monitor_issue)
+        _router.register(RysolvCollections.Comments.name, self._monitor_comment)
+        _router.register(RysolvCollections.Users.name, self._monitor_subscribers)
+        _router.register(RysolvCollections.WatchIssues.name, self._monitor_subscribers)
+        _router.register(RysolvCollections.Filters.name, self._monitor_subscribers)
+        if leader is None:
+            # the index is reloaded once the stream is open so no change is missed
+            _router.run(on_open=self._on_stream_open)
+            return
+        while True:
+            if not leader.wait(leader.ttl):
+                continue
+            _router.run(on_open=self._on_stream_open, active=leader.is_leader)
+            self.logger.warning("Lost monitor lease, stop monitor")
+            # held updates are restored by the replica taking the lease over
+            self.coalescer.clear()
 
-    def run_monitor_comment(self) -> None:
+    def _on_stream_open(self) -> None:
         """
 
-        run monitor comment
+        load subscribers, then updates held before a restart which are
+        notified to them
         :return:
         """
-        self.logger.info("Run monitor comment")
-        self._monitor_comment()
+        self.subscribers.bootstrap(self.database)
+        _restored = self.coalescer.restore()
+        if _restored:
+            self.logger.info("Restore %d pending issue updates", _restored)
 
     @staticmethod
     def _find_issue_by_id(issues: List[Issue], _id: str) -> Optional[Issue]: # pylint: disable=unsubscriptable-object
@@ -110,59 +199,104 @@ class RysolvBot:
                 break
         return _result
 
-    def _monitor_comment(self) -> None:
+    def _monitor_comment(self, change: Dict) -> None:
         """
 
-        monitor comment
+        handle change on Comments collection
+        :param change:
         :return:
         """
-        pipeline = [{"$match": {"operationType": {"$in": ["insert", "update"]}}}]
-        _collection = self.database.collections[RysolvCollections.Comments.name]
-        with _collection.watch(pipeline, full_document="updateLookup") as stream:
-            for change in stream:
-                self.logger.info("Change on Comments collection operationType: %s",
-                                 change["operationType"])
-                _comment = Issue(change["fullDocument"])
-                msg = "New modification on issue " \
-                      f"[{escape(_comment['issue_id'])}]({url_from_issue(_comment['issue_id'])})"
-                if change["operationType"] == "insert":
-                    self.notify_users(msg, self.database.find_users())
-                elif change["operationType"] == "update":
-                    _filter = {"issue_id": _comment['issue_id']}
-                    self.notify_users(msg,
-                                      self.database.find_watch_issues(_filter))
-
-    def _monitor_issue(self) -> None:
-        """
-
-        monitor issue
+        if not change.get("fullDocument"):
+            return
+        _comment = Comment(change["fullDocument"])
+        if change["operationType"] == "insert" and not _comment.get("initial"):
+            self.coalescer.add(_comment["issue_id"],
+                               [],
+                               [{"username": _comment.get("username"),
+                                 "body": _comment.get("body")}])
+
+    def _monitor_subscribers(self, change: Dict) -> None:
+        """
+
+        handle change on Users, WatchIssues and Filters collections
+        :param change:
+        :return:
+        """
+        self.subscribers.apply_change(change["ns"]["coll"], change)
+
+    def _monitor_issue(self, change: Dict) -> None:
+        """
+
+        handle change on Issues collection
+        :param change:
         :return:
         """
-        pipeline = [{"$match": {"operationType": {"$in": ["insert", "update"]}}}]
-        _collection = self.database.collections[RysolvCollections.Issues.name]
-        with _collection.watch(pipeline, full_document="updateLookup") as stream:
-            for change in stream:
-                self.logger.info("operationType: %s", change["operationType"])
-                _issue = Issue(change["fullDocument"])
-                if change["operationType"] == "insert":
-                    self.notify_users(str(_issue), self.database.find_users())
-                elif change["operationType"] == "update":
-                    msg = "New modification on issue " \
-                          f"[{escape(_issue['id'])}]({url_from_issue(_issue['id'])})"
-                    _filter = {"issue_id": _issue["id"]}
-                    self.notify_users(msg,
-                                      self.database.find_watch_issues(_filter))
-
-    def notify_users(self, msg: str, users: List) -> None:
-        """
-
-        notify users
+        if not change.get("fullDocument"):
+            return
+        _issue = Issue(change["fullDocument"])
+        if change["operationType"] == "insert":
+            self.notify_users(str(_issue), self.subscribers.recipients(_issue))
+        elif change["operationType"] == "update":
+            _fields = self._updated_fields(change)
+            if _fields:
+                self.coalescer.add(_issue["id"], _fields)
+
+    @staticmethod
+    def _updated_fields(change: Dict) -> Set[str]:
+        """
+
+        top level fields changed by an update event
+        :param change:
+        :return:
+        """
+        _description = change.get("updateDescription") or {}
+        _fields = {_name.split(".")[0] for _name in _description.get("updatedFields", {})}
+        _fields.update(_name.split(".")[0] for _name in _description.get("removedFields", []))
+        _fields.discard(HASH_FIELD)
+        return _fields
+
+    def _notify_update(self, issue_id: str, fields: List[str], comments: List[Dict]) -> None:
+        """
+
+        notify watchers of coalesced updates of an issue
+        :param issue_id:
+        :param fields:
+        :param comments:
+        :return:
+        """
+        self.notify_users(render_issue_update(issue_id, fields, comments),
+                          self.subscribers.watchers(issue_id))
+
+    def _checkpoint(self, name: str) -> ResumeCheckpoint:
+        """
+
+        resume checkpoint of a change stream
+        :param name:
+        :return:
+        """
+        return ResumeCheckpoint(self.database,
+                                name,
+                                every=self.options.checkpoint_every,
+                                interval=self.options.checkpoint_interval)
+
+    def notify_users(self, msg: str, user_ids: Iterable[int]) -> None:
+        """
+
+        write notification jobs of users to the outbox, sending is done by
+        outbox senders of this or other processes, notifications of users in
+        digest mode are buffered until their next digest
         :param msg:
-        :param users
+        :param user_ids:
         :return:
         """
-        for user in users:
-            self.send_message(user_id=user["user_id"], text=msg)
+        _user_ids = list(user_ids)
+        _digests = self.subscribers.digests(_user_ids)
+        if _digests:
+            self.database.write_digest(msg, _digests)
+            DIGEST_NOTIFICATIONS.inc(len(_digests), stage="buffered")
+        _user_ids = [_user_id for _user_id in _user_ids if _user_id not in _digests]
+        if _user_ids:
+            self.database.write_outbox(msg, _user_ids)
 
     def send_message(self, user_id: int, text: str) -> None:
         """
@@ -192,8 +326,14 @@ class RysolvBot:
         self.updater.dispatcher.add_handler(CommandHandler("unregister", self.unregister))
         self.updater.dispatcher.add_handler(CommandHandler("watch", self.watch_issue))
         self.updater.dispatcher.add_handler(CommandHandler("list_watchers", self.list_watch_issue))
+        self.updater.dispatcher.add_handler(
+            CallbackQueryHandler(self.list_watch_issue_page,
+                                 pattern=f"^{re.escape(WATCHERS_CALLBACK)}[<>]"))
         self.updater.dispatcher.add_handler(CommandHandler("delete_watcher",
                                                            self.delete_watch_issue))
+        self.updater.dispatcher.add_handler(CommandHandler("filter", self.set_filter))
+        self.updater.dispatcher.add_handler(CommandHandler("clear_filter", self.clear_filter))
+        self.updater.dispatcher.add_handler(CommandHandler("digest", self.set_digest))
 #       self.updater.dispatcher.add_handler(CommandHandler("comments", self.get_comments_by_issue))
         self.updater.dispatcher.add_handler(CommandHandler("version", self.get_version))
         self.updater.dispatcher.add_handler(CommandHandler("help", self.help_bot))
@@ -228,6 +368,7 @@ class RysolvBot:
         """
         self.logger.info("/unregister -> Unregister user")
         result = self.database.delete_user(update.message.from_user.id)
+        self.database.delete_filter(update.message.from_user.id)
         msg = ""
         if result.deleted_count == 1:
             msg = "Register has been successfully deleted"
@@ -254,10 +395,10 @@ class RysolvBot:
         :return:
         """
         self.logger.info("/help -> User ask for help")
-        msg = "*List of available commands:*\n"
-        msg += "\n".join(self.TELEGRAM_USAGE_COMMANDS)
+        msg = f"*{escape('List of available commands:')}*\n"
+        msg += escape("\n".join(self.TELEGRAM_USAGE_COMMANDS))
 
-        update.message.reply_text(escape(msg), parse_mode="MarkdownV2")
+        update.message.reply_text(msg, parse_mode="MarkdownV2")
 
     @classmethod
     def find_all_uuid(cls, text: str) -> List:
@@ -272,20 +413,51 @@ class RysolvBot:
     def list_watch_issue(self, update: Update, _):
         """
 
-        list watch issue handler
+        list watch issue handler, first page of the user's watchers
         :param update:
         :return:
         """
-        _watch_issues = list(self.database.find_watch_issues())
-        msg = "*List of watchers:*\n"
+        msg, keyboard = self._watchers_page(update.message.from_user.id)
+        update.message.reply_text(msg, parse_mode="MarkdownV2", reply_markup=keyboard)
 
-        if _watch_issues:
-            msg += "\n".join([rf"\* Issue [{escape(item['issue_id'])}]" \
-                              f"({url_from_issue(item['issue_id'])})"
-                              for item in _watch_issues])
-        else:
-            msg = "No watcher found"
-        update.message.reply_text(msg, parse_mode="MarkdownV2")
+    def list_watch_issue_page(self, update: Update, _):
+        """
+
+        watchers page navigation handler
+        :param update:
+        :return:
+        """
+        _query = update.callback_query
+        _query.answer()
+        _direction, _issue_id = parse_watchers_cursor(_query.data)
+        msg, keyboard = self._watchers_page(_query.from_user.id, **{_direction: _issue_id})
+        try:
+            _query.edit_message_text(msg, parse_mode="MarkdownV2", reply_markup=keyboard)
+        except BadRequest as error:
+            # e.g. a stale cursor falling back to the page already shown
+            if "not modified" not in str(error).lower():
+                raise
+
+    def _watchers_page(self,
+                       user_id: int,
+                       after: Optional[str] = None,
+                       before: Optional[str] = None) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+        """
+
+        render a page of a user's watchers
+        :param user_id:
+        :param after:
+        :param before:
+        :return: message and navigation keyboard
+        """
+        _page = self.database.find_watched_issue_page(user_id,
+                                                      after=after,
+                                                      before=before,
+                                                      limit=self.WATCHERS_PAGE_SIZE)
+        if not _page[0] and (after or before):
+            # watchers deleted since the page was shown
+            _page = self.database.find_watched_issue_page(user_id, limit=self.WATCHERS_PAGE_SIZE)
+        return render_watchers(_page[0]), render_watchers_keyboard(*_page)
 
     def delete_watch_issue(self, update: Update, _):
         """
@@ -321,12 +493,8 @@ class RysolvBot:
         _id = next(iter(_ids))
         self.logger.info("/comments -> A user ask to get comments of issues %s", _id)
         _comments = self.database.find_comments({"issue_id": _id})
-        msg = rf"*List of comment of {escape(_id)}\:*\n"
-        for _comment in _comments:
-            msg += "\n".join([escape(item["body"])
-                              for item in _comment["comments"]])
-#       else:
-#           msg = "No comment found"
+        msg = rf"*List of comment of {escape(_id)}\:*" "\n"
+        msg += "\n".join(escape(item["body"]) for item in _comments)
         self.send_message(update.message.from_user.id, msg)
 
     def watch_issue(self, update: Update, _) -> None:
@@ -349,3 +517,95 @@ class RysolvBot:
             else:
                 msg = f"Watcher ({_id}) added failed!"
             update.message.reply_text(escape(msg), parse_mode="MarkdownV2")
+
+    @classmethod
+    def parse_filter(cls, user_id: int, text: str) -> Filter:
+        """
+
+        parse filter criteria like language=go,rust org=rysolv.com funded=10
+        :param user_id:
+        :param text: criteria
+        :return:
+        """
+        _fields = {}
+        for _criterion in text.split():
+            _key, _, _value = _criterion.partition("=")
+            _field = cls.FILTER_KEYS.get(_key.lower())
+            if _field is None or not _value:
+                raise ValueError(f"Unknown criterion {_criterion}, use "
+                                 + ", ".join(f"{_key}=..." for _key in cls.FILTER_KEYS))
+            if _field == "min_funded":
+                try:
+                    _fields[_field] = float(_value)
+                except ValueError:
+                    raise ValueError(f"Funded amount {_value} is not a number") from None
+            else:
+                _fields[_field] = sorted({_item.lower() for _item in _value.split(",") if _item})
+        return Filter(user_id=user_id, **_fields)
+
+    def set_filter(self, update: Update, _) -> None:
+        """
+
+        set new issues filter handler, show it without criteria
+        :param update:
+        :return:
+        """
+        _user_id = update.message.from_user.id
+        _criteria = update.message.text.partition(" ")[2]
+        if not _criteria.strip():
+            msg = render_filter(self.database.find_filter(_user_id))
+            update.message.reply_text(msg, parse_mode="MarkdownV2")
+            return
+        self.logger.info("/filter -> A user sets a filter %s", _criteria)
+        try:
+            _filter = self.parse_filter(_user_id, _criteria)
+        except ValueError as error:
+            update.message.reply_text(escape(str(error)), parse_mode="MarkdownV2")
+            return
+        self.database.update_filter(_filter)
+        update.message.reply_text(render_filter(_filter), parse_mode="MarkdownV2")
+
+    def clear_filter(self, update: Update, _) -> None:
+        """
+
+        clear new issues filter handler
+        :param update:
+        :return:
+        """
+        self.database.delete_filter(update.message.from_user.id)
+        update.message.reply_text(render_filter(None), parse_mode="MarkdownV2")
+
+    def set_digest(self, update: Update, _) -> None:
+        """
+
+        set digest period handler, show it without argument
+        :param update:
+        :return:
+        """
+        _user_id = update.message.from_user.id
+        _argument = update.message.text.partition(" ")[2]
+        if not _argument.strip():
+            # read from Users, the index may lag a change just made
+            _user = self.database.find_user(_user_id)
+            if _user is None:
+                update.message.reply_text(escape("Register first with /register"),
+                                          parse_mode="MarkdownV2")
+                return
+            _period = _user.get("digest")
+        else:
+            try:
+                _period = parse_period(_argument)
+            except ValueError as error:
+                update.message.reply_text(escape(str(error)), parse_mode="MarkdownV2")
+                return
+            self.logger.info("/digest -> A user sets digest period %s", _period)
+            result = self.database.update_user_digest(_user_id, _period)
+            if not result.matched_count:
+                update.message.reply_text(escape("Register first with /register"),
+                                          parse_mode="MarkdownV2")
+                return
+        if _period:
+            msg = f"You get a digest of your notifications every {format_period(_period)}"
+        else:
+            msg = "You get notifications as they happen"
+        update.message.reply_text(escape(msg), parse_mode="MarkdownV2")
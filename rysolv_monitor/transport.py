@@ -0,0 +1,163 @@
+"""
+
+transport module
+"""
+from typing import Dict, Iterator, NamedTuple, Optional
+from logging import Logger
+import codecs
+import random
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+# gzip,deflate and br when brotli is installed
+from urllib3.util.request import ACCEPT_ENCODING
+
+from .constant import BASE_URL
+from .metrics import QUERY_SECONDS
+
+
+class QueryError(Exception):
+    """
+
+    QueryError class
+    """
+    def __init__(self, msg: str, status_code: Optional[int] = None):
+        super().__init__(msg)
+        self.status_code = status_code
+
+
+class TransportOptions(NamedTuple):
+    """
+
+    TransportOptions class, connection pool, timeouts and retries
+    """
+    # keep-alive connections, one per concurrent query
+    pool_size: int = 8
+    connect_timeout: float = 5.0
+    read_timeout: float = 30.0
+    max_retries: int = 4
+    # seconds, doubled on each attempt up to max_backoff
+    backoff: float = 0.5
+    max_backoff: float = 30.0
+
+
+class RysolvTransport:
+    """
+
+    RysolvTransport class, keep-alive session with retries on the graphql api
+    """
+    RETRY_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+    HEADERS = {
+        "content-type": "application/json",
+        "accept-encoding": ACCEPT_ENCODING,
+        "user-agent": """Mozilla/5.0 (X11; Linux x86_64) """
+                      """AppleWebKit/537.36 (KHTML, like Gecko) """
+                      """Chrome/87.0.4280.141 Safari/537.36""",
+    }
+
+    def __init__(self,
+                 logger: Logger,
+                 options: TransportOptions = TransportOptions(),
+                 url: str = f"{BASE_URL}/graphql"):
+        self.logger = logger
+        self.options = options
+        self.url = url
+        self.session = requests.Session()
+        self.session.headers.update(self.HEADERS)
+        _adapter = HTTPAdapter(pool_connections=1, pool_maxsize=options.pool_size)
+        self.session.mount("https://", _adapter)
+        self.session.mount("http://", _adapter)
+
+    def query(self, query: str) -> Dict:
+        """
+
+        post a graphql query, retry on connection errors, 429 and 5xx
+        :param query:
+        :return: response body
+        """
+        return self._post(query).json()
+
+    def stream(self, query: str, chunk_size: int = 65536) -> Iterator[str]:
+        """
+
+        post a graphql query like query, the body is decoded as it is read
+        :param query:
+        :param chunk_size: bytes per read
+        :return: text chunks of the response body
+        """
+        resp = self._post(query, stream=True)
+        _decoder = codecs.getincrementaldecoder(resp.encoding or "utf-8")()
+        try:
+            for _chunk in resp.iter_content(chunk_size):
+                yield _decoder.decode(_chunk)
+            yield _decoder.decode(b"", final=True)
+        except requests.RequestException as error:
+            raise QueryError(f"Fail to read response of {self.url}: {error}") from error
+        finally:
+            resp.close()
+
+    def _post(self, query: str, stream: bool = False) -> requests.Response:
+        _attempt = 0
+        while True:
+            _retry_after = None
+            _start = time.monotonic()
+            try:
+                resp = self.session.post(self.url,
+                                         json={"query": query},
+                                         timeout=(self.options.connect_timeout,
+                                                  self.options.read_timeout),
+                                         stream=stream)
+            except (requests.ConnectionError, requests.Timeout) as error:
+                QUERY_SECONDS.observe(time.monotonic() - _start, status="error")
+                _error = QueryError(f"Fail to query on {self.url}: {error}")
+            else:
+                QUERY_SECONDS.observe(time.monotonic() - _start, status=str(resp.status_code))
+                if resp.status_code == 200:
+                    return resp
+                _error = QueryError(f"Fail to query on {self.url}, got {resp.status_code} "
+                                    f"instead of 200, reason: {resp.reason}",
+                                    resp.status_code)
+                _retry_after = self._retry_after(resp)
+                resp.close()
+                if resp.status_code not in self.RETRY_STATUS_CODES:
+                    raise _error
+            if _attempt >= self.options.max_retries:
+                raise _error
+            _delay = self.backoff_delay(_attempt, _retry_after)
+            self.logger.warning("%s, retry %d/%d in %.2fs",
+                                _error,
+                                _attempt + 1,
+                                self.options.max_retries,
+                                _delay)
+            time.sleep(_delay)
+            _attempt += 1
+
+    def backoff_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+
+        full jitter exponential backoff, at least retry_after when the server asks
+        :param attempt:
+        :param retry_after:
+        :return:
+        """
+        _cap = self.options.max_backoff
+        _delay = random.uniform(0, min(_cap, self.options.backoff * 2 ** attempt))
+        if retry_after is not None:
+            _delay = max(_delay, min(retry_after, _cap))
+        return _delay
+
+    @staticmethod
+    def _retry_after(resp: requests.Response) -> Optional[float]:
+        try:
+            return float(resp.headers["retry-after"])
+        except (KeyError, ValueError):
+            return None
+
+    def close(self) -> None:
+        """
+
+        close session
+        :return:
+        """
+        self.session.close()
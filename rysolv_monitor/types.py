@@ -2,23 +2,96 @@
 
 types modules
 """
-from .utils import (
-    escape,
-    url_from_issue
-)
+from typing import Any, Dict, Mapping, Optional, Tuple
 
+from .utils import url_from_issue
+from .render import render_issue
 
-class Comment(dict):
+
+class Record:
+    """
+
+    Record class, slotted document with a fixed set of fields, read like a
+    dict, unknown keys of source documents are dropped and missing fields
+    are None
+    """
+    __slots__ = ()
+    FIELDS: Tuple[str, ...] = ()
+
+    def __init__(self, document: Optional[Mapping] = None, **fields):
+        _get = document.get if document is not None else fields.get
+        for _field in self.FIELDS:
+            setattr(self, _field, _get(_field))
+        if document is not None:
+            for _field, _value in fields.items():
+                setattr(self, _field, _value)
+
+    @classmethod
+    def from_document(cls, document: Mapping) -> "Record":
+        """
+
+        build record from a bson document or an api response item
+        :param document:
+        :return:
+        """
+        return cls(document)
+
+    def to_document(self) -> Dict[str, Any]:
+        """
+
+        bson document of the record
+        :return:
+        """
+        return {_field: getattr(self, _field) for _field in self.FIELDS}
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """
+
+        field value, default when missing
+        :param key:
+        :param default:
+        :return:
+        """
+        _value = getattr(self, key, None)
+        return default if _value is None else _value
+
+    def __contains__(self, key: str) -> bool:
+        return getattr(self, key, None) is not None
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, Record):
+            return type(self) is type(other) and self.to_document() == other.to_document()
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_document()!r})"
+
+
+class Comment(Record):
     """
 
     Comment class
     """
+    FIELDS = ("issue_id", "comment_key", "initial", "body", "createdDate", "githubUrl",
+              "isGithubComment", "profilePic", "userId", "username")
+    __slots__ = FIELDS
 
-class Issue(dict):
+
+class Issue(Record):
     """
 
     Issue class
     """
+    FIELDS = ("id", "attempting", "body", "comments", "createdDate", "fundedAmount",
+              "language", "modifiedDate", "name", "open", "organizationId", "organizationName",
+              "organizationVerified", "rep", "repo", "type", "watching")
+    __slots__ = FIELDS
 
     def url_from_issue(self) -> str:
         """
@@ -29,11 +102,32 @@ class Issue(dict):
         return url_from_issue(self["id"])
 
     def __str__(self):
-        return f"*New {escape(self.get('type'))} from {escape(self.get('organizationName'))}*\n" \
-               rf"Name\: {escape(self.get('name'))}" \
-               rf"\- Language\: {escape(','.join(self.get('language')))}\n" \
-               rf" Funded amount\: {self.get('fundedAmount')}$ \- {self.get('comments')} comments" \
-               rf" \- {len(self['attempting'])} attemptings\n" \
-               f"[Rysolv]({self.url_from_issue()})\n" \
-               f"[Github]({self.get('repo')})\n" \
-               rf"Last update\: {escape(str(self.get('modifiedDate')))}"
+        return render_issue(self)
+
+
+class Filter(Record):
+    """
+
+    Filter class, new issue subscription filter of a user, an issue matches
+    when every set criterion does, one of its values is enough for lists
+    """
+    FIELDS = ("user_id", "languages", "organizations", "types", "min_funded")
+    __slots__ = FIELDS
+
+    def matches(self, issue: Mapping) -> bool:
+        """
+
+        does issue match filter
+        :param issue:
+        :return:
+        """
+        _languages = {_value.lower() for _value in issue.get("language") or []}
+        if self.get("languages") and not _languages.intersection(self.get("languages")):
+            return False
+        if self.get("organizations") and \
+                (issue.get("organizationName") or "").lower() not in self.get("organizations"):
+            return False
+        if self.get("types") and (issue.get("type") or "").lower() not in self.get("types"):
+            return False
+        return not self.get("min_funded") or \
+            (issue.get("fundedAmount") or 0) >= self.get("min_funded")
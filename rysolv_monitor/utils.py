@@ -7,21 +7,24 @@ import re
 
 from .constant import BASE_URL
 
+# characters reserved by telegram MarkdownV2, backslash first so it isn't
+# escaped twice
+MARKDOWN_RESERVED = "\\_*[]()~`>#+-=|{}.!"
+MARKDOWN_ESCAPES = tuple((_char, "\\" + _char) for _char in MARKDOWN_RESERVED)
+
+
 def escape(text: str) -> str:
     """
 
-    special escape for telegram message
+    special escape for telegram message, the membership test skips the
+    copy for absent characters, faster than translate or re.sub on CPython
     :param text:
     :return:
     """
-    return text.replace("-", r"\-") \
-            .replace("(", r"\(") \
-            .replace(")", r"\)") \
-            .replace("!", r"\!") \
-            .replace(".", r"\.") \
-            .replace("+", r"\+") \
-            .replace("=", r"\=") \
-            .replace("_", r"\_")
+    for _char, _escaped in MARKDOWN_ESCAPES:
+        if _char in text:
+            text = text.replace(_char, _escaped)
+    return text
 
 
 def url_from_issue(_id: str) -> str:
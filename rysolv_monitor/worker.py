@@ -0,0 +1,58 @@
+"""
+
+worker module
+"""
+from typing import Callable
+from threading import Event, Thread
+
+
+class Worker:
+    """
+
+    Worker class, daemon thread calling step until stopped, step returns the
+    seconds to wait before its next call
+    """
+    def __init__(self, step: Callable[[], float], name: str):
+        self.step = step
+        self.name = name
+        self._stop = Event()
+        self._thread = None
+
+    def start(self) -> None:
+        """
+
+        start thread, calling it again is a no-op
+        :return:
+        """
+        if self._thread is None:
+            self._thread = Thread(target=self.run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """
+
+        stop thread once its current step is done
+        :return:
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def run(self) -> None:
+        """
+
+        call step until stopped, in the calling thread
+        :return:
+        """
+        while not self._stop.is_set():
+            self._stop.wait(self.step())
+
+    def wait(self, timeout: float) -> bool:
+        """
+
+        sleep unless stopped meanwhile
+        :param timeout: seconds
+        :return: whether the worker is stopped
+        """
+        return self._stop.wait(timeout)
@@ -3,12 +3,15 @@
 test telegram_bot.py
 """
 import logging
+from types import SimpleNamespace
 
 import pytest
+from telegram.error import BadRequest
 
 from rysolv_monitor.telegram_bot import (
     RysolvBot,
 )
+from rysolv_monitor.types import Filter
 
 def test_init_bot(init_database):
     """
@@ -30,3 +33,44 @@ def test_init_bot(init_database):
 ])
 def test_find_all_uuid(data, expected):
     assert RysolvBot.find_all_uuid(data) == expected
+
+@pytest.mark.parametrize("data, expected", [
+    ("language=Go,rust funded=10", Filter(user_id=1, languages=["go", "rust"], min_funded=10.0)),
+    ("org=rysolv.com type=bug", Filter(user_id=1, organizations=["rysolv.com"], types=["bug"])),
+    pytest.param("stars=5", None, marks=pytest.mark.xfail(raises=ValueError)),
+    pytest.param("funded=much", None, marks=pytest.mark.xfail(raises=ValueError)),
+])
+def test_parse_filter(data, expected):
+    assert RysolvBot.parse_filter(1, data) == expected
+
+class _Query:
+    """
+
+    callback query double whose message already shows the page
+    """
+    data = "watchers>a"
+    from_user = SimpleNamespace(id=10)
+
+    def __init__(self, error):
+        self.error = error
+
+    def answer(self):
+        pass
+
+    def edit_message_text(self, *args, **kwargs):
+        raise self.error
+
+@pytest.mark.parametrize("error, raised", [
+    (BadRequest("Message is not modified: specified new message content is the same"), False),
+    (BadRequest("Message to edit not found"), True),
+])
+def test_list_watch_issue_page_unchanged(monkeypatch, error, raised):
+    bot = RysolvBot.__new__(RysolvBot)
+    monkeypatch.setattr(bot, "_watchers_page", lambda user_id, **cursor: ("page", None),
+                        raising=False)
+    update = SimpleNamespace(callback_query=_Query(error))
+    if raised:
+        with pytest.raises(BadRequest):
+            bot.list_watch_issue_page(update, None)
+    else:
+        bot.list_watch_issue_page(update, None)
@@ -0,0 +1,158 @@
+"""
+
+test changestream.py
+"""
+import logging
+
+from pymongo.errors import OperationFailure
+
+from rysolv_monitor.changestream import ChangeStreamRouter, ResumeCheckpoint, open_stream
+
+
+class _Database:
+    """
+
+    database double storing resume tokens
+    """
+    def __init__(self, tokens=None):
+        self.tokens = tokens or {}
+        self.writes = 0
+
+    def find_resume_token(self, name):
+        return self.tokens.get(name)
+
+    def write_resume_token(self, name, token):
+        self.writes += 1
+        self.tokens[name] = token
+
+    def delete_resume_token(self, name):
+        self.tokens.pop(name, None)
+
+
+class _Collection:
+    """
+
+    collection double whose watch fails when resuming from a lost token
+    """
+    def __init__(self, error_code=None):
+        self.error_code = error_code
+        self.calls = []
+
+    def watch(self, pipeline, **kwargs):
+        self.calls.append(kwargs)
+        if "resume_after" in kwargs and self.error_code:
+            raise OperationFailure("lost", code=self.error_code)
+        return pipeline
+
+
+def test_checkpoint_flushes_every_n_events():
+    database = _Database()
+    checkpoint = ResumeCheckpoint(database, "Issues", every=2, interval=3600)
+    checkpoint.update({"_data": "1"})
+    assert database.writes == 0
+    checkpoint.update({"_data": "2"})
+    assert database.tokens["Issues"] == {"_data": "2"}
+    checkpoint.update({"_data": "3"})
+    checkpoint.flush()
+    assert database.writes == 2
+    assert checkpoint.load() == {"_data": "3"}
+
+
+def test_open_stream_resumes_after_token():
+    database = _Database({"Issues": {"_data": "1"}})
+    collection = _Collection()
+    open_stream(collection, [], ResumeCheckpoint(database, "Issues"), logging.getLogger("test"))
+    assert collection.calls[0]["resume_after"] == {"_data": "1"}
+
+
+def test_open_stream_falls_back_when_token_lost():
+    database = _Database({"Issues": {"_data": "1"}})
+    collection = _Collection(error_code=286)
+    open_stream(collection, [], ResumeCheckpoint(database, "Issues"), logging.getLogger("test"))
+    assert "resume_after" not in collection.calls[-1]
+    assert "Issues" not in database.tokens
+
+
+class _Stream(list):
+    """
+
+    change stream double, dead once every change is read
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    @property
+    def alive(self):
+        return bool(self)
+
+    def try_next(self):
+        return self.pop(0)
+
+
+class _Watched:
+    """
+
+    database double whose change stream resumes after a token
+    """
+    def __init__(self, changes):
+        self.changes = changes
+        self.opened = []
+
+    def watch(self, pipeline, **kwargs):
+        _token = kwargs.get("resume_after")
+        self.opened.append(_token)
+        _tokens = [_change["_id"] for _change in self.changes]
+        return _Stream(self.changes[_tokens.index(_token) + 1 if _token else 0:])
+
+
+def _change(index, collection_name="Issues"):
+    return {"_id": {"_data": index}, "ns": {"coll": collection_name}, "operationType": "insert"}
+
+
+def test_router_dispatches_by_collection():
+    handled = []
+    router = ChangeStreamRouter(_Database(), None, logging.getLogger("test"))
+    router.register("Issues", lambda change: handled.append(("issue", change["_id"])))
+    router.register("Users", lambda change: handled.append(("user", change["_id"])))
+    for _index, _collection_name in enumerate(["Issues", "Users", "Comments"]):
+        router.dispatch(_change(_index, _collection_name))
+    assert handled == [("issue", {"_data": 0}), ("user", {"_data": 1})]
+
+
+def test_router_handles_failed_change_again():
+    database = _Database()
+    database.database = _Watched([_change(_index) for _index in range(3)])
+    router = ChangeStreamRouter(database,
+                                ResumeCheckpoint(database, "database", every=1),
+                                logging.getLogger("test"),
+                                retry_backoff=0)
+    handled = []
+
+    def _handler(change):
+        if change["_id"] == {"_data": 1} and len(database.database.opened) == 1:
+            raise Exception("boom")
+        handled.append(change["_id"]["_data"])
+        if len(handled) == 3:
+            router.stop()
+
+    router.register("Issues", _handler)
+    router.run()
+    assert handled == [0, 1, 2]
+    assert database.database.opened == [None, {"_data": 0}]
+    assert database.tokens["database"] == {"_data": 2}
+
+
+def test_router_stops_once_inactive():
+    database = _Database()
+    database.database = _Watched([_change(_index) for _index in range(3)])
+    handled = []
+    router = ChangeStreamRouter(database,
+                                ResumeCheckpoint(database, "database"),
+                                logging.getLogger("test"))
+    router.register("Issues", lambda change: handled.append(change["_id"]["_data"]))
+    router.run(active=lambda: len(handled) < 2)
+    assert handled == [0, 1]
+    assert database.tokens["database"] == {"_data": 1}
@@ -0,0 +1,102 @@
+"""
+
+test coalesce.py
+"""
+import logging
+import time
+
+from rysolv_monitor.coalesce import UpdateCoalescer
+
+
+def test_coalescer_merges_events_of_window():
+    flushed = []
+    coalescer = UpdateCoalescer(
+        lambda issue_id, fields, comments: flushed.append((issue_id, fields, comments)),
+        logging.getLogger("test"),
+        window=10)
+    coalescer.add("a", ["name"])
+    coalescer.add("a", [], [{"body": "hi"}])
+    coalescer.add("b", ["comments"])
+    coalescer.add("a", ["name", "open"])
+    now = time.monotonic()
+    assert coalescer.flush_due(now) > 0
+    assert not flushed
+    assert coalescer.flush_due(now + 11) == 10
+    assert sorted(flushed) == [("a", ["name", "open"], [{"body": "hi"}]),
+                               ("b", ["comments"], [])]
+
+
+def test_coalescer_flush_all():
+    flushed = []
+    coalescer = UpdateCoalescer(lambda issue_id, fields, comments: flushed.append(issue_id),
+                                logging.getLogger("test"))
+    coalescer.add("a", ["name"])
+    coalescer.flush_all()
+    assert flushed == ["a"]
+    coalescer.flush_all()
+    assert flushed == ["a"]
+
+
+class _Database:
+    """
+
+    database double storing pending updates
+    """
+    def __init__(self):
+        self.documents = {}
+
+    def write_pending_update(self, entry_id, issue_id, fields, comments, due):
+        _document = self.documents.setdefault(entry_id, {"_id": entry_id,
+                                                         "issue_id": issue_id,
+                                                         "fields": [],
+                                                         "comments": [],
+                                                         "due": due})
+        _document["fields"].extend(_field for _field in fields if _field not in _document["fields"])
+        _document["comments"].extend(comments)
+
+    def find_pending_updates(self):
+        return sorted(self.documents.values(), key=lambda _document: _document["due"])
+
+    def delete_pending_updates(self, ids):
+        for _id in ids:
+            self.documents.pop(_id, None)
+
+
+def test_coalescer_restores_persisted_updates():
+    database = _Database()
+    crashed = UpdateCoalescer(lambda issue_id, fields, comments: None,
+                              logging.getLogger("test"),
+                              database=database)
+    crashed.add("a", ["name"])
+    crashed.add("a", [], [{"body": "hi"}])
+    assert len(database.documents) == 1
+    flushed = []
+    coalescer = UpdateCoalescer(
+        lambda issue_id, fields, comments: flushed.append((issue_id, fields, comments)),
+        logging.getLogger("test"),
+        database=database)
+    assert coalescer.restore() == 1
+    assert coalescer.restore() == 0
+    coalescer.flush_all()
+    assert flushed == [("a", ["name"], [{"body": "hi"}])]
+    assert not database.documents
+
+
+def test_coalescer_keeps_updates_of_failed_flush():
+    database = _Database()
+    flushed = []
+
+    def _flush(issue_id, fields, comments):
+        if not flushed:
+            flushed.append(None)
+            raise Exception("boom")
+        flushed.append((issue_id, fields, comments))
+
+    coalescer = UpdateCoalescer(_flush, logging.getLogger("test"), database=database)
+    coalescer.add("a", ["name"])
+    coalescer.flush_all()
+    assert len(database.documents) == 1
+    coalescer.add("a", ["open"])
+    coalescer.flush_all()
+    assert flushed[1:] == [("a", ["name", "open"], [])]
+    assert not database.documents
@@ -2,9 +2,16 @@
 
 test crawler.py
 """
+import copy
 import logging
+import re
 
-from rysolv_monitor.crawler import RysolvCrawler
+import pytest
+
+from rysolv_monitor.crawler import CrawlerOptions, RysolvCrawler
+from rysolv_monitor.database import WriteSummary
+from rysolv_monitor.leader import LeaseLost
+from rysolv_monitor.snapshot import SnapshotRecorder, SnapshotReplayer
 
 def test_monitor_issue(init_database):
     """
@@ -14,8 +21,8 @@ def test_monitor_issue(init_database):
     :return:
     """
     crawler = RysolvCrawler(init_database, logging.getLogger("test"))
-    data = crawler._monitor_issue()
-    assert data
+    data = crawler.crawl()
+    assert data["issues"]
 
 def test_fetch_issues():
     """
@@ -47,3 +54,212 @@ def test_convert_to_datetime():
     """
     _date_convert = RysolvCrawler.convert_to_datetime("2020-12-23T18:00:00.417Z")
     assert str(_date_convert) == "2020-12-23 18:00:00.417000"
+
+
+def _fake_comments_query(query):
+    """
+
+    answer an aliased comments query, issue "bad" fails the whole query
+    """
+    _ids = re.findall(r'(c[0-9]+): getIssueComments\(issueId: "([^"]+)"\)', query)
+    if any(_issue_id == "bad" for _, _issue_id in _ids):
+        raise Exception("boom")
+    return {"data": {_alias: [{"body": _issue_id}] for _alias, _issue_id in _ids}}
+
+
+def test_fetch_comments_isolates_failures(monkeypatch):
+    """
+
+    test a failing issue doesn't abort the other fetches
+    :return:
+    """
+    crawler = RysolvCrawler(None, logging.getLogger("test"), CrawlerOptions(max_workers=4))
+    monkeypatch.setattr(crawler, "_query", _fake_comments_query)
+    data = crawler.fetch_comments([{"id": "a"}, {"id": "bad"}, {"id": "b"}])
+    assert data == {"a": [{"body": "a"}], "b": [{"body": "b"}]}
+
+
+@pytest.mark.parametrize("comments, expected", [
+    ([0, 0, 0, 0, 0], [2, 2, 1]),
+    ([5, 5, 1, 0, 0], [1, 2, 2]),
+    ([50, 0, 0, 0, 0], [1, 2, 2]),
+])
+def test_batch_issues(comments, expected):
+    """
+
+    test batches are bounded by size and comments count
+    :return:
+    """
+    crawler = RysolvCrawler(None,
+                            logging.getLogger("test"),
+                            CrawlerOptions(batch_size=2, batch_comments=6))
+    issues = [{"id": str(_index), "comments": _count} for _index, _count in enumerate(comments)]
+    assert [len(_batch) for _batch in crawler._batch_issues(issues)] == expected
+
+
+class _FingerprintDatabase:
+    """
+
+    database double storing fingerprints and comments
+    """
+    def __init__(self, fingerprints):
+        self.fingerprints = fingerprints
+        self.comments = []
+
+    @staticmethod
+    def write_issues(issues):
+        return WriteSummary()
+
+    @staticmethod
+    def find_watched_issue_ids():
+        return set()
+
+    def write_comments(self, comments):
+        self.comments.extend(comments)
+        return WriteSummary()
+
+    def find_fingerprints(self):
+        return dict(self.fingerprints)
+
+    def write_fingerprints(self, fingerprints):
+        for item in fingerprints:
+            self.fingerprints[item["issue_id"]] = item
+
+
+def test_changed_issues():
+    """
+
+    test only new or modified issues are refreshed
+    :return:
+    """
+    _date = RysolvCrawler.convert_to_datetime("2020-12-23T18:00:00.417Z")
+    database = _FingerprintDatabase({
+        "same": {"issue_id": "same", "comments": 1, "modifiedDate": _date},
+        "count": {"issue_id": "count", "comments": 1, "modifiedDate": _date},
+    })
+    crawler = RysolvCrawler(database, logging.getLogger("test"))
+    issues = [{"id": "same", "comments": 1, "modifiedDate": _date},
+              {"id": "count", "comments": 2, "modifiedDate": _date},
+              {"id": "new", "comments": 0, "modifiedDate": _date}]
+    changed = crawler.changed_issues(issues)
+    assert [_issue["id"] for _issue in changed] == ["count", "new"]
+    crawler.update_fingerprints(changed)
+    assert not crawler.changed_issues(issues)
+    assert database.fingerprints["new"]["comments"] == 0
+
+
+def test_crawl_stores_one_document_per_comment(monkeypatch):
+    """
+
+    test comments are flattened, keyed and flagged initial for new issues
+    :return:
+    """
+    _date = RysolvCrawler.convert_to_datetime("2020-12-23T18:00:00.417Z")
+    database = _FingerprintDatabase({
+        "known": {"issue_id": "known", "comments": 1, "modifiedDate": _date},
+    })
+    crawler = RysolvCrawler(database, logging.getLogger("test"))
+    monkeypatch.setattr(crawler, "iter_issues", lambda: iter([
+        {"id": "known", "comments": 2, "modifiedDate": _date},
+        {"id": "new", "comments": 1, "modifiedDate": _date},
+    ]))
+    monkeypatch.setattr(crawler, "_query", _fake_comments_query)
+    stats = crawler.crawl()
+    assert stats["refreshed"] == 2
+    assert sorted((item["issue_id"], item["initial"]) for item in database.comments) == \
+        [("known", False), ("new", True)]
+    assert all(len(item["comment_key"]) == 40 for item in database.comments)
+    stats = crawler.crawl()
+    assert stats["changed"] == 0
+    assert stats["skipped"] == 2
+
+
+def test_crawl_replay(tmp_path):
+    """
+
+    test a recorded crawl replays offline and the monitor stops at the end
+    :return:
+    """
+    _issues = {"data": {"getIssues": {"issues": [
+        {"id": "a", "comments": 1, "createdDate": "2020-12-23T18:00:00.417Z",
+         "modifiedDate": "2020-12-23T18:00:00.417Z"},
+    ]}}}
+    _transport = type("Transport", (), {
+        "query": staticmethod(lambda query: _fake_comments_query(query)
+                              if "getIssueComments" in query else copy.deepcopy(_issues)),
+        "close": staticmethod(lambda: None),
+    })
+    path = str(tmp_path / "snapshot.jsonl.gz")
+    recorder = SnapshotRecorder(_transport, path, logging.getLogger("test"))
+    database = _FingerprintDatabase({})
+    recorded = RysolvCrawler(database, logging.getLogger("test"), transport=recorder).crawl()
+    recorder.close()
+    replayed_database = _FingerprintDatabase({})
+    crawler = RysolvCrawler(replayed_database,
+                            logging.getLogger("test"),
+                            CrawlerOptions(sleep_time=0),
+                            transport=SnapshotReplayer(path, logging.getLogger("test")))
+    crawler.run()
+    assert replayed_database.comments == database.comments
+    assert recorded["refreshed"] == 1
+
+
+def test_crawl_in_chunks(monkeypatch):
+    """
+
+    test issues are refreshed chunk by chunk
+    :return:
+    """
+    _date = RysolvCrawler.convert_to_datetime("2020-12-23T18:00:00.417Z")
+    database = _FingerprintDatabase({})
+    crawler = RysolvCrawler(database,
+                            logging.getLogger("test"),
+                            CrawlerOptions(max_workers=2, batch_size=2, chunk_size=2))
+    monkeypatch.setattr(crawler, "iter_issues", lambda: iter([
+        {"id": str(_index), "comments": 1, "modifiedDate": _date} for _index in range(5)
+    ]))
+    refreshes = []
+    _refresh = crawler._refresh
+    monkeypatch.setattr(crawler, "_refresh", lambda issues, changed_ids: (
+        refreshes.append(len(issues)), _refresh(issues, changed_ids))[1])
+    monkeypatch.setattr(crawler, "_query", _fake_comments_query)
+    stats = crawler.crawl()
+    assert refreshes == [4, 1]
+    assert stats["issues"] == stats["refreshed"] == 5
+    assert len(database.comments) == 5
+
+
+class _Leader:
+    """
+
+    leader double losing its lease after some checks
+    """
+    name = "crawler"
+
+    def __init__(self, checks):
+        self.checks = checks
+
+    def is_leader(self):
+        self.checks -= 1
+        return self.checks >= 0
+
+
+def test_crawl_aborts_when_lease_lost(monkeypatch):
+    """
+
+    test a sweep stops at the first chunk after the lease lapsed
+    :return:
+    """
+    database = _FingerprintDatabase({})
+    written = []
+    monkeypatch.setattr(database, "write_issues", lambda issues: (
+        written.append(len(issues)), WriteSummary())[1])
+    crawler = RysolvCrawler(database,
+                            logging.getLogger("test"),
+                            CrawlerOptions(chunk_size=2))
+    monkeypatch.setattr(crawler, "iter_issues", lambda: iter([
+        {"id": str(_index), "comments": 0} for _index in range(6)
+    ]))
+    with pytest.raises(LeaseLost):
+        crawler.crawl(_Leader(2))
+    assert written == [2, 2]
@@ -1,6 +1,13 @@
+import time
+import uuid
+
+from pymongo.errors import AutoReconnect, BulkWriteError, OperationFailure, WTimeoutError
+from bson import ObjectId
 import pytest
 
-from rysolv_monitor.database import RysolvCollections
+from rysolv_monitor.database import RysolvCollections, RysolvDatabase, is_transient
+from rysolv_monitor.schema import SchemaMismatch
+from rysolv_monitor.types import Comment, Issue
 
 
 def test_database_init_collections(init_database):
@@ -14,15 +21,172 @@ def test_database_users_validator(init_database, data):
     init_database.collections[RysolvCollections.Users.name].insert_one(data)
 
 @pytest.mark.parametrize("data", [
-    ({"user_id": 55555, "issue_id": 495959}),
+    ({"user_id": 55555, "issue_id": "49e9f746-c265-447f-ae66-4fbbeb910ab0"}),
     pytest.param({"user_id": 555}, marks=pytest.mark.xfail),
     pytest.param({"isssue_id": 555}, marks=pytest.mark.xfail),
     pytest.param({"user_id": 55555, "issue_id": "495959"}, marks=pytest.mark.xfail),
-    pytest.param({"user_id": "55555", "issue_id": 495959}, marks=pytest.mark.xfail),
+    pytest.param({"user_id": "55555", "issue_id": "49e9f746-c265-447f-ae66-4fbbeb910ab0"},
+                 marks=pytest.mark.xfail),
 ])
 def test_database_watch_issue_validator(init_database, data):
     init_database.collections[RysolvCollections.WatchIssues.name].insert_one(data)
 
+def test_database_reconcile_is_idempotent(init_database):
+    assert init_database.reconcile(apply=False) == []
+    init_database.database.command("collMod", RysolvCollections.Users.name, validator={})
+    init_database.collections[RysolvCollections.Issues.name].drop_index("id_-1")
+    assert init_database.reconcile(apply=False) == ["set validator of Users",
+                                                    "create 1 indexes on Issues"]
+    with pytest.raises(SchemaMismatch):
+        RysolvDatabase(init_database.database, check_only=True)
+    init_database.reconcile()
+    assert RysolvDatabase(init_database.database, check_only=True).reconcile(apply=False) == []
+
 def test_database_find_last_version(init_database):
     version = init_database.find_last_version()
     assert not version
+
+def test_database_write_issues_skips_unchanged(init_database):
+    issues = [Issue(id="a", name="first"), Issue(id="b", name="second")]
+    result = init_database.write_issues(issues)
+    assert result.upserted_count == 2
+    issues[1] = Issue(id="b", name="renamed")
+    result = init_database.write_issues(issues)
+    assert result.skipped_count == 1
+    assert result.modified_count == 1
+
+def _comment(issue_id, comment_key, body, **fields):
+    _document = {"issue_id": issue_id, "comment_key": comment_key, "initial": False,
+                 "body": body, "createdDate": "2021-01-01T00:00:00.000Z", "githubUrl": None,
+                 "isGithubComment": False, "profilePic": None, "userId": "u1",
+                 "username": "user"}
+    return Comment(_document, **fields)
+
+def test_database_write_comments_inserts_new_only(init_database):
+    comments = [_comment("a", "1", "first"),
+                _comment("a", "2", "second")]
+    result = init_database.write_comments(comments)
+    assert result.upserted_count == 2
+    result = init_database.write_comments(comments + [_comment("b", "1", "third")])
+    assert result.upserted_count == 1
+    assert result.skipped_count == 2
+
+def test_database_write_comments_without_author(init_database):
+    # the api may return comments without author nor date
+    result = init_database.write_comments([_comment("a", "1", "ghost",
+                                                    createdDate=None,
+                                                    userId=None,
+                                                    username=None)])
+    assert result.upserted_count == 1
+
+@pytest.mark.parametrize("error, transient", [
+    (AutoReconnect("primary stepped down"), True),
+    (WTimeoutError("waiting for replication timed out"), True),
+    (BulkWriteError({"writeErrors": [{"code": 11000}], "writeConcernErrors": []}), True),
+    (BulkWriteError({"writeErrors": [{"code": 121}], "writeConcernErrors": []}), False),
+    (OperationFailure("not authorized", code=13), False),
+])
+def test_is_transient(error, transient):
+    assert is_transient(error) is transient
+
+class _FlakyCollection:
+    """
+
+    _FlakyCollection class, fails the first bulk write
+    """
+    def __init__(self, collection):
+        self.collection = collection
+        self.calls = 0
+
+    def bulk_write(self, operations, ordered):
+        self.calls += 1
+        if self.calls == 1:
+            raise AutoReconnect("connection reset")
+        return self.collection.bulk_write(operations, ordered=ordered)
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+def test_database_bulk_write_retries_transient_errors(init_database):
+    init_database.options = init_database.options._replace(retry_backoff=0)
+    flaky = _FlakyCollection(init_database.collections[RysolvCollections.Issues.name])
+    init_database.collections[RysolvCollections.Issues.name] = flaky
+    result = init_database.write_issues([Issue(id="a", name="first")])
+    assert flaky.calls == 2
+    assert result.upserted_count == 1
+
+def test_database_write_concern_profiles(init_database):
+    issues = init_database.collections[RysolvCollections.Issues.name]
+    users = init_database.collections[RysolvCollections.Users.name]
+    assert issues.write_concern.document == {"w": 1}
+    assert users.write_concern.document == {"w": "majority"}
+
+def test_database_outbox_lease(init_database):
+    init_database.write_outbox("hello", [1, 2, 65])
+    partitions = [1]
+    job = init_database.claim_outbox_job("first", partitions, lease=60)
+    assert sorted(job["user_ids"]) == [1, 65]
+    assert job["attempts"] == 1
+    assert init_database.claim_outbox_job("second", partitions, lease=60) is None
+    # an expired lease, e.g. of a crashed sender, is claimed again
+    init_database.collections[RysolvCollections.Outbox.name].update_one(
+        {"_id": job["_id"]}, {"$set": {"lease_until": 0}})
+    job = init_database.claim_outbox_job("second", partitions, lease=60)
+    assert job["attempts"] == 2
+    assert not init_database.complete_outbox_job(job["_id"], "first", [1, 65], []).matched_count
+    assert init_database.complete_outbox_job(job["_id"], "second", [1, 65], []).modified_count
+    assert init_database.claim_outbox_job("second", partitions, lease=60) is None
+
+def test_database_server_time(init_database):
+    assert abs(init_database.server_time() - time.time()) < 60
+
+def test_database_lease(init_database):
+    assert init_database.acquire_lease("crawler", "first", ttl=60)
+    assert not init_database.acquire_lease("crawler", "second", ttl=60)
+    assert init_database.acquire_lease("crawler", "first", ttl=60)
+    # expired, e.g. the leader died
+    assert init_database.acquire_lease("crawler", "first", ttl=-1)
+    assert init_database.acquire_lease("crawler", "second", ttl=60)
+    assert not init_database.release_lease("crawler", "first").deleted_count
+    assert init_database.release_lease("crawler", "second").deleted_count
+
+def test_database_digest_buffer(init_database):
+    init_database.update_user(10)
+    assert init_database.update_user_digest(10, 900).matched_count
+    assert init_database.find_user(10)["digest"] == 900
+    assert init_database.find_user(20) is None
+    assert not init_database.update_user_digest(20, 900).matched_count
+    init_database.write_digest("first", {10: 900})
+    init_database.write_digest("second", {10: 900})
+    assert init_database.find_due_digest_users(0) == []
+    later = time.time() + 900
+    assert init_database.find_due_digest_users(later) == [10]
+    entries = init_database.find_digest_entries(10, later)
+    assert [entry["text"] for entry in entries] == ["first", "second"]
+    init_database.delete_digest_entries([entry["_id"] for entry in entries])
+    assert init_database.find_due_digest_users(later) == []
+
+def test_database_pending_updates(init_database):
+    entry_id = ObjectId()
+    init_database.write_pending_update(entry_id, "a", ["name"], [{"body": "hi"}], due=1)
+    # a retried write doesn't add events twice
+    init_database.write_pending_update(entry_id, "a", ["name", "open"], [{"body": "hi"}], due=2)
+    documents = init_database.find_pending_updates()
+    assert [(_document["fields"], _document["comments"], _document["due"])
+            for _document in documents] == [(["name", "open"], [{"body": "hi"}], 1)]
+    init_database.delete_pending_updates([entry_id])
+    assert init_database.find_pending_updates() == []
+
+def test_database_watched_issue_page(init_database):
+    issue_ids = sorted(str(uuid.UUID(int=_index, version=4)) for _index in range(5))
+    for issue_id in issue_ids:
+        init_database.update_watch_issue(10, issue_id)
+    init_database.update_watch_issue(20, issue_ids[0])
+    assert init_database.find_watched_issue_page(10, limit=2) == (issue_ids[:2], False, True)
+    assert init_database.find_watched_issue_page(10, after=issue_ids[3], limit=2) == \
+        (issue_ids[4:], True, False)
+    assert init_database.find_watched_issue_page(10, before=issue_ids[2], limit=2) == \
+        (issue_ids[:2], False, True)
+    explain = init_database.collections[RysolvCollections.WatchIssues.name] \
+        .find({"user_id": 10}, {"_id": 0, "issue_id": 1}).explain()
+    assert explain["executionStats"]["totalDocsExamined"] == 0
@@ -0,0 +1,63 @@
+"""
+
+test digest.py
+"""
+import logging
+
+import pytest
+
+from rysolv_monitor.digest import DigestFlusher, format_period, parse_period
+
+
+@pytest.mark.parametrize("data, expected", [
+    ("15m", 900.0),
+    ("1H", 3600.0),
+    ("1d", 86400.0),
+    ("off", None),
+    pytest.param("1m", None, marks=pytest.mark.xfail(raises=ValueError)),
+    pytest.param("hourly", None, marks=pytest.mark.xfail(raises=ValueError)),
+])
+def test_parse_period(data, expected):
+    assert parse_period(data) == expected
+
+
+def test_format_period():
+    assert format_period(900.0) == "15m"
+    assert format_period(7200.0) == "2h"
+    assert format_period(86400.0) == "1d"
+
+
+class _DigestDatabase:
+    """
+
+    database double of digest buffer and outbox
+    """
+    def __init__(self, entries):
+        self.entries = entries
+        self.outbox = []
+
+    def find_due_digest_users(self, now):
+        return sorted({_entry["user_id"] for _entry in self.entries if _entry["due"] <= now})
+
+    def find_digest_entries(self, user_id, now):
+        return [_entry for _entry in self.entries
+                if _entry["user_id"] == user_id and _entry["due"] <= now]
+
+    def delete_digest_entries(self, ids):
+        self.entries = [_entry for _entry in self.entries if _entry["_id"] not in ids]
+
+    def write_outbox(self, text, user_ids):
+        self.outbox.append((text, user_ids))
+
+
+def test_flush_due_combines_notifications_per_user():
+    database = _DigestDatabase([
+        {"_id": 1, "user_id": 10, "text": "first", "due": 100},
+        {"_id": 2, "user_id": 10, "text": "second", "due": 100},
+        {"_id": 3, "user_id": 20, "text": "later", "due": 200},
+    ])
+    flusher = DigestFlusher(database, logging.getLogger("test"))
+    assert flusher.flush_due(150) == 1
+    assert database.outbox == [("*Digest, 2 notifications*\n\nfirst\n\nsecond", [10])]
+    assert [_entry["_id"] for _entry in database.entries] == [3]
+    assert flusher.flush_due(150) == 0
@@ -0,0 +1,42 @@
+"""
+
+test dispatcher.py
+"""
+import logging
+
+from telegram.error import RetryAfter, Unauthorized
+
+from rysolv_monitor.dispatcher import DispatcherOptions, NotificationDispatcher
+
+
+def test_dispatcher_sends_and_counts(monkeypatch):
+    """
+
+    test messages are delivered, rate limits retried and failures counted
+    :return:
+    """
+    monkeypatch.setattr("time.sleep", lambda _: None)
+    sent = []
+    retried = set()
+
+    def _send(user_id, text):
+        if user_id == 2 and user_id not in retried:
+            retried.add(user_id)
+            raise RetryAfter(1)
+        if user_id == 3:
+            raise Unauthorized("blocked")
+        sent.append((user_id, text))
+
+    dispatcher = NotificationDispatcher(_send, logging.getLogger("test"),
+                                        DispatcherOptions(workers=2))
+    dispatcher.start()
+    for _user_id in (1, 2, 3):
+        dispatcher.submit(_user_id, "hello")
+    dispatcher.join()
+    dispatcher.stop()
+    assert sorted(sent) == [(1, "hello"), (2, "hello")]
+    stats = dispatcher.stats()
+    assert stats["sent"] == 2
+    assert stats["failed"] == 1
+    assert stats["rate_limited"] == 1
+    assert stats["queue_depth"] == 0
@@ -0,0 +1,58 @@
+"""
+
+test leader.py
+"""
+import logging
+
+from rysolv_monitor.leader import LeaderLease
+
+
+class _LeaseDatabase:
+    """
+
+    database double of a single lease
+    """
+    def __init__(self):
+        self.owner = None
+        self.available = True
+
+    def acquire_lease(self, name, owner, ttl):
+        if not self.available:
+            raise ConnectionError("database down")
+        if self.owner in (None, owner):
+            self.owner = owner
+        return self.owner == owner
+
+    def release_lease(self, name, owner):
+        if self.owner == owner:
+            self.owner = None
+
+
+def test_lease_single_leader_and_takeover():
+    database = _LeaseDatabase()
+    first = LeaderLease(database, "crawler", logging.getLogger("test"))
+    second = LeaderLease(database, "crawler", logging.getLogger("test"))
+    assert first.renew()
+    assert not second.renew()
+    first.stop()
+    assert not first.is_leader()
+    assert second.renew()
+
+
+def test_lease_kept_until_lapse(monkeypatch):
+    """
+
+    test a failed renewal keeps leading until the lease lapses
+    :return:
+    """
+    now = [100.0]
+    monkeypatch.setattr("time.monotonic", lambda: now[0])
+    database = _LeaseDatabase()
+    lease = LeaderLease(database, "crawler", logging.getLogger("test"), ttl=10)
+    assert lease.renew()
+    database.available = False
+    now[0] += 5
+    assert lease.renew()
+    now[0] += 5
+    assert not lease.renew()
+    assert not lease.wait(0)
@@ -0,0 +1,29 @@
+"""
+
+test __main__.py
+"""
+import pytest
+
+from rysolv_monitor.__main__ import _env_flag, build_parser
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("1", True),
+    ("TRUE", True),
+    ("yes", True),
+    ("0", False),
+    ("false", False),
+    ("", False),
+])
+def test_env_flag(monkeypatch, value, expected):
+    monkeypatch.setenv("CHECK_ONLY", value)
+    assert _env_flag("CHECK_ONLY") is expected
+
+
+def test_build_parser_reads_environment(monkeypatch):
+    monkeypatch.setenv("CHECK_ONLY", "true")
+    monkeypatch.setenv("SENDER_COUNT", "3")
+    parsed = build_parser().parse_args([])
+    assert parsed.check_only is True
+    assert parsed.sender_count == 3
+    assert build_parser().parse_args(["--sender-count", "2"]).sender_count == 2
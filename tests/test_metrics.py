@@ -0,0 +1,46 @@
+"""
+
+test metrics.py
+"""
+import urllib.request
+
+from rysolv_monitor.metrics import MetricsRegistry, start_metrics_server
+
+
+def test_registry_render():
+    registry = MetricsRegistry()
+    counter = registry.counter("test_total", "Test counter", ("status",))
+    counter.inc(status="200")
+    counter.inc(2, status="200")
+    gauge = registry.gauge("test_depth", "Test gauge")
+    gauge.set_function(lambda: 7)
+    histogram = registry.histogram("test_seconds", "Test histogram", buckets=(0.1, 1.0))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+    assert registry.counter("test_total", "Test counter", ("status",)) is counter
+    text = registry.render()
+    assert "# TYPE test_total counter\ntest_total{status=\"200\"} 3\n" in text
+    assert "test_depth 7\n" in text
+    assert 'test_seconds_bucket{le="0.1"} 1\n' in text
+    assert 'test_seconds_bucket{le="1.0"} 2\n' in text
+    assert 'test_seconds_bucket{le="+Inf"} 3\n' in text
+    assert "test_seconds_count 3\n" in text
+    assert "test_seconds_sum 5.55\n" in text
+    assert histogram.count() == 3
+    assert histogram.sum() == 5.55
+    counter.clear()
+    assert counter.value(status="200") == 0
+    assert "test_total{" not in registry.render()
+
+
+def test_metrics_server():
+    registry = MetricsRegistry()
+    registry.counter("test_total", "Test counter").inc()
+    server = start_metrics_server(0, registry=registry)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url) as resp:
+            assert b"test_total 1" in resp.read()
+    finally:
+        server.shutdown()
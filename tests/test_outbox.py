@@ -0,0 +1,96 @@
+"""
+
+test outbox.py
+"""
+import logging
+
+import pytest
+from pymongo.results import UpdateResult
+from telegram.error import TimedOut, Unauthorized
+
+from rysolv_monitor.dispatcher import DispatcherOptions, NotificationDispatcher
+from rysolv_monitor.outbox import OutboxSender, SenderOptions, sender_partitions
+
+
+class _OutboxDatabase:
+    """
+
+    database double holding outbox jobs
+    """
+    def __init__(self, jobs):
+        self.jobs = {job["_id"]: dict(job, attempts=0, status="pending") for job in jobs}
+        self.completed = []
+
+    def claim_outbox_job(self, owner, partitions, lease):
+        for job in self.jobs.values():
+            if job["status"] == "pending" and job["partition"] in partitions:
+                job.update(status="leased", lease_owner=owner, attempts=job["attempts"] + 1)
+                return dict(job)
+        return None
+
+    def complete_outbox_job(self, job_id, owner, delivered, retry_user_ids, retry_at=None):
+        self.completed.append((job_id, sorted(delivered), sorted(retry_user_ids), retry_at))
+        job = self.jobs[job_id]
+        if retry_user_ids and retry_at is not None:
+            job.update(status="pending", user_ids=retry_user_ids)
+        else:
+            job.update(status="failed" if retry_user_ids else "sent")
+        job.setdefault("delivered", []).extend(delivered)
+        return UpdateResult({"n": 1, "nModified": 1}, True)
+
+
+def test_sender_partitions():
+    partitions = [sender_partitions(_index, 3) for _index in range(3)]
+    assert sorted(sum(partitions, [])) == list(range(64))
+    assert not set(partitions[0]) & set(partitions[1])
+    with pytest.raises(ValueError):
+        sender_partitions(3, 3)
+
+
+def test_sender_retries_transient_failures_only(monkeypatch):
+    """
+
+    test sent and blocked recipients are done, timed out ones are retried
+    :return:
+    """
+    monkeypatch.setattr("time.sleep", lambda _: None)
+    timed_out = set()
+    sent = []
+
+    def _send(user_id, text):
+        if user_id == 2 and user_id not in timed_out:
+            timed_out.add(user_id)
+            raise TimedOut()
+        if user_id == 3:
+            raise Unauthorized("blocked")
+        sent.append((user_id, text))
+
+    database = _OutboxDatabase([{"_id": "job", "partition": 1, "user_ids": [1, 2, 3],
+                                 "text": "hello"}])
+    dispatcher = NotificationDispatcher(_send, logging.getLogger("test"),
+                                        DispatcherOptions(workers=2))
+    dispatcher.start()
+    sender = OutboxSender(database,
+                          dispatcher,
+                          logging.getLogger("test"),
+                          SenderOptions(retry_backoff=0))
+    assert sender.drain_once()
+    dispatcher.join()
+    assert database.completed[0][1:3] == ([1], [2])
+    assert sender.drain_once()
+    dispatcher.join()
+    assert not sender.drain_once()
+    dispatcher.stop()
+    assert sorted(sent) == [(1, "hello"), (2, "hello")]
+    assert database.jobs["job"]["status"] == "sent"
+
+
+def test_sender_gives_up_after_max_attempts():
+    database = _OutboxDatabase([{"_id": "job", "partition": 1, "user_ids": [1], "text": "hi"}])
+    database.jobs["job"]["attempts"] = 2
+    sender = OutboxSender(database,
+                          None,
+                          logging.getLogger("test"),
+                          SenderOptions(max_attempts=2))
+    assert sender.drain_once()
+    assert database.jobs["job"]["status"] == "failed"
@@ -0,0 +1,28 @@
+"""
+
+test ratelimit.py
+"""
+import time
+
+import pytest
+
+from rysolv_monitor.ratelimit import ChatRateLimiter, TokenBucket
+
+
+def test_token_bucket_reserve():
+    bucket = TokenBucket(rate=10, capacity=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    assert bucket.reserve() == pytest.approx(0.2, abs=0.01)
+    assert not bucket.is_full()
+
+
+def test_chat_rate_limiter_prunes_idle_chats():
+    limiter = ChatRateLimiter(global_rate=1000, chat_rate=20, max_chats=2)
+    assert limiter.reserve(1) == 0
+    assert limiter.reserve(2) == 0
+    # both chats used a token in the last 50ms
+    assert limiter.prune() == 0
+    time.sleep(0.1)
+    assert limiter.prune() == 2
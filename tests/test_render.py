@@ -0,0 +1,107 @@
+"""
+
+test render.py
+"""
+from rysolv_monitor.render import (
+    ISSUE_CACHE,
+    MESSAGE_LENGTH,
+    parse_watchers_cursor,
+    render_comment,
+    render_digest,
+    render_filter,
+    render_issue,
+    render_issue_update,
+    render_watchers,
+    render_watchers_keyboard,
+)
+from rysolv_monitor.types import Filter, Issue
+from rysolv_monitor.utils import escape
+
+ISSUE = Issue({
+    "id": "49e9f746-c265-447f-ae66-4fbbeb910ab0",
+    "type": "bug",
+    "organizationName": "rysolv",
+    "name": "Fix [parser] (v1.2)",
+    "language": ["python", "c++"],
+    "fundedAmount": 12.5,
+    "comments": 2,
+    "attempting": ["a"],
+    "repo": "https://github.com/rysolv/rysolv",
+    "modifiedDate": "2020-12-23 18:00:00",
+})
+
+
+def test_escape_all_reserved_characters():
+    assert escape("_*[]()~`>#+-=|{}.!\\") == \
+        r"\_\*\[\]\(\)\~\`\>\#\+\-\=\|\{\}\.\!\\"
+    assert escape("plain text") == "plain text"
+
+
+def test_render_issue_cached_per_version():
+    ISSUE_CACHE.clear()
+    text = str(ISSUE)
+    assert r"Name\: Fix \[parser\] \(v1\.2\)" in text
+    assert r"Funded amount\: 12\.5$" in text
+    assert render_issue(ISSUE) is text
+    assert ISSUE_CACHE.hits == 1
+    updated = Issue(ISSUE, modifiedDate="2020-12-24 18:00:00")
+    assert render_issue(updated) is not text
+
+
+def test_render_watchers():
+    assert render_watchers([]) == "No watcher found"
+    assert render_watchers(["a-b"]) == "*List of watchers:*\n" \
+        r"\* Issue [a\-b](https://rysolv.com/issues/detail/a-b)"
+
+
+def test_render_watchers_keyboard():
+    assert render_watchers_keyboard(["a", "b"], False, False) is None
+    keyboard = render_watchers_keyboard(["a", "b"], True, True)
+    previous, _next = keyboard.inline_keyboard[0]
+    assert parse_watchers_cursor(previous.callback_data) == ("before", "a")
+    assert parse_watchers_cursor(_next.callback_data) == ("after", "b")
+
+
+def test_render_issue_update_lists_fields():
+    assert render_issue_update("a-b", ["comments", "fundedAmount"]) == \
+        "New modification on issue [a\\-b](https://rysolv.com/issues/detail/a-b)\n" \
+        r"Changed\: comments, fundedAmount"
+
+
+def test_render_comment_snippet():
+    text = render_comment({"username": "john_doe", "body": "Looks good.\n" + "x" * 200})
+    assert text.startswith(r"\- *john\_doe*\: Looks good\. xxx")
+    assert text.endswith("…")
+    assert render_comment({"body": None}) == r"\- *anonymous*\: "
+
+
+def test_render_filter():
+    assert render_filter(None) == "No filter, you get every new issue"
+    assert render_filter(Filter(user_id=1, languages=["c++", "go"], min_funded=10)) == \
+        "*New issues filter:*\n" \
+        r"\- Languages\: c\+\+, go" "\n" \
+        r"\- Min funded amount\: 10$"
+
+
+def test_render_digest_splits_between_notifications():
+    messages = render_digest(["a" * 60, "b" * 60, "c"], limit=100)
+    assert messages == ["*Digest, 3 notifications*\n\n" + "a" * 60, "b" * 60 + "\n\nc"]
+
+
+def test_render_digest_never_exceeds_limit():
+    messages = render_digest(["x" * 3000] * 4)
+    assert len(messages) == 4
+    assert all(len(_message) <= MESSAGE_LENGTH for _message in messages)
+    assert "".join(messages).count("x") == 12000
+
+
+def test_render_digest_splits_long_notification_between_lines():
+    messages = render_digest(["*title*\n" + "a" * 50 + "\n" + "b" * 50, "c"], limit=80)
+    assert messages == ["*Digest, 2 notifications*\n\n*title*", "a" * 50, "b" * 50 + "\n\nc"]
+
+
+def test_render_digest_truncates_long_line():
+    messages = render_digest([r"\." * 100], limit=80)
+    assert len(messages) == 1
+    assert len(messages[0]) <= 80
+    assert messages[0].endswith(r"\.…")
@@ -0,0 +1,44 @@
+"""
+
+test scheduler.py
+"""
+from rysolv_monitor.scheduler import PollScheduler, SchedulerOptions
+
+
+def test_scheduler_changed_issues_first_then_backoff():
+    scheduler = PollScheduler(SchedulerOptions(min_interval=30,
+                                               base_interval=300,
+                                               max_interval=1200),
+                              request_budget=1000)
+    scheduler.observe({"id": "cold"}, changed=False, watched=False, now=0)
+    scheduler.observe({"id": "hot"}, changed=True, watched=True, now=0)
+    assert scheduler.pop_due(now=0) == ["hot", "cold"]
+    scheduler.record("hot", changed=False, now=0)
+    scheduler.record("cold", changed=False, now=0)
+    # hot stays at min_interval, cold backs off from base_interval
+    assert scheduler.pop_due(now=30) == ["hot"]
+    scheduler.record("hot", changed=False, now=30)
+    assert scheduler.pop_due(now=599) == ["hot"]
+    assert "cold" in scheduler.pop_due(now=600)
+    scheduler.record("cold", changed=False, now=600)
+    assert "cold" not in scheduler.pop_due(now=1799)
+    assert scheduler.pop_due(now=1800) == ["cold"]
+
+
+def test_scheduler_changed_issue_is_due_now():
+    scheduler = PollScheduler(request_budget=1000)
+    scheduler.observe({"id": "a"}, changed=False, watched=False, now=0)
+    scheduler.pop_due(now=0)
+    scheduler.record("a", changed=False, now=0)
+    assert not scheduler.pop_due(now=10)
+    scheduler.observe({"id": "a"}, changed=True, watched=False, now=10)
+    assert scheduler.pop_due(now=10) == ["a"]
+
+
+def test_scheduler_budget_and_forget():
+    scheduler = PollScheduler(request_budget=2)
+    for _issue_id in "abcd":
+        scheduler.observe({"id": _issue_id, "open": False}, changed=False, watched=False, now=0)
+    assert len(scheduler.pop_due(now=0)) == 2
+    scheduler.forget({"c", "d"})
+    assert len(scheduler) == 2
@@ -0,0 +1,115 @@
+"""
+
+test snapshot.py
+"""
+import logging
+import time
+
+import pytest
+
+from rysolv_monitor.crawler import RysolvCrawler
+from rysolv_monitor.snapshot import SnapshotExhausted, SnapshotRecorder, SnapshotReplayer
+from rysolv_monitor.transport import QueryError
+
+ISSUES_QUERY = "query { getIssues { issues { id } } }"
+
+
+class _Transport:
+    """
+
+    transport double answering from a list of responses or exceptions
+    """
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.closed = False
+
+    def query(self, _query):
+        _response = self.responses.pop(0)
+        if isinstance(_response, Exception):
+            raise _response
+        return _response
+
+    def close(self):
+        self.closed = True
+
+
+def _record(path, exchanges):
+    transport = _Transport([_response for _, _response in exchanges])
+    recorder = SnapshotRecorder(transport, str(path), logging.getLogger("test"))
+    for _query, _ in exchanges:
+        try:
+            recorder.query(_query)
+        except QueryError:
+            pass
+    recorder.close()
+    assert transport.closed
+
+
+def _issues(*issue_ids):
+    return {"data": {"getIssues": {"issues": [{"id": _id} for _id in issue_ids]}}}
+
+
+def _comments(*bodies):
+    return {"data": {f"c{_index}": [{"body": _body}] for _index, _body in enumerate(bodies)}}
+
+
+def test_replay_sweeps_in_order(tmp_path):
+    """
+
+    test sweeps and errors are replayed in order until exhausted
+    :return:
+    """
+    path = tmp_path / "snapshot.jsonl.gz"
+    _record(path, [
+        (ISSUES_QUERY, _issues("a")),
+        (ISSUES_QUERY, QueryError("unavailable", 503)),
+        (ISSUES_QUERY, _issues("a", "b")),
+    ])
+    replayer = SnapshotReplayer(str(path), logging.getLogger("test"))
+    assert replayer.remaining == 3
+    assert replayer.query(ISSUES_QUERY) == _issues("a")
+    with pytest.raises(QueryError) as error:
+        replayer.query(ISSUES_QUERY)
+    assert error.value.status_code == 503
+    assert replayer.query(ISSUES_QUERY) == _issues("a", "b")
+    with pytest.raises(SnapshotExhausted):
+        replayer.query(ISSUES_QUERY)
+    with pytest.raises(QueryError):
+        replayer.query("query { unknown }")
+
+
+def test_replay_comments_by_issue(tmp_path):
+    """
+
+    test comments are answered per issue with the latest recorded batch
+    :return:
+    """
+    path = tmp_path / "snapshot.jsonl.gz"
+    _record(path, [
+        (ISSUES_QUERY, _issues("a", "b")),
+        (RysolvCrawler._comments_query(["a", "b"]), _comments("a1", "b1")),
+        (ISSUES_QUERY, _issues("a", "b")),
+        (RysolvCrawler._comments_query(["b"]), _comments("b2")),
+    ])
+    replayer = SnapshotReplayer(str(path), logging.getLogger("test"))
+    replayer.query(ISSUES_QUERY)
+    assert replayer.query(RysolvCrawler._comments_query(["b", "a", "c"])) == {
+        "data": {"c0": [{"body": "b1"}], "c1": [{"body": "a1"}], "c2": None}}
+    replayer.query(ISSUES_QUERY)
+    assert replayer.query(RysolvCrawler._comments_query(["a", "b"])) == _comments("a1", "b2")
+
+
+def test_replay_speed(tmp_path):
+    """
+
+    test sweeps are paced by their recorded offset divided by speed
+    :return:
+    """
+    path = tmp_path / "snapshot.jsonl.gz"
+    _record(path, [(ISSUES_QUERY, _issues("a")), (ISSUES_QUERY, _issues("b"))])
+    replayer = SnapshotReplayer(str(path), logging.getLogger("test"), speed=1.0)
+    replayer._sweeps[ISSUES_QUERY][1]["t"] = 0.2
+    _start = time.monotonic()
+    replayer.query(ISSUES_QUERY)
+    replayer.query(ISSUES_QUERY)
+    assert time.monotonic() - _start >= 0.2
@@ -0,0 +1,47 @@
+"""
+
+test stream.py
+"""
+import json
+
+import pytest
+
+from rysolv_monitor.stream import iter_array, StreamError
+
+BODY = json.dumps({"data": {"getIssues": {"__typename": "IssueArray", "issues": [
+    {"id": str(_index), "name": 'a "]}, b', "language": ["c", {"d": "]"}], "rep": 1.5}
+    for _index in range(20)
+]}}})
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 64, len(BODY)])
+def test_iter_array(chunk_size):
+    """
+
+    test items are parsed whatever the chunk boundaries
+    :return:
+    """
+    chunks = [BODY[_index:_index + chunk_size] for _index in range(0, len(BODY), chunk_size)]
+    assert list(iter_array(chunks, "issues")) == json.loads(BODY)["data"]["getIssues"]["issues"]
+
+
+def test_iter_array_split_number():
+    """
+
+    test a number split across chunks isn't yielded early
+    :return:
+    """
+    assert list(iter_array(['{"issues": [1, 2', '3 ]}'], "issues")) == [1, 23]
+    assert not list(iter_array(['{"issues": [ ]}'], "issues"))
+
+
+def test_iter_array_errors():
+    """
+
+    test missing and truncated arrays raise
+    :return:
+    """
+    with pytest.raises(StreamError):
+        list(iter_array(['{"data": {"getIssues": {"message": "error"}}}'], "issues"))
+    with pytest.raises(StreamError):
+        list(iter_array(['{"issues": [{"id": 1}, {"id"'], "issues"))
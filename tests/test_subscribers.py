@@ -0,0 +1,115 @@
+"""
+
+test subscribers.py
+"""
+import random
+
+from rysolv_monitor.subscribers import FilterIndex, SubscriberIndex
+from rysolv_monitor.types import Filter
+
+
+def _change(operation_type, _id, document=None):
+    return {"operationType": operation_type,
+            "documentKey": {"_id": _id},
+            "fullDocument": document}
+
+
+def test_subscriber_index_apply_change():
+    index = SubscriberIndex()
+    index.apply_change("Users", _change("insert", 1, {"user_id": 10}))
+    index.apply_change("Users", _change("insert", 2, {"user_id": 20}))
+    index.apply_change("WatchIssues", _change("insert", 3, {"user_id": 10, "issue_id": "a"}))
+    index.apply_change("WatchIssues", _change("insert", 4, {"user_id": 20, "issue_id": "a"}))
+    index.apply_change("WatchIssues", _change("update", 4, {"user_id": 20, "issue_id": "a"}))
+    assert sorted(index.users()) == [10, 20]
+    assert sorted(index.watchers("a")) == [10, 20]
+    assert index.watched_issues(20) == ["a"]
+
+    index.apply_change("Users", _change("delete", 2))
+    index.apply_change("WatchIssues", _change("delete", 4))
+    assert index.users() == [10]
+    assert index.watchers("a") == [10]
+    assert not index.watched_issues(20)
+    assert not index.watchers("b")
+
+
+class _Database:
+    """
+
+    database double
+    """
+    @staticmethod
+    def find_users():
+        return [{"_id": 1, "user_id": 10}]
+
+    @staticmethod
+    def find_watch_issues():
+        return [{"_id": 2, "user_id": 10, "issue_id": "a"}]
+
+    @staticmethod
+    def find_filters():
+        return []
+
+
+def test_subscriber_index_bootstrap():
+    index = SubscriberIndex()
+    index.apply_change("Users", _change("insert", 5, {"user_id": 50}))
+    index.bootstrap(_Database())
+    assert index.users() == [10]
+    assert index.watchers("a") == [10]
+    index.apply_change("WatchIssues", _change("delete", 2))
+    assert not index.watchers("a")
+
+
+def test_subscriber_index_recipients():
+    index = SubscriberIndex()
+    index.apply_change("Users", _change("insert", 1, {"user_id": 10}))
+    index.apply_change("Users", _change("insert", 2, {"user_id": 20}))
+    index.apply_change("Filters", _change("insert", 3, {"user_id": 20, "languages": ["go"]}))
+    # filter of an unregistered user
+    index.apply_change("Filters", _change("insert", 4, {"user_id": 30, "languages": ["go"]}))
+    assert index.recipients({"language": ["Python"]}) == [10]
+    assert sorted(index.recipients({"language": ["Go"]})) == [10, 20]
+    index.apply_change("Filters", _change("delete", 3))
+    assert sorted(index.recipients({"language": ["Python"]})) == [10, 20]
+    index.apply_change("Users", _change("delete", 2))
+    assert index.recipients({"language": ["Go"]}) == [10]
+
+
+def test_filter_index_matches_like_a_scan():
+    """
+
+    test inverted index matches the same users as matching every filter
+    :return:
+    """
+    _random = random.Random(0)
+    languages = ["python", "go", "rust", "c++"]
+    organizations = ["rysolv.com", "org.com"]
+    filters = [Filter(user_id=_user_id,
+                      languages=_random.sample(languages, _random.randint(0, 2)),
+                      organizations=_random.sample(organizations, _random.randint(0, 1)),
+                      types=_random.choice([[], ["bug"], ["feature"]]),
+                      min_funded=_random.choice([None, 10, 50]))
+               for _user_id in range(300)]
+    index = FilterIndex()
+    for _filter in filters:
+        index.add(_filter)
+    for _filter in filters[::3]:
+        index.remove(_filter.user_id)
+    filters = [_filter for _filter in filters if _filter.user_id in index]
+    for _ in range(50):
+        issue = {"language": [_value.upper() for _value in _random.sample(languages, 2)],
+                 "organizationName": _random.choice(organizations),
+                 "type": _random.choice(["bug", "feature"]),
+                 "fundedAmount": _random.choice([0, 10, 25, 100])}
+        assert sorted(index.match(issue)) == sorted(_filter.user_id for _filter in filters
+                                                    if _filter.matches(issue))
+
+
+def test_subscriber_index_digests():
+    index = SubscriberIndex()
+    index.apply_change("Users", _change("insert", 1, {"user_id": 10, "digest": 900}))
+    index.apply_change("Users", _change("insert", 2, {"user_id": 20, "digest": None}))
+    assert index.digests([10, 20, 30]) == {10: 900}
+    index.apply_change("Users", _change("update", 1, {"user_id": 10, "digest": None}))
+    assert not index.digests([10])
@@ -0,0 +1,95 @@
+"""
+
+test transport.py
+"""
+import json
+import logging
+
+import pytest
+import requests
+
+from rysolv_monitor.transport import RysolvTransport, QueryError, TransportOptions
+
+
+class _Response:
+    """
+
+    minimal requests.Response double
+    """
+    def __init__(self, status_code, body=None, headers=None):
+        self.status_code = status_code
+        self.encoding = None
+        self.reason = "reason"
+        self.headers = headers or {}
+        self._body = body
+
+    def json(self):
+        return self._body
+
+    def iter_content(self, chunk_size):
+        _body = json.dumps(self._body, ensure_ascii=False).encode("utf-8")
+        for _index in range(0, len(_body), chunk_size):
+            yield _body[_index:_index + chunk_size]
+
+    def close(self):
+        pass
+
+
+class _Session:
+    """
+
+    session double replaying a list of responses or exceptions
+    """
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def post(self, *_args, **_kwargs):
+        self.calls += 1
+        _response = self.responses.pop(0)
+        if isinstance(_response, Exception):
+            raise _response
+        return _response
+
+
+@pytest.fixture
+def transport(monkeypatch):
+    """
+
+    transport without backoff sleeps
+    """
+    monkeypatch.setattr("time.sleep", lambda _: None)
+    return RysolvTransport(logging.getLogger("test"), TransportOptions(max_retries=2))
+
+
+def test_query_retries_transient_errors(transport):
+    transport.session = _Session([requests.ConnectionError("reset"),
+                                  _Response(503),
+                                  _Response(200, {"data": {}})])
+    assert transport.query("query {}") == {"data": {}}
+    assert transport.session.calls == 3
+
+
+def test_query_gives_up_after_max_retries(transport):
+    transport.session = _Session([_Response(429), _Response(502), _Response(500)])
+    with pytest.raises(QueryError) as error:
+        transport.query("query {}")
+    assert error.value.status_code == 500
+
+
+def test_query_does_not_retry_client_errors(transport):
+    transport.session = _Session([_Response(400)])
+    with pytest.raises(QueryError):
+        transport.query("query {}")
+    assert transport.session.calls == 1
+
+
+def test_backoff_delay_honours_retry_after(transport):
+    assert 0 <= transport.backoff_delay(3) <= transport.options.backoff * 2 ** 3
+    assert transport.backoff_delay(0, retry_after=7) >= 7
+
+
+def test_stream_decodes_split_characters(transport):
+    transport.session = _Session([_Response(503), _Response(200, {"name": "é" * 10})])
+    assert json.loads("".join(transport.stream("query {}", chunk_size=3))) == {"name": "é" * 10}
+    assert transport.session.calls == 2
@@ -0,0 +1,21 @@
+"""
+
+test worker.py
+"""
+import time
+
+from rysolv_monitor.worker import Worker
+
+
+def test_worker_calls_step_until_stopped():
+    calls = []
+    worker = Worker(lambda: calls.append(time.monotonic()) or 0.01, "test")
+    worker.start()
+    worker.start()
+    while len(calls) < 3:
+        time.sleep(0.01)
+    worker.stop()
+    count = len(calls)
+    assert worker.wait(0)
+    time.sleep(0.05)
+    assert len(calls) == count